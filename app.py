@@ -1,25 +1,62 @@
 # app.py
+import time
+import logging
+import threading
+import functools
 import streamlit as st
-from config import APP_TITLE,DB_DIR,KB_DIR,UPLOAD_DIR,COLLECTION_NAME
+from config import (
+    APP_TITLE,DB_DIR,KB_DIR,UPLOAD_DIR,COLLECTION_NAME,FAQ,MANIFEST_PATH,JOBS_PATH,JOBS_POLL_S,METRICS_PORT,
+    LEXICAL_INDEX_PATH,LEXICAL_MAX_DF,VECTOR_STORE_DTYPE,VECTOR_STORE_PATH,VECTOR_RESCORE,
+    RERANK_MODEL,RERANK_MAX_BATCH,RERANK_BATCH_WINDOW_MS,RERANK_BUDGET_MS,OLLAMA_MAX_CONCURRENT,OLLAMA_PRIORITY_AGING_S,
+    EMBED_CACHE_PATH,EMBED_CACHE_MAX_MB,QUERY_CACHE_MAX_ENTRIES,ANSWER_CACHE_MAX_ENTRIES,
+    EXTRACT_WORKERS,EXTRACT_TIMEOUT_S,
+)
 from styles import APP_CSS
+from caches import EmbeddingCache,QueryEmbeddingCache,AnswerCache,SingleFlight
+from manifest import Manifest
+from lexical import LexicalIndex
+from vector_store import VectorStore
+from rerank import Reranker,load_cross_encoder
+from jobs import JobQueue
+from metrics import get_metrics
 
 from components.sidebar import render_sidebar
 from components.settings_dialog import render_settings_dialog
 
 from pages_ui.ask_page import render_ask_page
 from pages_ui.db_page import render_db_page
+from pages_ui.metrics_page import render_metrics_page
 
 from rag import (
     get_client,
-    get_collection,
-    ingest_uploaded_pdfs,
+    open_collection,
+    enqueue_uploaded_pdfs,
+    run_ingest_jobs,
     retrieve,
     build_prompt,
     chat_llm,
+    chat_llm_stream,
     clear_all,
+    delete_source,
     get_db_status,
+    get_collection_version,
+    prewarm_query_cache,
+    sync_manifest,
+    sync_lexical,
+    sync_vector_store,
+    get_scheduler,
 )
 
+_RUN_T0=time.perf_counter()
+
+# 啟動/rerun 計時 log（印在執行 streamlit 的終端機）
+log=logging.getLogger("rag_llama")
+if not log.handlers:
+    _h=logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    log.addHandler(_h)
+    log.setLevel(logging.INFO)
+
 st.set_page_config(page_title=APP_TITLE,layout="wide")
 
 # CSS
@@ -37,6 +74,7 @@ st.session_state.setdefault("pending_question","")
 st.session_state.setdefault("auto_ask",False)
 st.session_state.setdefault("q_input","")
 st.session_state.setdefault("show_settings",False)
+st.session_state.setdefault("last_delete",None)
 
 # settings defaults（避免沒設定就被 pages 使用）
 st.session_state.setdefault("llm_model","llama3.1")
@@ -45,10 +83,183 @@ st.session_state.setdefault("top_k",6)
 st.session_state.setdefault("chunk_size",800)
 st.session_state.setdefault("overlap",120)
 st.session_state.setdefault("temperature",0.2)
+st.session_state.setdefault("context_tokens",1500)
+st.session_state.setdefault("chunk_mode","char")
+st.session_state.setdefault("chunk_tokens",256)
+st.session_state.setdefault("overlap_tokens",32)
+st.session_state.setdefault("embed_batch_size",32)
+st.session_state.setdefault("embed_concurrency",4)
+st.session_state.setdefault("incremental_ingest",True)
+st.session_state.setdefault("hybrid_search",True)
+st.session_state.setdefault("rerank",False)
+st.session_state.setdefault("rerank_candidates",20)
+
+# DB：client / collection 整個 process 只開一次，所有 session、每次 rerun 共用
+# Chroma 的 PersistentClient 可以在同一個 process 的多個 thread 同時讀寫（每個 session 是一個 thread），
+# 但不要在別的 process 對同一個 DB_DIR 另外開 client 寫入（例如一邊跑 app 一邊用別的程式匯入）
+# 壓縮向量索引（config.VECTOR_STORE_DTYPE 有設才開）：整個 process 共用；開著時它是唯一存向量的地方，
+# Chroma 只放文字與 metadata（rag.open_collection，第一次開會把舊 collection 的向量搬過來）
+@st.cache_resource
+def _get_vector_store():
+    if not VECTOR_STORE_DTYPE:
+        return None
+    return VectorStore(str(VECTOR_STORE_PATH),dtype=VECTOR_STORE_DTYPE,rescore=VECTOR_RESCORE)
+
+vector_store=_get_vector_store()
+
+@st.cache_resource
+def _get_db():
+    t0=time.perf_counter()
+    client=get_client(str(DB_DIR))
+    collection=open_collection(client,COLLECTION_NAME,vector_store=vector_store,vectors_path=str(VECTOR_STORE_PATH))
+    log.info("chroma client + collection %s opened in %.1f ms",collection.name,(time.perf_counter()-t0)*1000)
+    return client,collection
+
+client,collection=_get_db()
+
+@st.cache_resource
+def _run_counter()->dict:
+    return {"runs":0,"lock":threading.Lock()}
+
+# Embedding 快取：整個 process 共用一份（命中/未命中次數才會跨 rerun 累計）
+@st.cache_resource
+def _get_embed_cache()->EmbeddingCache:
+    return EmbeddingCache(str(EMBED_CACHE_PATH),max_bytes=EMBED_CACHE_MAX_MB*1024*1024)
+
+embed_cache=_get_embed_cache()
+
+# 文件清單：同上，整個 process 共用
+@st.cache_resource
+def _get_manifest()->Manifest:
+    return Manifest(str(MANIFEST_PATH))
+
+manifest=_get_manifest()
+
+# 關鍵字索引：整個 process 共用；跟 collection 段數對不起來（舊資料庫第一次用）就在背景重建
+@st.cache_resource
+def _get_lexical()->LexicalIndex:
+    idx=LexicalIndex(str(LEXICAL_INDEX_PATH),max_df=LEXICAL_MAX_DF)
+    if idx.count()!=collection.count():
+        threading.Thread(target=sync_lexical,args=(collection,idx),name="lexical-rebuild",daemon=True).start()
+    return idx
+
+lexical=_get_lexical()
+
+# 壓縮向量索引跟 collection 段數對不起來（例如匯入途中當掉）：背景補齊，少的段落重新 embedding（快取有的不打 Ollama）
+@st.cache_resource
+def _repair_vector_store(embed_model:str):
+    if vector_store is None or vector_store.count()==collection.count():
+        return None
+    t=threading.Thread(
+        target=sync_vector_store,args=(collection,vector_store,embed_model),kwargs={"embed_cache":embed_cache},
+        name="vector-repair",daemon=True,
+    )
+    t.start()
+    return t
+
+_repair_vector_store(st.session_state.embed_model)
+
+# 背景匯入：工作表 + 一個 worker thread，整個 process 共用；rerun / 重新整理頁面都不會中斷匯入
+# 一次領一批同參數的工作，抽字交給 process pool（EXTRACT_WORKERS），不佔 Streamlit process 的 GIL
+@st.cache_resource
+def _get_jobs()->JobQueue:
+    runner=functools.partial(
+        run_ingest_jobs,collection=collection,embed_cache=embed_cache,manifest=manifest,lexical=lexical,vector_store=vector_store,
+        extract_workers=EXTRACT_WORKERS,extract_timeout=EXTRACT_TIMEOUT_S,
+    )
+    return JobQueue(str(JOBS_PATH),runner)
+
+jobs=_get_jobs()
+
+# 重新排序：模型只載一次、所有 session 共用一個合批 worker；沒裝 sentence-transformers 就是 None
+@st.cache_resource(show_spinner="載入重新排序模型…")
+def _get_reranker(model_name:str):
+    try:
+        score_fn=load_cross_encoder(model_name)
+    except Exception:
+        # 模型下載/載入失敗：當作沒有 reranker
+        return None
+    if score_fn is None:
+        return None
+    return Reranker(score_fn,max_batch=RERANK_MAX_BATCH,batch_window=RERANK_BATCH_WINDOW_MS/1000)
+
+reranker=_get_reranker(RERANK_MODEL) if st.session_state.rerank else None
+
+# 問題向量快取：同上，整個 process 共用
+@st.cache_resource
+def _get_query_cache()->QueryEmbeddingCache:
+    return QueryEmbeddingCache(max_entries=QUERY_CACHE_MAX_ENTRIES)
+
+query_cache=_get_query_cache()
+
+# 背景先把 FAQ 的問題向量算好；每個 embed 模型只跑一次，不擋住畫面
+@st.cache_resource
+def _prewarm_faq(embed_model:str)->threading.Thread:
+    def _run():
+        try:
+            prewarm_query_cache(query_cache,[q for items in FAQ.values() for q in items],embed_model)
+        except Exception:
+            # Ollama 還沒起來也沒關係，之後照常逐題計算
+            pass
+    t=threading.Thread(target=_run,name=f"faq-prewarm-{embed_model}",daemon=True)
+    t.start()
+    return t
+
+_prewarm_faq(st.session_state.embed_model)
+
+# 回答快取：key 含知識庫版本，匯入/清空之後自動作廢
+@st.cache_resource
+def _get_answer_cache()->AnswerCache:
+    return AnswerCache(max_entries=ANSWER_CACHE_MAX_ENTRIES)
+
+answer_cache=_get_answer_cache()
+
+# 同時提問合併：同一題（同回答快取的 key）正在跑時，其他 session 等同一份結果，不重複檢索/生成
+@st.cache_resource
+def _get_single_flight()->SingleFlight:
+    return SingleFlight()
+
+single_flight=_get_single_flight()
+
+# Ollama 請求排程：所有 session 共用一個佇列（rag 模組裡的單例），這裡只設上限與老化間隔
+scheduler=get_scheduler()
+scheduler.set_limit(OLLAMA_MAX_CONCURRENT)
+scheduler.set_aging(OLLAMA_PRIORITY_AGING_S)
+
+# 效能指標：整個 process 一份（metrics.get_metrics()）；排程器/匯入工作的狀態登記成 gauge，匯出時才讀
+metrics=get_metrics()
+
+@st.cache_resource
+def _setup_metrics():
+    def _queue():
+        s=get_scheduler().stats()
+        return {(("state","waiting"),):s["depth"],(("state","running"),):s["running"],(("state","limit"),):s["limit"]}
+
+    def _wait_p95():
+        return {(("priority",name),):p["wait_p95"] for name,p in get_scheduler().stats()["by_priority"].items()}
+
+    metrics.describe("rag_ollama_queue","Ollama requests waiting / running / allowed at once")
+    metrics.gauge("rag_ollama_queue",_queue)
+    metrics.describe("rag_ollama_wait_p95_seconds","Recent p95 scheduler wait per priority")
+    metrics.gauge("rag_ollama_wait_p95_seconds",_wait_p95)
+    metrics.describe("rag_ingest_jobs_active","Ingest jobs queued or running")
+    metrics.gauge("rag_ingest_jobs_active",lambda:{():jobs.active_count()})
+    if METRICS_PORT:
+        try:
+            return metrics.start_http_exporter(METRICS_PORT)
+        except OSError as e:
+            # port 被占用（例如開了兩個 app）：指標頁照常可用
+            log.warning("metrics exporter on port %s not started: %s",METRICS_PORT,e)
+    return None
+
+_setup_metrics()
 
-# DB
-client=get_client(str(DB_DIR))
-collection=get_collection(client,COLLECTION_NAME)
+# 第一次（cold）要開 DB、載入各種快取；之後（warm）應該只剩幾毫秒
+_rc=_run_counter()
+with _rc["lock"]:
+    _rc["runs"]+=1
+    _run_no=_rc["runs"]
+log.info("%s run #%d: resources ready in %.1f ms","cold" if _run_no==1 else "warm",_run_no,(time.perf_counter()-_RUN_T0)*1000)
 
 # Sidebar
 render_sidebar(APP_TITLE)
@@ -57,19 +268,37 @@ render_sidebar(APP_TITLE)
 render_settings_dialog()
 
 # Router
-if st.session_state.page=="資料庫":
+if st.session_state.page=="指標":
+    render_metrics_page(metrics,scheduler=scheduler,exporter_port=METRICS_PORT)
+elif st.session_state.page=="資料庫":
     render_db_page(
-        ingest_uploaded_pdfs_fn=ingest_uploaded_pdfs,
-        clear_all_fn=clear_all,
+        clear_all_fn=functools.partial(clear_all,vector_store=vector_store),
         get_db_status_fn=get_db_status,
         collection=collection,
         upload_dir=str(UPLOAD_DIR),
+        embed_cache=embed_cache,
+        manifest=manifest,
+        sync_manifest_fn=sync_manifest,
+        delete_source_fn=functools.partial(delete_source,vector_store=vector_store),
+        lexical=lexical,
+        jobs=jobs,
+        enqueue_fn=enqueue_uploaded_pdfs,
+        jobs_poll_s=JOBS_POLL_S,
     )
 else:
     render_ask_page(
-        retrieve_fn=retrieve,
+        retrieve_fn=functools.partial(retrieve,vector_store=vector_store),
         build_prompt_fn=build_prompt,
         chat_fn=chat_llm,
+        chat_stream_fn=chat_llm_stream,
         collection=collection,
         get_db_status_fn=get_db_status,
+        query_cache=query_cache,
+        answer_cache=answer_cache,
+        get_version_fn=get_collection_version,
+        lexical=lexical,
+        reranker=reranker,
+        rerank_budget=RERANK_BUDGET_MS/1000,
+        scheduler=scheduler,
+        single_flight=single_flight,
     )
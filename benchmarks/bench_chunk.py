@@ -0,0 +1,186 @@
+# benchmarks/bench_chunk.py
+"""
+切段（chunking）效能與正確性
+
+- 黃金比對：新版 rag._smart_chunk 的輸出必須跟舊版遞迴實作（下面的 legacy_smart_chunk）一字不差，
+  並檢查 rag._chunk_spans 回傳的位置真的對得回原文
+- 效能：KnowledgeBase/policies 的 PDF，以及三種 1 MB 的合成頁面，回報 MB/s
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_chunk              # 比對 + 效能
+    python -m benchmarks.bench_chunk --fuzz 50000 # 多跑隨機比對
+"""
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import List
+
+import rag
+from rag import _normalize_text
+from pdf_extract import extract_pdf_pages
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+
+
+def legacy_smart_chunk(text:str,chunk_size:int=800,overlap:int=120)->List[str]:
+    # 舊版實作原封不動保留，當作黃金標準
+    text=_normalize_text(text)
+    if not text:
+        return []
+
+    seps=["\n\n","\n",". ","。","！","？"," "]
+    chunks=[]
+
+    def split_rec(s:str,sep_idx:int)->None:
+        if len(s)<=chunk_size:
+            chunks.append(s.strip())
+            return
+        if sep_idx>=len(seps):
+            chunks.append(s[:chunk_size].strip())
+            rest=s[chunk_size:]
+            if rest.strip():
+                split_rec(rest,sep_idx)
+            return
+
+        sep=seps[sep_idx]
+        parts=s.split(sep)
+        buf=""
+        for p in parts:
+            candidate=(buf+(sep if buf else "")+p).strip()
+            if len(candidate)<=chunk_size:
+                buf=candidate
+            else:
+                if buf:
+                    split_rec(buf,sep_idx+1)
+                buf=p.strip()
+        if buf:
+            split_rec(buf,sep_idx+1)
+
+    split_rec(text,0)
+    chunks=[c for c in chunks if c]
+
+    if overlap>0 and len(chunks)>1:
+        out=[]
+        prev=""
+        for c in chunks:
+            if prev:
+                tail=prev[-overlap:]
+                out.append((tail+"\n"+c).strip())
+            else:
+                out.append(c)
+            prev=c
+        return out
+    return chunks
+
+
+def _policy_pages()->List[str]:
+    pages=[]
+    for pdf in sorted(POLICIES_DIR.glob("*.pdf")):
+        pages.extend(t for _,t in extract_pdf_pages(str(pdf)))
+    return pages
+
+
+def _synthetic_pages(size:int,seed:int=0)->dict:
+    rnd=random.Random(seed)
+    cjk="員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理"
+    # 中文段落：有句號、換行、空段
+    buf=[]
+    n=0
+    while n<size:
+        s="".join(rnd.choice(cjk) for _ in range(rnd.randint(8,60)))+rnd.choice("。。。！？；")
+        if rnd.random()<0.15:
+            s+="\n" if rnd.random()<0.7 else "\n\n"
+        buf.append(s)
+        n+=len(s)
+    cjk_prose="".join(buf)[:size]
+    # 英文：只有空白與句點
+    words=["policy","leave","overtime","approval","salary","employee","manager","days","hours"]
+    buf=[]
+    n=0
+    while n<size:
+        w=rnd.choice(words)+(". " if rnd.random()<0.08 else " ")
+        buf.append(w)
+        n+=len(w)
+    latin="".join(buf)[:size]
+    # 完全沒有分隔符號的中文（掃描 OCR 常見）：舊版要硬切上千層遞迴
+    no_sep="".join(rnd.choice(cjk) for _ in range(size))
+    return {"cjk_prose":cjk_prose,"latin_words":latin,"cjk_no_separator":no_sep}
+
+
+def _fuzz(n:int,seed:int=1)->int:
+    alpha=list("ab ．.。！？\n　\t 中文字x. ")+["\n\n",". ",". \n"," \n","\n \n"]
+    rnd=random.Random(seed)
+    for _ in range(n):
+        t="".join(rnd.choice(alpha) for _ in range(rnd.randint(0,160)))
+        cs=rnd.randint(1,60)
+        ov=rnd.choice([0,0,1,3,10,50])
+        _check_one(t,cs,ov)
+    return n
+
+
+def _check_one(text:str,chunk_size:int,overlap:int)->None:
+    want=legacy_smart_chunk(text,chunk_size,overlap)
+    got=rag._smart_chunk(text,chunk_size,overlap)
+    assert got==want,f"輸出不一致：chunk_size={chunk_size} overlap={overlap} text={text[:80]!r}"
+    norm=_normalize_text(text)
+    for c in rag._chunk_spans(norm,chunk_size,overlap):
+        core=c.text[c.head:]
+        span=norm[c.start:c.end]
+        # 位置區間的頭尾字元必須對得上；中間只可能少掉被 strip 的空白
+        assert span[:1]==core[:1] and span[-1:]==core[-1:],"位置對不回原文"
+        assert len(core)<=len(span)
+
+
+def _rate(fn,pages:List[str],repeat:int)->float:
+    total=sum(len(p.encode("utf-8")) for p in pages)*repeat
+    t0=time.perf_counter()
+    for _ in range(repeat):
+        for p in pages:
+            fn(p)
+    dt=time.perf_counter()-t0
+    return total/1024/1024/dt if dt>0 else float("inf")
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunk-size",type=int,default=800)
+    ap.add_argument("--overlap",type=int,default=120)
+    ap.add_argument("--synthetic-mb",type=float,default=1.0)
+    ap.add_argument("--fuzz",type=int,default=5000,help="隨機比對次數")
+    ap.add_argument("--repeat",type=int,default=20,help="policies 語料重複次數（語料很小）")
+    args=ap.parse_args(argv)
+
+    policies=_policy_pages()
+    synthetic=_synthetic_pages(int(args.synthetic_mb*1024*1024))
+
+    # ---- 黃金比對 ----
+    for cs,ov in [(args.chunk_size,args.overlap),(200,0),(400,60),(1200,200)]:
+        for p in policies:
+            _check_one(p,cs,ov)
+    for name,page in synthetic.items():
+        if name=="cjk_no_separator":
+            continue
+        _check_one(page,args.chunk_size,args.overlap)
+    print(f"golden: policies {len(policies)} pages x 4 settings OK, synthetic OK, fuzz {_fuzz(args.fuzz)} cases OK")
+
+    # ---- 效能 ----
+    new=lambda t:rag._chunk_spans(t,args.chunk_size,args.overlap)
+    old=lambda t:legacy_smart_chunk(t,args.chunk_size,args.overlap)
+    print(f"{'corpus':<18} {'MB':>7} {'legacy MB/s':>12} {'new MB/s':>10}")
+    mb=sum(len(p.encode("utf-8")) for p in policies)/1024/1024
+    print(f"{'policies':<18} {mb*args.repeat:>7.2f} {_rate(old,policies,args.repeat):>12.2f} {_rate(new,policies,args.repeat):>10.2f}")
+    for name,page in synthetic.items():
+        mb=len(page.encode("utf-8"))/1024/1024
+        try:
+            legacy=f"{_rate(old,[page],1):>12.2f}"
+        except RecursionError:
+            legacy=f"{'RecursionErr':>12}"
+        print(f"{name:<18} {mb:>7.2f} {legacy} {_rate(new,[page],1):>10.2f}")
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# benchmarks/bench_chunk_modes.py
+"""
+字數切段 vs token 切段：chunk 大小（token 數）分布、檢索命中率、匯入吞吐量
+
+- 語料：KnowledgeBase/policies 的 PDF
+- 查詢：從語料裡抽出的句子（去掉頭尾各 1 字）；top-k 裡有任何一段涵蓋該句（同頁、位置重疊）就算命中
+- embedding：benchmarks.stub_ollama.stub_embedding（字元 bigram hashing，不需要 Ollama）
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_chunk_modes
+    python -m benchmarks.bench_chunk_modes --chunk-size 600 --overlap 80 --chunk-tokens 192 --overlap-tokens 24
+"""
+import sys
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+
+import rag
+from pdf_extract import extract_pdf_pages
+from tokenizer import count_tokens
+from benchmarks.stub_ollama import stub_embedding
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+
+
+def _pages():
+    out=[]
+    for pdf in sorted(POLICIES_DIR.glob("*.pdf")):
+        for page_no,text in extract_pdf_pages(str(pdf)):
+            out.append((pdf.name,page_no,text))
+    return out
+
+
+def _queries(pages,n:int,seed:int=0):
+    rnd=random.Random(seed)
+    pool=[]
+    for pid,(_,_,text) in enumerate(pages):
+        for a,b,_,tok in rag._text_units(text):
+            if tok>=12:
+                pool.append((pid,a,b))
+    rnd.shuffle(pool)
+    out=[]
+    for pid,a,b in pool[:n]:
+        text=pages[pid][2]
+        out.append((text[a+1:b-1],pid,a,b))
+    return out
+
+
+def _dot(a,b):
+    return sum(x*y for x,y in zip(a,b))
+
+
+def _run(mode:str,size:int,overlap:int,pages,queries,top_k:int):
+    t0=time.perf_counter()
+    chunks=[]
+    for pid,(_,_,text) in enumerate(pages):
+        for c in rag._chunk_page(text,size,overlap,chunk_mode=mode):
+            chunks.append((pid,c))
+    t_chunk=time.perf_counter()-t0
+
+    t0=time.perf_counter()
+    vecs=[stub_embedding(c.text) for _,c in chunks]
+    t_embed=time.perf_counter()-t0
+
+    toks=[count_tokens(c.text) for _,c in chunks]
+    hit1=0
+    hitk=0
+    for q,pid,a,b in queries:
+        qv=stub_embedding(q)
+        order=sorted(range(len(chunks)),key=lambda i:-_dot(qv,vecs[i]))[:top_k]
+        ok=[chunks[i][0]==pid and chunks[i][1].start-chunks[i][1].head<b and a<chunks[i][1].end for i in order]
+        hit1+=1 if ok[:1]==[True] else 0
+        hitk+=1 if any(ok) else 0
+
+    mb=sum(len(t.encode("utf-8")) for _,_,t in pages)/1024/1024
+    return {
+        "chunks":len(chunks),
+        "tok_mean":statistics.mean(toks),
+        "tok_std":statistics.pstdev(toks),
+        "tok_max":max(toks),
+        "hit1":hit1/len(queries),
+        "hitk":hitk/len(queries),
+        "chunk_mbps":mb/t_chunk if t_chunk>0 else float("inf"),
+        "ingest_cps":len(chunks)/(t_chunk+t_embed),
+    }
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunk-size",type=int,default=800)
+    ap.add_argument("--overlap",type=int,default=120)
+    ap.add_argument("--chunk-tokens",type=int,default=256)
+    ap.add_argument("--overlap-tokens",type=int,default=32)
+    ap.add_argument("--queries",type=int,default=200)
+    ap.add_argument("--top-k",type=int,default=6)
+    args=ap.parse_args(argv)
+
+    pages=_pages()
+    queries=_queries(pages,args.queries)
+    print(f"pages={len(pages)} queries={len(queries)} top_k={args.top_k}")
+    print(f"{'mode':<16} {'chunks':>6} {'tok mean':>9} {'tok std':>8} {'tok max':>8} {'hit@1':>6} {f'hit@{args.top_k}':>6} {'chunk MB/s':>11} {'ingest chunks/s':>16}")
+    for label,mode,size,ov in [
+        (f"char {args.chunk_size}/{args.overlap}","char",args.chunk_size,args.overlap),
+        (f"token {args.chunk_tokens}/{args.overlap_tokens}","token",args.chunk_tokens,args.overlap_tokens),
+    ]:
+        r=_run(mode,size,ov,pages,queries,args.top_k)
+        print(
+            f"{label:<16} {r['chunks']:>6} {r['tok_mean']:>9.1f} {r['tok_std']:>8.1f} {r['tok_max']:>8} "
+            f"{r['hit1']:>6.2f} {r['hitk']:>6.2f} {r['chunk_mbps']:>11.2f} {r['ingest_cps']:>16.1f}"
+        )
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
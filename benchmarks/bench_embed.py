@@ -0,0 +1,93 @@
+# benchmarks/bench_embed.py
+"""
+批次 embedding 吞吐量：batch size 1 / 16 / 64 × 並行數，回報 chunks/sec
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_embed
+    python -m benchmarks.bench_embed --chunks 4000 --latency-ms 10
+    python -m benchmarks.bench_embed --concurrency 1,4,8
+    python -m benchmarks.bench_embed --no-batch   # 模擬不支援 /api/embed 的伺服器（走逐筆 fallback）
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from benchmarks.stub_ollama import start_stub_server,server_url,stub_embedding
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+
+
+def _corpus_chunks(n:int,chunk_size:int,overlap:int):
+    import rag
+    from pdf_extract import extract_pdf_pages
+    chunks=[]
+    for pdf in sorted(POLICIES_DIR.glob("*.pdf")):
+        for _,text in extract_pdf_pages(str(pdf)):
+            chunks.extend(rag._smart_chunk(text,chunk_size=chunk_size,overlap=overlap))
+    if not chunks:
+        chunks=[f"第{i}條 合成測試段落。"*20 for i in range(64)]
+    out=[]
+    while len(out)<n:
+        out.extend(chunks)
+    return out[:n]
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks",type=int,default=2000)
+    ap.add_argument("--batch-sizes",default="1,16,64")
+    ap.add_argument("--concurrency",default="1",help="同時在途的 request 數（逗號分隔可跑多組）")
+    ap.add_argument("--latency-ms",type=float,default=5.0,help="每個 request 的固定延遲")
+    ap.add_argument("--item-latency-ms",type=float,default=0.5,help="每段文字額外延遲")
+    ap.add_argument("--chunk-size",type=int,default=800)
+    ap.add_argument("--overlap",type=int,default=120)
+    ap.add_argument("--no-batch",action="store_true",help="伺服器不支援 /api/embed")
+    args=ap.parse_args(argv)
+
+    srv=start_stub_server(
+        request_latency=args.latency_ms/1000.0,
+        item_latency=args.item_latency_ms/1000.0,
+        support_batch=not args.no_batch,
+    )
+    # ollama 的預設 client 在 import 時讀 OLLAMA_HOST，所以要先設好再 import rag
+    os.environ["OLLAMA_HOST"]=server_url(srv)
+    import rag
+
+    texts=_corpus_chunks(args.chunks,args.chunk_size,args.overlap)
+    expected=[stub_embedding(t) for t in texts[:32]]
+    print(f"chunks={len(texts)} request_latency={args.latency_ms}ms item_latency={args.item_latency_ms}ms batch_api={'off' if args.no_batch else 'on'}")
+    print(f"{'batch':>6} {'conc':>5} {'seconds':>9} {'chunks/s':>10} {'requests':>9} {'speedup':>8}")
+
+    items=[(str(i),t,{}) for i,t in enumerate(texts)]
+    base=None
+    for bs in [int(x) for x in args.batch_sizes.split(",") if x.strip()]:
+        for conc in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+            rag._NO_BATCH_MODELS.clear()
+            # 每個 request 都要拿排程器的名額；上限不跟著設的話，並行數超過預設上限的那幾組量到的其實是排隊
+            rag.get_scheduler().set_limit(conc)
+            before=srv.requests
+            t0=time.perf_counter()
+            embs=[]
+            for _,_,_,batch_embs in rag._iter_embedded(items,"stub-embed",batch_size=bs,concurrency=conc):
+                embs.extend(batch_embs)
+            dt=time.perf_counter()-t0
+            reqs=srv.requests-before
+
+            # 順序必須跟輸入一致
+            assert len(embs)==len(texts)
+            for a,b in zip(embs[:32],expected):
+                assert max(abs(x-y) for x,y in zip(a,b))<1e-6,"embedding 順序錯了"
+
+            rate=len(texts)/dt if dt>0 else float("inf")
+            base=base or rate
+            print(f"{bs:>6} {conc:>5} {dt:>9.3f} {rate:>10.1f} {reqs:>9} {rate/base:>7.1f}x")
+
+    srv.shutdown()
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
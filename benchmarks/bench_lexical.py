@@ -0,0 +1,129 @@
+# benchmarks/bench_lexical.py
+"""
+關鍵字索引（lexical.LexicalIndex）在大量 chunk 時的查詢延遲
+
+- 語料：把 KnowledgeBase/policies 的句子隨機重組成 N 段（每段約 chunk_chars 字），
+  每段再塞一個隨機條號與金額，模擬使用者最常查的「第幾條」「多少元」
+- 查詢：隨機挑一段，取其中一句的片段（含條號/金額）；看該段有沒有在前 10 名
+- 索引檔建一次就留著（--index 指定路徑），第二次跑同樣參數會直接沿用
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_lexical                        # 20 萬段
+    python -m benchmarks.bench_lexical --chunks 1000000       # 百萬段（建索引要一段時間）
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tempfile
+from pathlib import Path
+
+from lexical import LexicalIndex
+from rag import _text_units
+from pdf_extract import extract_pdf_pages
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+
+
+def _sentences():
+    out=[]
+    for pdf in sorted(POLICIES_DIR.glob("*.pdf")):
+        for _,text in extract_pdf_pages(str(pdf)):
+            for a,b,_,_ in _text_units(text):
+                if b-a>=6:
+                    out.append(text[a:b])
+    return out
+
+
+def _make_chunk(rnd:random.Random,sents,i:int,chunk_chars:int):
+    parts=[]
+    n=0
+    while n<chunk_chars:
+        s=rnd.choice(sents)
+        parts.append(s)
+        n+=len(s)
+    art=rnd.randint(1,400)
+    amount=rnd.randint(1000,999999)
+    marker=f"依第{art}條規定，補助金額為{amount:,}元。"
+    parts.insert(rnd.randint(0,len(parts)),marker)
+    return f"c{i}","".join(parts),f"doc{i//20}.pdf",marker
+
+
+def _build(idx:LexicalIndex,n:int,chunk_chars:int,seed:int,batch:int=2000):
+    rnd=random.Random(seed)
+    sents=_sentences()
+    t0=time.perf_counter()
+    buf=[]
+    for i in range(n):
+        cid,doc,src,_=_make_chunk(rnd,sents,i,chunk_chars)
+        buf.append((cid,doc,src))
+        if len(buf)>=batch:
+            idx.add([x[0] for x in buf],[x[1] for x in buf],[x[2] for x in buf])
+            buf=[]
+        if (i+1)%100000==0:
+            print(f"  indexed {i+1} chunks ({time.perf_counter()-t0:.0f}s)",flush=True)
+    if buf:
+        idx.add([x[0] for x in buf],[x[1] for x in buf],[x[2] for x in buf])
+    return time.perf_counter()-t0
+
+
+def _queries(n_chunks:int,chunk_chars:int,seed:int,n:int):
+    # 重新產生同一批 chunk（同 seed），只留被抽到的那幾段
+    rnd=random.Random(seed)
+    sents=_sentences()
+    pick=set(random.Random(seed+1).sample(range(n_chunks),n))
+    out=[]
+    for i in range(n_chunks):
+        cid,doc,_,marker=_make_chunk(rnd,sents,i,chunk_chars)
+        if i in pick:
+            # 條號 + 金額（精確查詢），以及 marker 前後各帶一點上下文
+            out.append((cid,marker[1:marker.index("，")]+"、"+marker[marker.index("為")+1:-1]))
+    return out
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks",type=int,default=200000)
+    ap.add_argument("--chunk-chars",type=int,default=300)
+    ap.add_argument("--queries",type=int,default=200)
+    ap.add_argument("--top-k",type=int,default=10)
+    ap.add_argument("--seed",type=int,default=0)
+    ap.add_argument("--index",default="",help="索引檔路徑（預設放在暫存資料夾）")
+    args=ap.parse_args(argv)
+
+    path=args.index or os.path.join(tempfile.gettempdir(),f"bench_lexical_{args.chunks}_{args.chunk_chars}_{args.seed}.sqlite3")
+    idx=LexicalIndex(path)
+    if idx.count()!=args.chunks:
+        print(f"building index: {args.chunks} chunks -> {path}")
+        idx.clear()
+        secs=_build(idx,args.chunks,args.chunk_chars,args.seed)
+        print(f"build: {secs:.1f}s ({args.chunks/secs:,.0f} chunks/s)")
+    size_mb=os.path.getsize(path)/1024/1024
+
+    queries=_queries(args.chunks,args.chunk_chars,args.seed,args.queries)
+    # 先熱身（page cache）
+    for _,q in queries[:20]:
+        idx.search(q,args.top_k)
+
+    lat=[]
+    hits=0
+    for cid,q in queries:
+        t0=time.perf_counter()
+        res=idx.search(q,args.top_k)
+        lat.append((time.perf_counter()-t0)*1000)
+        hits+=1 if cid in [r[0] for r in res] else 0
+    lat.sort()
+    p=lambda x:lat[min(len(lat)-1,int(len(lat)*x))]
+    print(f"chunks={args.chunks:,} index={size_mb:,.0f} MB queries={len(queries)} example={queries[0][1]!r}")
+    print(
+        f"latency ms: mean {statistics.mean(lat):.2f}  p50 {p(0.5):.2f}  p95 {p(0.95):.2f}  p99 {p(0.99):.2f}"
+        f"   hit@{args.top_k} {hits/len(queries):.2f}"
+    )
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# benchmarks/bench_prompt.py
+"""
+build_prompt：相鄰段落合併 + 去掉 overlap + context token 上限，prompt 少了多少 token、prefill 省多少時間
+
+- 語料：KnowledgeBase/policies 匯入暫存的 Chroma（預設 800/120 字數切段）
+- 問題：config.FAQ 全部，每題 retrieve top_k 段，分別用舊版 / 新版 build_prompt 組 prompt
+- 預設用假的 Ollama（stub_ollama）做 embedding，prefill 時間用 --prefill-tps（CPU 上 llama3.1 8B 大約每秒幾十個 token）估算
+- --real：用真的 Ollama（OLLAMA_HOST）做 embedding 與生成，實測 prompt_eval_duration（num_predict=1，只量 prefill），
+  並拿 Ollama 回報的 prompt_eval_count 跟 tokenizer.count_tokens 的估算比（含 chat template 的固定 token）
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_prompt
+    python -m benchmarks.bench_prompt --top-k 8 --context-tokens 1000
+    python -m benchmarks.bench_prompt --real --llm-model llama3.1 --embed-model nomic-embed-text
+"""
+import os
+import sys
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import Tuple
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+
+
+def legacy_build_prompt(question,hits):
+    # 改版前的 build_prompt（原樣保留，當對照組）
+    ctx_lines=[]
+    src_lines=[]
+    for i,h in enumerate(hits,start=1):
+        src=h.meta.get("source","unknown")
+        page=h.meta.get("page",None)
+        src_label=f"{src}（第{page}頁）" if page else src
+        src_lines.append(f"[{i}] {src_label}")
+        ctx_lines.append(f"[{i}] {h.text}")
+
+    sources="\n".join(src_lines) if src_lines else "(no sources)"
+    context="\n\n".join(ctx_lines) if ctx_lines else "(no context found)"
+
+    system=(
+        "You are a reliable assistant. Answer using ONLY the provided context. "
+        "If the context is insufficient, say you don't have enough information. "
+        "Cite sources like [1], [2]."
+    )
+    user=(
+        f"Sources:\n{sources}\n\n"
+        f"Context:\n{context}\n\n"
+        f"Question:\n{question}\n\n"
+        "Answer in Traditional Chinese. Keep it concise and actionable."
+    )
+    return system,user
+
+
+def _prefill(ollama,model:str,system:str,user:str)->Tuple[float,int]:
+    # (prefill 秒數, 模型實際的 prompt token 數)
+    r=ollama.chat(
+        model=model,
+        messages=[{"role":"system","content":system},{"role":"user","content":user}],
+        options={"temperature":0,"num_predict":1},
+    )
+    return (r.get("prompt_eval_duration") or 0)/1e9,int(r.get("prompt_eval_count") or 0)
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--top-k",type=int,default=6)
+    ap.add_argument("--chunk-size",type=int,default=800)
+    ap.add_argument("--overlap",type=int,default=120)
+    ap.add_argument("--context-tokens",type=int,default=1500)
+    ap.add_argument("--prefill-tps",type=float,default=40.0,help="估算用：每秒 prefill 幾個 token")
+    ap.add_argument("--real",action="store_true",help="用真的 Ollama 實測 prefill 時間")
+    ap.add_argument("--llm-model",default="llama3.1")
+    ap.add_argument("--embed-model",default="nomic-embed-text")
+    args=ap.parse_args(argv)
+
+    if not args.real:
+        from benchmarks.stub_ollama import start_stub_server,server_url
+        srv=start_stub_server(request_latency=0.0,item_latency=0.0)
+        os.environ["OLLAMA_HOST"]=server_url(srv)
+
+    import ollama
+    import rag
+    from config import FAQ
+    from tokenizer import count_tokens
+
+    client=rag.get_client(tempfile.mkdtemp(prefix="bench_prompt_"))
+    col=rag.get_collection(client,"bench_prompt")
+    pdfs=sorted(str(p) for p in POLICIES_DIR.glob("*.pdf"))
+    rag.ingest_pdf_paths(pdfs,str(ROOT/"KnowledgeBase"),col,args.embed_model,args.chunk_size,args.overlap)
+    questions=[q for items in FAQ.values() for q in items]
+
+    rows=[]
+    for q in questions:
+        hits=rag.retrieve(q,col,args.embed_model,top_k=args.top_k)
+        s0,u0=legacy_build_prompt(q,hits)
+        merged={}
+        s1,u1=rag.build_prompt(q,hits,stats=merged)
+        budget={}
+        s2,u2=rag.build_prompt(q,hits,max_context_tokens=args.context_tokens,stats=budget)
+        row={
+            "legacy":count_tokens(s0)+count_tokens(u0),
+            "merged":merged["prompt_tokens"],
+            "budget":budget["prompt_tokens"],
+            "blocks":len(merged["hits"]),
+            "hits":len(hits),
+        }
+        if args.real:
+            # 交錯量，避免 Ollama 的 prompt cache 偏向某一邊
+            row["legacy_s"],row["legacy_real"]=_prefill(ollama,args.llm_model,s0,u0)
+            row["budget_s"],row["budget_real"]=_prefill(ollama,args.llm_model,s2,u2)
+        rows.append(row)
+
+    def _mean(k):
+        return statistics.mean(r[k] for r in rows)
+
+    legacy,merged,budget=_mean("legacy"),_mean("merged"),_mean("budget")
+    print(f"questions={len(rows)} top_k={args.top_k} chunk={args.chunk_size}/{args.overlap} context_tokens={args.context_tokens}")
+    print(f"hits/question {_mean('hits'):.1f} -> blocks after merge {_mean('blocks'):.1f}")
+    print(f"{'prompt':<28} {'tokens (mean)':>14} {'vs legacy':>10} {'p95':>6}")
+    for label,key,m in [("legacy",'legacy',legacy),("merge + strip overlap",'merged',merged),(f"+ budget {args.context_tokens}",'budget',budget)]:
+        vals=sorted(r[key] for r in rows)
+        print(f"{label:<28} {m:>14.0f} {(m/legacy-1)*100:>9.1f}% {vals[int(len(vals)*0.95)-1]:>6}")
+    if args.real:
+        ls,bs=_mean("legacy_s"),_mean("budget_s")
+        print(f"measured prefill ({args.llm_model}): legacy {ls:.2f}s -> new {bs:.2f}s  (saved {ls-bs:.2f}s/question)")
+        # Ollama 的 prompt cache 命中時，prompt_eval_count 可能只算沒命中的部分（比值偏低）：min 很低時看 mean / max
+        pairs=[(r[k],r[k+"_real"]) for r in rows for k in ("legacy","budget") if r[k+"_real"]>0]
+        if pairs:
+            ratios=sorted(real/est for est,real in pairs)
+            print(f"token estimate vs {args.llm_model} prompt_eval_count: real/estimated mean {statistics.mean(ratios):.2f}"
+                  f"  min {ratios[0]:.2f}  max {ratios[-1]:.2f}  (n={len(pairs)})")
+    else:
+        print(f"estimated prefill @ {args.prefill_tps:g} tok/s: legacy {legacy/args.prefill_tps:.1f}s -> new {budget/args.prefill_tps:.1f}s"
+              f"  (saved {(legacy-budget)/args.prefill_tps:.1f}s/question)")
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# benchmarks/bench_retrieval.py
+"""
+檢索品質 / 延遲 / 匯入成本：在參數組合（chunk size × overlap × top_k × 純向量/混合）上跑一遍，調 DEFAULT_TOP_K 等預設值用
+
+- 語料：KnowledgeBase/policies 的 PDF，每組參數匯入一個全新的暫存 Chroma（rag.ingest_pdf_path，跟 app 同一條路）
+- 題目：config.FAQ 的問題 + benchmarks/labels.json 的補充題；labels.json 標了每題答案在哪些 PDF 的哪幾頁
+- 指標（頁為單位：top-k 裡有段落落在標註的頁就算找到那一頁）：
+  - recall@k：標註的頁找到幾成（每題平均）
+  - hit@k：至少找到一頁的題目比例
+  - MRR：第一個命中段落排名的倒數（沒命中算 0）
+  - 查詢延遲 p50 / p95（整個 retrieve：問題 embedding + 向量查詢 + 關鍵字查詢）
+  - 匯入吞吐量（chunks/s，不含抽字；抽字只做一次，另外印）、索引大小（Chroma 目錄 + 關鍵字索引）
+- embedding：預設用假的 Ollama（benchmarks.stub_ollama，字元 bigram hashing，結果固定，不需要 Ollama，CI 可跑）；
+  --real 改用真的 Ollama（OLLAMA_HOST）和 --embed-model，數字才代表實際的檢索品質
+- 沒有用 query / embedding 快取，每題都真的算一次
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --chunk-sizes 400,800,1200 --overlaps 60,120 --top-ks 3,6,10
+    python -m benchmarks.bench_retrieval --real --embed-model nomic-embed-text --json > retrieval.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT=Path(__file__).resolve().parent.parent
+POLICIES_DIR=ROOT/"KnowledgeBase"/"policies"
+LABELS_PATH=Path(__file__).resolve().parent/"labels.json"
+
+
+def _ints(s:str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _pct(vals,q:float)->float:
+    s=sorted(vals)
+    return s[min(len(s)-1,int(q*len(s)))] if s else 0.0
+
+
+def _dir_bytes(path:str)->int:
+    total=0
+    for dirpath,_,files in os.walk(path):
+        for f in files:
+            try:
+                total+=os.path.getsize(os.path.join(dirpath,f))
+            except OSError:
+                pass
+    return total
+
+
+def load_questions(labels_path:Path=LABELS_PATH):
+    """
+    回傳 [(set, question, {(source, page), ...})]；set 是 "faq" 或 "answers"
+    FAQ 的題目以 config.FAQ 為準，labels.json 沒標到的題目不列入（會印警告）
+    """
+    from config import FAQ
+    with open(labels_path,encoding="utf-8") as f:
+        labels=json.load(f)
+    out=[]
+    for q in (q for items in FAQ.values() for q in items):
+        rel=labels.get("faq",{}).get(q)
+        if not rel:
+            print(f"warning: FAQ question not labelled, skipped: {q}",file=sys.stderr)
+            continue
+        out.append(("faq",q,{(s,int(p)) for s,p in rel}))
+    for q,rel in labels.get("answers",{}).items():
+        out.append(("answers",q,{(s,int(p)) for s,p in rel}))
+    return out
+
+
+def score_hits(hits,relevant:set)->dict:
+    # 頁為單位：同一頁多段只算一次；source 存的是相對 KnowledgeBase 的路徑，標註只寫檔名
+    found=set()
+    first=None
+    for rank,h in enumerate(hits,start=1):
+        meta=h.meta or {}
+        key=(os.path.basename(meta.get("source") or ""),meta.get("page"))
+        if key in relevant:
+            found.add(key)
+            if first is None:
+                first=rank
+    return {
+        "recall":len(found)/len(relevant),
+        "hit":1.0 if found else 0.0,
+        "rr":(1.0/first) if first else 0.0,
+    }
+
+
+def _ingest(rag,pages_by_file,db_dir:str,embed_model:str,chunk_size:int,overlap:int,chunk_mode:str):
+    from lexical import LexicalIndex
+    client=rag.get_client(db_dir)
+    col=rag.get_collection(client,"bench_retrieval")
+    lexical=LexicalIndex(os.path.join(db_dir,"lexical.sqlite3"))
+    chunks=0
+    t0=time.perf_counter()
+    for path,pages in pages_by_file:
+        _,added,note=rag.ingest_pdf_path(
+            path,col,embed_model,chunk_size,overlap,str(ROOT/"KnowledgeBase"),
+            chunk_mode=chunk_mode,pages=pages,incremental=False,lexical=lexical,
+        )
+        if note:
+            print(f"warning: {note}",file=sys.stderr)
+        chunks+=added
+    secs=time.perf_counter()-t0
+    return col,lexical,chunks,secs
+
+
+def run_config(rag,pages_by_file,questions,embed_model:str,chunk_size:int,overlap:int,chunk_mode:str,top_ks,hybrid_modes):
+    db_dir=tempfile.mkdtemp(prefix="bench_retrieval_")
+    try:
+        col,lexical,chunks,ingest_s=_ingest(rag,pages_by_file,db_dir,embed_model,chunk_size,overlap,chunk_mode)
+        base={
+            "chunk_size":chunk_size,"overlap":overlap,"chunk_mode":chunk_mode,
+            "chunks":chunks,"ingest_s":ingest_s,"chunks_per_s":(chunks/ingest_s) if ingest_s>0 else 0.0,
+            "index_mb":_dir_bytes(db_dir)/1024/1024,
+        }
+        rows=[]
+        for hybrid in hybrid_modes:
+            for k in top_ks:
+                lat=[]
+                scores={"faq":[],"answers":[]}
+                for qset,q,relevant in questions:
+                    t0=time.perf_counter()
+                    hits=rag.retrieve(q,col,embed_model,top_k=k,lexical=lexical if hybrid else None)
+                    lat.append(time.perf_counter()-t0)
+                    scores[qset].append(score_hits(hits,relevant))
+                row={**base,"search":"hybrid" if hybrid else "vector","top_k":k,"p50_ms":_pct(lat,0.5)*1000,"p95_ms":_pct(lat,0.95)*1000}
+                for qset,vals in scores.items():
+                    n=len(vals) or 1
+                    row[qset]={
+                        "n":len(vals),
+                        "recall":sum(v["recall"] for v in vals)/n,
+                        "hit":sum(v["hit"] for v in vals)/n,
+                        "mrr":sum(v["rr"] for v in vals)/n,
+                    }
+                rows.append(row)
+        return rows
+    finally:
+        shutil.rmtree(db_dir,ignore_errors=True)
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunk-sizes",default="400,800,1200",help="逗號分隔（token 模式時是 token 數）")
+    ap.add_argument("--overlaps",default="60,120")
+    ap.add_argument("--top-ks",default="3,6,10")
+    ap.add_argument("--chunk-mode",choices=["char","token"],default="char")
+    ap.add_argument("--search",choices=["vector","hybrid","both"],default="both")
+    ap.add_argument("--labels",default=str(LABELS_PATH))
+    ap.add_argument("--real",action="store_true",help="用真的 Ollama（OLLAMA_HOST）做 embedding")
+    ap.add_argument("--embed-model",default="nomic-embed-text")
+    ap.add_argument("--json",action="store_true",help="輸出 JSON（每組參數一筆）")
+    args=ap.parse_args(argv)
+
+    srv=None
+    if not args.real:
+        from benchmarks.stub_ollama import start_stub_server,server_url
+        srv=start_stub_server(request_latency=0.0,item_latency=0.0)
+        os.environ["OLLAMA_HOST"]=server_url(srv)
+    import rag
+    from pdf_extract import extract_pdf_pages
+
+    questions=load_questions(Path(args.labels))
+    t0=time.perf_counter()
+    pages_by_file=[(str(p),extract_pdf_pages(str(p))) for p in sorted(POLICIES_DIR.glob("*.pdf"))]
+    extract_s=time.perf_counter()-t0
+    n_pages=sum(len(pages) for _,pages in pages_by_file)
+
+    hybrid_modes={"vector":[False],"hybrid":[True],"both":[False,True]}[args.search]
+    rows=[]
+    for size in _ints(args.chunk_sizes):
+        for overlap in _ints(args.overlaps):
+            if overlap>=size:
+                continue
+            rows.extend(run_config(rag,pages_by_file,questions,args.embed_model,size,overlap,args.chunk_mode,_ints(args.top_ks),hybrid_modes))
+    if srv is not None:
+        srv.shutdown()
+
+    if args.json:
+        print(json.dumps({"embed":"ollama:"+args.embed_model if args.real else "stub","files":len(pages_by_file),"pages":n_pages,"extract_s":extract_s,"rows":rows},ensure_ascii=False,indent=2))
+        return 0
+
+    n_faq=sum(1 for s,_,_ in questions if s=="faq")
+    print(f"embed={'ollama:'+args.embed_model if args.real else 'stub (bigram hashing)'} files={len(pages_by_file)} pages={n_pages}"
+          f" extract {extract_s:.2f}s  questions: faq={n_faq} answers={len(questions)-n_faq}")
+    print(f"{'size/ovl':>9} {'search':<6} {'k':>3} {'chunks':>6} {'chunks/s':>8} {'index':>7}"
+          f" {'FAQ R@k':>7} {'MRR':>5} {'ANS R@k':>7} {'hit':>5} {'MRR':>5} {'p50':>7} {'p95':>7}")
+    for r in rows:
+        f,a=r["faq"],r["answers"]
+        print(
+            f"{r['chunk_size']:>4}/{r['overlap']:<4} {r['search']:<6} {r['top_k']:>3} {r['chunks']:>6} {r['chunks_per_s']:>8.0f} {r['index_mb']:>5.1f}MB"
+            f" {f['recall']:>7.2f} {f['mrr']:>5.2f} {a['recall']:>7.2f} {a['hit']:>5.2f} {a['mrr']:>5.2f} {r['p50_ms']:>5.1f}ms {r['p95_ms']:>5.1f}ms"
+        )
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
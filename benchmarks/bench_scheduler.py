@@ -0,0 +1,111 @@
+# benchmarks/bench_scheduler.py
+"""
+Ollama 請求排程：很多人同時問的時候，有排程（同時最多 --limit 個）vs 沒排程（全部同時丟給 Ollama）
+
+- 假的 Ollama（stub_ollama，shared_cpu=True）：同時 n 個請求就每個只剩 1/n 的速度，模擬單機 CPU
+- 每個使用者：問題 embedding（檢索）→ 串流生成；--users 個人在 --spread 秒內陸續送出
+- --ingest：同時有背景匯入一直在做 embedding（最低優先），看會不會拖慢線上問答
+- 印出檢索 embedding 延遲、首字時間（TTFT，含排隊）、整段回答時間的 p50 / p95，以及排程器的佇列統計
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_scheduler
+    python -m benchmarks.bench_scheduler --users 30 --limit 2 --ingest
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+EMBED_MODEL="nomic-embed-text"
+
+
+def _pct(vals,q:float)->float:
+    s=sorted(vals)
+    return s[min(len(s)-1,int(q*len(s)))] if s else 0.0
+
+
+def _run_round(rag,users:int,spread:float,ingest:bool)->dict:
+    rows=[]
+    lock=threading.Lock()
+    stop=threading.Event()
+
+    def _user(i:int,delay:float):
+        time.sleep(delay)
+        t0=time.perf_counter()
+        rag._embed(f"問題 {i}：請假需要什麼證明？",EMBED_MODEL)
+        t_emb=time.perf_counter()
+        gen={}
+        for _ in rag.chat_llm_stream("system",f"question {i}","stub",stats=gen):
+            pass
+        t_end=time.perf_counter()
+        with lock:
+            rows.append({"embed":t_emb-t0,"ttft":t_emb-t0+gen["ttft_s"],"total":t_end-t0,"queue":gen["queue_s"]})
+
+    def _ingest():
+        n=0
+        while not stop.is_set():
+            rag._embed_batch([f"背景匯入第 {n} 批第 {j} 段" for j in range(16)],EMBED_MODEL)
+            n+=1
+
+    bg=threading.Thread(target=_ingest,daemon=True) if ingest else None
+    if bg:
+        bg.start()
+    rnd=random.Random(0)
+    ths=[threading.Thread(target=_user,args=(i,rnd.uniform(0,spread))) for i in range(users)]
+    t0=time.perf_counter()
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    wall=time.perf_counter()-t0
+    stop.set()
+    if bg:
+        bg.join()
+    return {"rows":rows,"wall":wall}
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users",type=int,default=30)
+    ap.add_argument("--spread",type=float,default=1.0,help="使用者在幾秒內陸續送出")
+    ap.add_argument("--limit",type=int,default=2,help="排程器同時請求數上限")
+    ap.add_argument("--chat-tokens",type=int,default=32)
+    ap.add_argument("--token-ms",type=float,default=10.0,help="單獨跑時每段文字幾毫秒")
+    ap.add_argument("--ingest",action="store_true",help="同時跑背景匯入 embedding")
+    args=ap.parse_args(argv)
+
+    from benchmarks.stub_ollama import start_stub_server,server_url
+    srv=start_stub_server(
+        request_latency=0.02,item_latency=0.001,
+        chat_tokens=args.chat_tokens,token_latency=args.token_ms/1000,shared_cpu=True,
+    )
+    os.environ["OLLAMA_HOST"]=server_url(srv)
+    import rag
+    from scheduler import Scheduler
+
+    print(f"users={args.users} spread={args.spread}s chat={args.chat_tokens}x{args.token_ms:g}ms ingest={'on' if args.ingest else 'off'}")
+    print(f"{'mode':<16} {'embed p50':>9} {'p95':>6} {'TTFT p50':>9} {'p95':>6} {'total p50':>9} {'p95':>6} {'wall':>6}")
+    for label,limit in [("no scheduling",10_000),(f"limit {args.limit}",args.limit)]:
+        # 每一輪換一個新的排程器，統計才不會混在一起
+        rag._SCHEDULER=Scheduler(max_concurrent=limit)
+        r=_run_round(rag,args.users,args.spread,args.ingest)
+        rows=r["rows"]
+
+        def _p(k,q):
+            return _pct([x[k] for x in rows],q)
+        print(
+            f"{label:<16} {_p('embed',0.5):>8.2f}s {_p('embed',0.95):>5.2f}s {_p('ttft',0.5):>8.2f}s {_p('ttft',0.95):>5.2f}s"
+            f" {_p('total',0.5):>8.2f}s {_p('total',0.95):>5.2f}s {r['wall']:>5.1f}s"
+        )
+        st=rag.get_scheduler().stats()
+        for name,s in st["by_priority"].items():
+            if s["requests"]:
+                print(f"    {name:<13} n={s['requests']:<5} wait p50 {s['wait_p50']:.2f}s p95 {s['wait_p95']:.2f}s  service p50 {s['service_p50']:.2f}s p95 {s['service_p95']:.2f}s")
+    srv.shutdown()
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
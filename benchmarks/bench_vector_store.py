@@ -0,0 +1,203 @@
+# benchmarks/bench_vector_store.py
+"""
+壓縮向量索引（vector_store.VectorStore）：int8 / float16 / float32 的記憶體、磁碟、召回率損失與查詢延遲
+
+- 資料：合成的分群單位向量（預設 50,000 × 768，跟 nomic-embed-text 同維度），問題是某個向量加一點雜訊，
+  比較接近真實的「語意相近但不完全一樣」；固定亂數種子，結果可重現
+- 標準答案：float32 全部內積（暴力法）的前 k 筆
+- 每種 dtype 回報：
+  - RAM：記憶體裡的矩陣 + scale（含預留空間）＋ Chroma 的索引檔（HNSW，查詢時整個載入記憶體）
+  - 磁碟：VectorStore 的 SQLite + .f32（float32 原始向量，只給精確重算用）＋ Chroma 目錄
+  - Chroma 那一份是實際開壓縮索引時的樣子：只放文字、metadata 與 1 維佔位向量（rag.open_collection）
+  - recall@k（不重算）：只看壓縮矩陣的排名
+  - recall@k（重算）：挑 k*rescore 筆候選，再用 float32 精確重算
+  - 查詢延遲 p50 / p95（含重算時讀 memmap）
+- 對照（reference）：不開壓縮索引時，向量存在 Chroma（float32 + HNSW）的磁碟與索引大小；
+  以及 Python list[float] 全放記憶體的估計值（每個數字 24 bytes 物件 + 8 bytes 指標）
+- 每段配一段 --doc-chars 字的假文字（Chroma 存的文件內容也算進去）；--no-chroma 跳過 Chroma（比較快，數字只剩 VectorStore）
+
+用法（在專案根目錄）：
+    python -m benchmarks.bench_vector_store
+    python -m benchmarks.bench_vector_store --n 200000 --dim 768 --rescore 2,4,8
+    python -m benchmarks.bench_vector_store --n 20000 --json
+    python -m benchmarks.bench_vector_store --n 200000 --no-chroma
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmarks.bench_retrieval import _pct,_dir_bytes
+
+
+def _ints(s:str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def make_data(n:int,dim:int,n_queries:int,clusters:int,noise:float,seed:int):
+    """(向量 (n, dim), 問題 (n_queries, dim))，都是 L2 正規化過的 float32"""
+    rng=np.random.default_rng(seed)
+    centers=rng.standard_normal((clusters,dim)).astype(np.float32)
+    vecs=np.empty((n,dim),dtype=np.float32)
+    for i in range(0,n,10000):
+        j=min(n,i+10000)
+        vecs[i:j]=centers[rng.integers(0,clusters,j-i)]+rng.standard_normal((j-i,dim)).astype(np.float32)*noise
+    vecs/=np.linalg.norm(vecs,axis=1,keepdims=True)
+    base=vecs[rng.integers(0,n,n_queries)]
+    queries=base+rng.standard_normal((n_queries,dim)).astype(np.float32)*(noise/np.sqrt(dim))*4
+    queries/=np.linalg.norm(queries,axis=1,keepdims=True)
+    return vecs,queries
+
+
+def exact_topk(vecs:np.ndarray,queries:np.ndarray,k:int,ids):
+    # float32 暴力法；回傳每題前 k 筆的 ID 集合
+    out=[]
+    for i in range(0,len(queries),64):
+        scores=queries[i:i+64]@vecs.T
+        top=np.argpartition(-scores,k-1,axis=1)[:,:k]
+        out.extend({ids[j] for j in row} for row in top)
+    return out
+
+
+def _recall(found,truth)->float:
+    return sum(len(set(f)&t)/len(t) for f,t in zip(found,truth))/len(truth)
+
+
+def run_dtype(dtype:str,vecs,queries,truth,ids,k:int,rescores,batch:int)->dict:
+    from vector_store import VectorStore
+    d=tempfile.mkdtemp(prefix="bench_vectors_")
+    try:
+        t0=time.perf_counter()
+        vs=VectorStore(os.path.join(d,"vectors.sqlite3"),dtype=dtype)
+        for i in range(0,len(ids),batch):
+            vs.add(ids[i:i+batch],vecs[i:i+batch],["bench"]*len(ids[i:i+batch]))
+        build_s=time.perf_counter()-t0
+        # 重開一次：量的是實際啟動時從 .f32 載入、量化的時間，RAM 也不含 add 時多預留的空間
+        t0=time.perf_counter()
+        vs=VectorStore(os.path.join(d,"vectors.sqlite3"),dtype=dtype)
+        load_s=time.perf_counter()-t0
+        st=vs.stats()
+        row={"dtype":dtype,"count":st["count"],"ram_bytes":st["ram_bytes"],"disk_bytes":st["disk_bytes"],"build_s":build_s,"load_s":load_s}
+
+        # 不重算：candidates=k 時挑出來的集合就是壓縮矩陣的前 k 筆
+        found=[[cid for cid,_ in vs.search(q,k,candidates=k)] for q in queries]
+        row["recall_approx"]=_recall(found,truth)
+        row["rescore"]=[]
+        for r in rescores if dtype!="float32" else [1]:
+            lat=[]
+            found=[]
+            for q in queries:
+                t0=time.perf_counter()
+                hits=vs.search(q,k,candidates=k*r)
+                lat.append(time.perf_counter()-t0)
+                found.append([cid for cid,_ in hits])
+            row["rescore"].append({"rescore":r,"recall":_recall(found,truth),"p50_ms":_pct(lat,0.5)*1000,"p95_ms":_pct(lat,0.95)*1000})
+        return row
+    finally:
+        shutil.rmtree(d,ignore_errors=True)
+
+
+_DOC_TEXT="第十六條 員工因業務需要，應於預定加班日前填寫加班工作申請單，經單位主管及部門主管簽核，總經理核准後送交管理部辦理。"
+
+
+def _docs(ids,doc_chars:int):
+    return [(cid+" "+_DOC_TEXT*(doc_chars//len(_DOC_TEXT)+1))[:doc_chars] for cid in ids]
+
+
+def chroma_footprint(vecs,ids,batch:int,doc_chars:int)->dict:
+    """
+    把 ids 的文字/metadata 寫進暫存的 Chroma；vecs=None 時跟開壓縮索引一樣只放 1 維佔位向量
+    回傳 disk_bytes（整個目錄）、index_bytes（chroma.sqlite3 以外的檔案，也就是 HNSW 索引）
+    """
+    import chromadb
+    from rag import _placeholder_embeddings
+    d=tempfile.mkdtemp(prefix="bench_vectors_chroma_")
+    try:
+        client=chromadb.PersistentClient(path=d)
+        col=client.get_or_create_collection("bench_vectors")
+        for i in range(0,len(ids),batch):
+            part=ids[i:i+batch]
+            embs=_placeholder_embeddings(len(part)) if vecs is None else vecs[i:i+batch]
+            col.add(ids=part,documents=_docs(part,doc_chars),metadatas=[{"source":"bench.pdf","page":1}]*len(part),embeddings=embs)
+        # 讀一次，HNSW 的檔案才會寫完
+        col.get(ids=ids[:1])
+        total=_dir_bytes(d)
+        db=0
+        for f in ("chroma.sqlite3","chroma.sqlite3-wal"):
+            try:
+                db+=os.path.getsize(os.path.join(d,f))
+            except OSError:
+                pass
+        return {"disk_bytes":total,"index_bytes":total-db}
+    finally:
+        shutil.rmtree(d,ignore_errors=True)
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n",type=int,default=50000,help="向量數")
+    ap.add_argument("--dim",type=int,default=768)
+    ap.add_argument("--queries",type=int,default=200)
+    ap.add_argument("--k",type=int,default=10)
+    ap.add_argument("--rescore",default="1,4",help="候選倍數，逗號分隔（1＝只重排壓縮矩陣的前 k 筆）")
+    ap.add_argument("--dtypes",default="float32,float16,int8")
+    ap.add_argument("--clusters",type=int,default=256)
+    ap.add_argument("--noise",type=float,default=0.6,help="群內雜訊（越大群越散）")
+    ap.add_argument("--seed",type=int,default=0)
+    ap.add_argument("--batch",type=int,default=5000,help="寫入時每批幾筆")
+    ap.add_argument("--doc-chars",type=int,default=400,help="每段假文字的字數（算 Chroma 的文件大小）")
+    ap.add_argument("--no-chroma",action="store_true",help="不量 Chroma（總量只剩 VectorStore）")
+    ap.add_argument("--json",action="store_true")
+    args=ap.parse_args(argv)
+
+    t0=time.perf_counter()
+    vecs,queries=make_data(args.n,args.dim,args.queries,args.clusters,args.noise,args.seed)
+    ids=[f"v{i}" for i in range(args.n)]
+    truth=exact_topk(vecs,queries,args.k,ids)
+    gen_s=time.perf_counter()-t0
+
+    rows=[run_dtype(dt,vecs,queries,truth,ids,args.k,_ints(args.rescore),args.batch) for dt in args.dtypes.split(",") if dt.strip()]
+    ref={
+        "float32_ndarray_bytes":int(vecs.nbytes),
+        "python_list_bytes":args.n*(56+args.dim*(8+24)),
+    }
+    if not args.no_chroma:
+        # 開壓縮索引時 Chroma 的實際大小（每種 dtype 都一樣），加進每一列的總量
+        docs_only=chroma_footprint(None,ids,args.batch,args.doc_chars)
+        for r in rows:
+            r["chroma_disk_bytes"]=docs_only["disk_bytes"]
+            r["chroma_index_bytes"]=docs_only["index_bytes"]
+            r["total_disk_bytes"]=r["disk_bytes"]+docs_only["disk_bytes"]
+            r["total_ram_bytes"]=r["ram_bytes"]+docs_only["index_bytes"]
+        full=chroma_footprint(vecs,ids,args.batch,args.doc_chars)
+        ref["chroma_full_disk_bytes"]=full["disk_bytes"]
+        ref["chroma_full_index_bytes"]=full["index_bytes"]
+
+    if args.json:
+        print(json.dumps({"n":args.n,"dim":args.dim,"queries":args.queries,"k":args.k,"reference":ref,"rows":rows},ensure_ascii=False,indent=2))
+        return 0
+
+    mb=lambda b:f"{b/1024/1024:.1f}MB"
+    print(f"n={args.n} dim={args.dim} queries={args.queries} k={args.k}  data+ground truth {gen_s:.1f}s")
+    print(f"reference RAM: python list[float] ≈ {mb(ref['python_list_bytes'])}  float32 ndarray {mb(ref['float32_ndarray_bytes'])}")
+    if "chroma_full_disk_bytes" in ref:
+        print(f"reference vectors in chroma (no VectorStore): RAM(HNSW) {mb(ref['chroma_full_index_bytes'])}  disk {mb(ref['chroma_full_disk_bytes'])}")
+        print(f"with VectorStore chroma keeps text/metadata only: RAM(HNSW) {mb(rows[0]['chroma_index_bytes'])}  disk {mb(rows[0]['chroma_disk_bytes'])}"
+              +"  (included in the RAM / disk columns below)")
+    ram_key,disk_key=("total_ram_bytes","total_disk_bytes") if rows and "total_disk_bytes" in rows[0] else ("ram_bytes","disk_bytes")
+    print(f"{'dtype':<8} {'RAM':>8} {'disk':>8} {'load':>6} {'R@k raw':>7} {'rescore':>7} {'R@k':>6} {'p50':>8} {'p95':>8}")
+    for r in rows:
+        for i,rs in enumerate(r["rescore"]):
+            head=(f"{r['dtype']:<8} {mb(r[ram_key]):>8} {mb(r[disk_key]):>8} {r['load_s']:>5.1f}s {r['recall_approx']:>7.3f}"
+                  if i==0 else " "*(8+1+8+1+8+1+6+1+7))
+            print(f"{head} {('x'+str(rs['rescore'])) if r['dtype']!='float32' else '-':>7} {rs['recall']:>6.3f} {rs['p50_ms']:>6.2f}ms {rs['p95_ms']:>6.2f}ms")
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
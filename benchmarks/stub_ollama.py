@@ -0,0 +1,161 @@
+# benchmarks/stub_ollama.py
+"""
+本機假的 Ollama 伺服器（只給 benchmark 用，不需要真的模型）
+
+- /api/embed       多筆輸入（input 可以是字串或 list）
+- /api/embeddings  舊版單筆（prompt）
+- /api/chat        固定吐 chat_tokens 段文字（stream=true 時一段一行 NDJSON），每段睡 token_latency
+embedding 用字元 bigram 做 hashing，相同文字一定得到相同向量，相似文字的向量也會接近。
+每個 request 會睡 request_latency，每段文字再加 item_latency，用來模擬網路與模型成本。
+shared_cpu=True 時模擬單機 CPU：同時有 n 個 request 在跑，每個的速度都只剩 1/n（processor sharing），
+跟真的 Ollama 在一台 CPU 上同時跑很多請求一樣，大家一起變慢。
+"""
+import json
+import math
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from typing import List
+
+DIM=768
+
+
+def stub_embedding(text:str,dim:int=DIM)->List[float]:
+    v=[0.0]*dim
+    s=(text or "").strip()
+    grams=[s[i:i+2] for i in range(max(1,len(s)-1))] if s else [""]
+    for g in grams:
+        h=hashlib.blake2b(g.encode("utf-8"),digest_size=8).digest()
+        idx=int.from_bytes(h[:4],"little")%dim
+        v[idx]+=1.0 if h[4]&1 else -1.0
+    n=math.sqrt(sum(x*x for x in v))
+    return [x/n for x in v] if n>0 else v
+
+
+def _work(srv,secs:float)->None:
+    # 花 secs 秒的「運算」；shared_cpu 時跟其他在跑的 request 平分
+    if not srv.shared_cpu:
+        time.sleep(secs)
+        return
+    left=secs
+    while left>0:
+        with srv.lock:
+            n=max(1,srv.active)
+        dt=min(0.002,left*n)
+        time.sleep(dt)
+        left-=dt/n
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version="StubOllama/0.1"
+
+    def log_message(self,fmt,*args):
+        pass
+
+    def _send(self,code:int,payload:dict)->None:
+        body=json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        n=int(self.headers.get("Content-Length","0") or 0)
+        req=json.loads(self.rfile.read(n) or b"{}")
+        srv=self.server
+        with srv.lock:
+            srv.requests+=1
+            srv.active+=1
+        try:
+            return self._dispatch(req)
+        finally:
+            with srv.lock:
+                srv.active-=1
+
+    def _dispatch(self,req:dict)->None:
+        srv=self.server
+        if self.path=="/api/embed":
+            if not srv.support_batch:
+                return self._send(404,{"error":"404 page not found"})
+            inp=req.get("input","")
+            texts=[inp] if isinstance(inp,str) else list(inp)
+            _work(srv,srv.request_latency+srv.item_latency*len(texts))
+            return self._send(200,{"model":req.get("model",""),"embeddings":[stub_embedding(t) for t in texts]})
+
+        if self.path=="/api/embeddings":
+            _work(srv,srv.request_latency+srv.item_latency)
+            return self._send(200,{"embedding":stub_embedding(req.get("prompt",""))})
+
+        if self.path=="/api/chat":
+            return self._chat(req)
+
+        return self._send(404,{"error":f"unknown path {self.path}"})
+
+    def _chat(self,req:dict)->None:
+        srv=self.server
+        msgs=req.get("messages") or []
+        prompt="".join((m.get("content") or "") for m in msgs)
+        pieces=[f"第{i+1}段。" for i in range(srv.chat_tokens)]
+        _work(srv,srv.request_latency)
+        t0=time.perf_counter()
+        final={
+            "model":req.get("model",""),
+            "created_at":"1970-01-01T00:00:00Z",
+            "message":{"role":"assistant","content":""},
+            "done":True,
+            "done_reason":"stop",
+            "prompt_eval_count":len(prompt),
+            "eval_count":len(pieces),
+        }
+        if not req.get("stream",True):
+            _work(srv,srv.token_latency*len(pieces))
+            final["message"]["content"]="".join(pieces)
+            final["eval_duration"]=int((time.perf_counter()-t0)*1e9) or 1
+            return self._send(200,final)
+
+        self.send_response(200)
+        self.send_header("Content-Type","application/x-ndjson")
+        self.end_headers()
+        for p in pieces:
+            _work(srv,srv.token_latency)
+            line={"model":final["model"],"created_at":final["created_at"],"message":{"role":"assistant","content":p},"done":False}
+            self.wfile.write(json.dumps(line,ensure_ascii=False).encode("utf-8")+b"\n")
+            self.wfile.flush()
+        final["eval_duration"]=int((time.perf_counter()-t0)*1e9) or 1
+        self.wfile.write(json.dumps(final).encode("utf-8")+b"\n")
+        self.wfile.flush()
+        self.close_connection=True
+
+
+def start_stub_server(
+    request_latency:float=0.005,
+    item_latency:float=0.0005,
+    support_batch:bool=True,
+    port:int=0,
+    chat_tokens:int=32,
+    token_latency:float=0.0,
+    shared_cpu:bool=False,
+)->ThreadingHTTPServer:
+    """
+    背景啟動，回傳 server；網址用 f"http://127.0.0.1:{server.server_address[1]}"
+    用完記得 server.shutdown()
+    """
+    srv=ThreadingHTTPServer(("127.0.0.1",port),_Handler)
+    srv.daemon_threads=True
+    srv.request_latency=request_latency
+    srv.item_latency=item_latency
+    srv.support_batch=support_batch
+    srv.chat_tokens=chat_tokens
+    srv.token_latency=token_latency
+    srv.shared_cpu=shared_cpu
+    srv.requests=0
+    srv.active=0
+    srv.lock=threading.Lock()
+    threading.Thread(target=srv.serve_forever,daemon=True).start()
+    return srv
+
+
+def server_url(srv:ThreadingHTTPServer)->str:
+    return f"http://127.0.0.1:{srv.server_address[1]}"
@@ -0,0 +1,385 @@
+# caches.py
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional, Callable
+
+import numpy as np
+
+
+def _text_key(text:str)->str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def normalize_question(q:str)->str:
+    # 全形/半形統一（NFKC）、連續空白併成一個：「病假  需要證明嗎？」跟「病假 需要證明嗎?」算同一題
+    q=unicodedata.normalize("NFKC",q or "")
+    return re.sub(r"\s+"," ",q).strip()
+
+
+class EmbeddingCache:
+    """
+    磁碟上的 embedding 快取（SQLite），key = (embed 模型, chunk 文字的 SHA-256)
+    - 向量以 float32 存，超過 max_bytes 時依最後使用時間淘汰（LRU）
+    - 同一個物件可以給多個 thread 共用（內部有鎖）
+    - hits / misses 是這個 process 啟動以來的累計
+    """
+
+    def __init__(self,path:str,max_bytes:int=512*1024*1024):
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path=path
+        self.max_bytes=int(max_bytes)
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings("
+            "model TEXT NOT NULL,text_hash TEXT NOT NULL,vec BLOB NOT NULL,"
+            "nbytes INTEGER NOT NULL,last_used REAL NOT NULL,"
+            "PRIMARY KEY(model,text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._bytes=self._conn.execute("SELECT COALESCE(SUM(nbytes),0) FROM embeddings").fetchone()[0]
+
+    def get_many(self,model:str,texts:List[str])->List[Optional[np.ndarray]]:
+        """回傳跟 texts 等長的 list（float32 陣列）；沒命中的位置是 None"""
+        keys=[_text_key(t) for t in texts]
+        found={}
+        with self._lock:
+            uniq=list(dict.fromkeys(keys))
+            # SQLite 的參數數量有上限，分段查
+            for i in range(0,len(uniq),500):
+                part=uniq[i:i+500]
+                q=",".join("?"*len(part))
+                for h,blob in self._conn.execute(
+                    f"SELECT text_hash,vec FROM embeddings WHERE model=? AND text_hash IN ({q})",
+                    [model,*part],
+                ):
+                    found[h]=blob
+            if found:
+                now=time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used=? WHERE model=? AND text_hash=?",
+                    [(now,model,h) for h in found],
+                )
+                self._conn.commit()
+            out=[]
+            for h in keys:
+                blob=found.get(h)
+                if blob is None:
+                    self.misses+=1
+                    out.append(None)
+                else:
+                    self.hits+=1
+                    out.append(np.frombuffer(blob,dtype=np.float32))
+        return out
+
+    def put_many(self,model:str,texts:List[str],vecs)->None:
+        now=time.time()
+        rows=[]
+        for t,v in zip(texts,vecs):
+            blob=np.asarray(v,dtype=np.float32).tobytes()
+            rows.append((model,_text_key(t),blob,len(blob),now))
+        if not rows:
+            return
+        with self._lock:
+            # 覆寫同一個 key 時先扣掉舊的大小
+            for i in range(0,len(rows),500):
+                part=rows[i:i+500]
+                q=",".join("?"*len(part))
+                old=self._conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes),0) FROM embeddings WHERE model=? AND text_hash IN ({q})",
+                    [model,*[r[1] for r in part]],
+                ).fetchone()[0]
+                self._bytes-=old
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings(model,text_hash,vec,nbytes,last_used) VALUES (?,?,?,?,?)",
+                rows,
+            )
+            self._bytes+=sum(r[3] for r in rows)
+            if self._bytes>self.max_bytes:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self)->None:
+        # 一次砍到 90%，避免每次寫入都在邊界上來回淘汰
+        target=int(self.max_bytes*0.9)
+        while self._bytes>target:
+            rows=self._conn.execute(
+                "SELECT model,text_hash,nbytes FROM embeddings ORDER BY last_used LIMIT 500"
+            ).fetchall()
+            if not rows:
+                self._bytes=0
+                break
+            freed=0
+            victims=[]
+            for model,h,nb in rows:
+                victims.append((model,h))
+                freed+=nb
+                if self._bytes-freed<=target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE model=? AND text_hash=?",victims)
+            self._bytes-=freed
+
+    def clear(self)->None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._bytes=0
+
+    def stats(self)->Dict:
+        with self._lock:
+            entries=self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total=self.hits+self.misses
+            return {
+                "entries":entries,
+                "bytes":self._bytes,
+                "max_bytes":self.max_bytes,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":(self.hits/total) if total else 0.0,
+            }
+
+
+class QueryEmbeddingCache:
+    """
+    問題向量的記憶體 LRU 快取，key = (embed 模型, normalize_question 後的問題)
+    - 常用問題每次點都是同一句，命中就不用再打一次 Ollama
+    - saved_seconds：命中時，把當初算這個向量花的時間累加起來（估計省下的等待時間）
+    - 同一個物件可以給多個 thread 共用（內部有鎖）
+    """
+
+    def __init__(self,max_entries:int=1024):
+        self.max_entries=max(1,int(max_entries))
+        self.hits=0
+        self.misses=0
+        self.saved_seconds=0.0
+        self._lock=threading.Lock()
+        # key -> (向量, 當初計算花的秒數)
+        self._data:"OrderedDict[tuple,tuple]"=OrderedDict()
+
+    def get(self,model:str,question:str)->Optional[List[float]]:
+        key=(model,normalize_question(question))
+        with self._lock:
+            item=self._data.get(key)
+            if item is None:
+                self.misses+=1
+                return None
+            self._data.move_to_end(key)
+            self.hits+=1
+            self.saved_seconds+=item[1]
+            return item[0]
+
+    def put(self,model:str,question:str,vec:List[float],seconds:float=0.0)->None:
+        key=(model,normalize_question(question))
+        with self._lock:
+            self._data[key]=(vec,float(seconds))
+            self._data.move_to_end(key)
+            while len(self._data)>self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_embed(self,model:str,question:str,embed_fn:Callable[[str,str],List[float]])->List[float]:
+        """沒命中就呼叫 embed_fn(問題, 模型) 並存起來（不持鎖呼叫，避免卡住其他查詢）"""
+        vec=self.get(model,question)
+        if vec is not None:
+            return vec
+        q=normalize_question(question)
+        t0=time.perf_counter()
+        vec=embed_fn(q,model)
+        self.put(model,q,vec,time.perf_counter()-t0)
+        return vec
+
+    def warm(self,model:str,questions:List[str],embed_many_fn:Callable[[List[str]],List[List[float]]])->int:
+        """
+        預先算好一批問題（例如 config.FAQ），已經在快取裡的略過；回傳這次新算的筆數
+        一批算完的時間平均分給每一題，當作之後命中時省下的秒數
+        """
+        with self._lock:
+            todo=[]
+            for q in dict.fromkeys(normalize_question(x) for x in questions):
+                if q and (model,q) not in self._data:
+                    todo.append(q)
+        if not todo:
+            return 0
+        t0=time.perf_counter()
+        vecs=embed_many_fn(todo)
+        each=(time.perf_counter()-t0)/len(todo)
+        for q,v in zip(todo,vecs):
+            self.put(model,q,v,each)
+        return len(todo)
+
+    def clear(self)->None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self)->Dict:
+        with self._lock:
+            total=self.hits+self.misses
+            return {
+                "entries":len(self._data),
+                "max_entries":self.max_entries,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":(self.hits/total) if total else 0.0,
+                "saved_seconds":self.saved_seconds,
+            }
+
+
+class AnswerCache:
+    """
+    完整回答的記憶體 LRU 快取，key 見 AnswerCache.key()
+    - key 裡有知識庫版本（rag.get_collection_version），匯入/清空後版本會變
+    - 一看到新版本就把舊版本的回答全部丟掉，不會答出過期的內容
+    - 同一個物件可以給多個 thread 共用（內部有鎖）
+    """
+
+    def __init__(self,max_entries:int=256):
+        self.max_entries=max(1,int(max_entries))
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+        self._version:Optional[str]=None
+        # key -> {"answer":..., "hits":[Hit,...]}
+        self._data:"OrderedDict[tuple,Dict]"=OrderedDict()
+
+    @staticmethod
+    def key(question:str,top_k:int,model:str,temperature:float,version:str,embed_model:str="",retrieval:str="")->tuple:
+        # retrieval：檢索方式（例如 "hybrid" / "vector"），不同方式找到的段落不同
+        return (normalize_question(question),int(top_k),model,round(float(temperature),3),embed_model,retrieval,str(version))
+
+    def _sync_version_locked(self,version:str)->None:
+        if version!=self._version:
+            for k in [k for k in self._data if k[-1]!=version]:
+                del self._data[k]
+            self._version=version
+
+    def get(self,key:tuple)->Optional[Dict]:
+        with self._lock:
+            self._sync_version_locked(key[-1])
+            item=self._data.get(key)
+            if item is None:
+                self.misses+=1
+                return None
+            self._data.move_to_end(key)
+            self.hits+=1
+            return item
+
+    def put(self,key:tuple,answer:str,hits:list)->None:
+        with self._lock:
+            self._sync_version_locked(key[-1])
+            self._data[key]={"answer":answer,"hits":list(hits)}
+            self._data.move_to_end(key)
+            while len(self._data)>self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self)->None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self)->Dict:
+        with self._lock:
+            total=self.hits+self.misses
+            return {
+                "entries":len(self._data),
+                "max_entries":self.max_entries,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":(self.hits/total) if total else 0.0,
+            }
+
+
+class Flight:
+    """
+    一個進行中的問答：帶頭的 session 一邊生成一邊 publish，跟著的 session 用 stream() 同步看到同樣的文字
+    結束時 finish(result)；帶頭的被中斷（rerun、例外）就 abort()，跟著的要自己重跑
+    """
+
+    def __init__(self):
+        self._cv=threading.Condition()
+        self._pieces:List[str]=[]
+        self.done=False
+        self.aborted=False
+        self.result:Optional[Dict]=None
+        self.followers=0
+
+    def publish(self,piece:str)->None:
+        with self._cv:
+            self._pieces.append(piece)
+            self._cv.notify_all()
+
+    def finish(self,result:Dict)->None:
+        with self._cv:
+            self.result=result
+            self.done=True
+            self._cv.notify_all()
+
+    def abort(self)->None:
+        with self._cv:
+            if not self.done:
+                self.aborted=True
+                self.done=True
+                self._cv.notify_all()
+
+    def stream(self,timeout:float=1.0):
+        """依序 yield 已經生成的文字，直到結束（含已經生成過的部分）"""
+        i=0
+        while True:
+            with self._cv:
+                while i>=len(self._pieces) and not self.done:
+                    self._cv.wait(timeout=timeout)
+                new=self._pieces[i:]
+                finished=self.done
+            i+=len(new)
+            for p in new:
+                yield p
+            if finished and i>=len(self._pieces):
+                return
+
+    def wait(self,timeout:Optional[float]=None)->bool:
+        with self._cv:
+            return self._cv.wait_for(lambda:self.done,timeout=timeout)
+
+
+class SingleFlight:
+    """
+    相同問題（同 AnswerCache.key）同時只跑一次檢索 + 生成，其他同時送出的人共用結果
+    - begin(key) 回傳 (flight, leader)：leader=True 的負責跑，跑完一定要 end(key, flight)
+    - 同一個物件給整個 process 共用（內部有鎖）
+    """
+
+    def __init__(self):
+        self.leaders=0
+        self.shared=0
+        self._lock=threading.Lock()
+        self._flights:Dict[tuple,Flight]={}
+
+    def begin(self,key:tuple)->tuple:
+        with self._lock:
+            f=self._flights.get(key)
+            if f is not None and not f.done:
+                f.followers+=1
+                self.shared+=1
+                return f,False
+            f=self._flights[key]=Flight()
+            self.leaders+=1
+            return f,True
+
+    def end(self,key:tuple,flight:Flight)->None:
+        # 帶頭的沒有呼叫 finish 就結束（被中斷），當作 abort
+        flight.abort()
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self)->Dict:
+        with self._lock:
+            return {"in_flight":len(self._flights),"leaders":self.leaders,"shared":self.shared}
@@ -2,7 +2,10 @@
 import streamlit as st
 from config import (
     DEFAULT_LLM_MODEL,DEFAULT_EMBED_MODEL,DEFAULT_TOP_K,
-    DEFAULT_CHUNK_SIZE,DEFAULT_OVERLAP,DEFAULT_TEMPERATURE
+    DEFAULT_CHUNK_SIZE,DEFAULT_OVERLAP,DEFAULT_TEMPERATURE,DEFAULT_CONTEXT_TOKENS,
+    DEFAULT_CHUNK_MODE,DEFAULT_CHUNK_TOKENS,DEFAULT_OVERLAP_TOKENS,
+    DEFAULT_EMBED_BATCH_SIZE,DEFAULT_EMBED_CONCURRENCY,DEFAULT_INCREMENTAL_INGEST,
+    DEFAULT_HYBRID_SEARCH,DEFAULT_RERANK,DEFAULT_RERANK_CANDIDATES,
 )
 
 def _init_settings_state():
@@ -12,6 +15,16 @@ def _init_settings_state():
     st.session_state.setdefault("chunk_size",DEFAULT_CHUNK_SIZE)
     st.session_state.setdefault("overlap",DEFAULT_OVERLAP)
     st.session_state.setdefault("temperature",DEFAULT_TEMPERATURE)
+    st.session_state.setdefault("context_tokens",DEFAULT_CONTEXT_TOKENS)
+    st.session_state.setdefault("chunk_mode",DEFAULT_CHUNK_MODE)
+    st.session_state.setdefault("chunk_tokens",DEFAULT_CHUNK_TOKENS)
+    st.session_state.setdefault("overlap_tokens",DEFAULT_OVERLAP_TOKENS)
+    st.session_state.setdefault("embed_batch_size",DEFAULT_EMBED_BATCH_SIZE)
+    st.session_state.setdefault("embed_concurrency",DEFAULT_EMBED_CONCURRENCY)
+    st.session_state.setdefault("incremental_ingest",DEFAULT_INCREMENTAL_INGEST)
+    st.session_state.setdefault("hybrid_search",DEFAULT_HYBRID_SEARCH)
+    st.session_state.setdefault("rerank",DEFAULT_RERANK)
+    st.session_state.setdefault("rerank_candidates",DEFAULT_RERANK_CANDIDATES)
 
 def open_settings():
     st.session_state.show_settings=True
@@ -33,13 +46,39 @@ def render_settings_dialog():
         llm=st.text_input("LLM 模型",value=st.session_state.llm_model)
         emb=st.text_input("Embedding 模型",value=st.session_state.embed_model)
 
+        modes={"char":"依字數","token":"依估算 token（中文標點/條文斷句）"}
+        chunk_mode=st.selectbox(
+            "切段方式",
+            list(modes.keys()),
+            index=list(modes.keys()).index(st.session_state.chunk_mode) if st.session_state.chunk_mode in modes else 0,
+            format_func=lambda k:modes[k],
+        )
+
         c1,c2=st.columns(2)
         with c1:
             top_k=st.number_input("Top-k",min_value=1,max_value=20,value=int(st.session_state.top_k))
             chunk_size=st.number_input("Chunk size",min_value=200,max_value=2000,value=int(st.session_state.chunk_size),step=50)
+            embed_concurrency=st.number_input("Embedding 並行數",min_value=1,max_value=32,value=int(st.session_state.embed_concurrency))
         with c2:
             overlap=st.number_input("Overlap",min_value=0,max_value=600,value=int(st.session_state.overlap),step=10)
             temperature=st.slider("Temperature",0.0,1.0,float(st.session_state.temperature),step=0.05)
+            embed_batch_size=st.number_input("Embedding batch",min_value=1,max_value=256,value=int(st.session_state.embed_batch_size),step=8)
+
+        t1,t2=st.columns(2)
+        with t1:
+            chunk_tokens=st.number_input("Chunk tokens（估算）",min_value=64,max_value=2048,value=int(st.session_state.chunk_tokens),step=32)
+        with t2:
+            overlap_tokens=st.number_input("Overlap tokens（估算）",min_value=0,max_value=512,value=int(st.session_state.overlap_tokens),step=8)
+
+        context_tokens=st.number_input("Context tokens 上限（估算）",min_value=256,max_value=16384,value=int(st.session_state.context_tokens),step=256)
+
+        incremental=st.checkbox("增量匯入（略過內容沒變的檔案）",value=bool(st.session_state.incremental_ingest))
+        hybrid=st.checkbox("混合檢索（向量 + 關鍵字，條號/金額比較找得到）",value=bool(st.session_state.hybrid_search))
+        r1,r2=st.columns(2)
+        with r1:
+            rerank=st.checkbox("重新排序（cross-encoder）",value=bool(st.session_state.rerank))
+        with r2:
+            rerank_candidates=st.number_input("候選段數",min_value=5,max_value=100,value=int(st.session_state.rerank_candidates),step=5)
 
         st.write("")
 
@@ -52,6 +91,16 @@ def render_settings_dialog():
                 st.session_state.chunk_size=int(chunk_size)
                 st.session_state.overlap=int(overlap)
                 st.session_state.temperature=float(temperature)
+                st.session_state.context_tokens=int(context_tokens)
+                st.session_state.chunk_mode=chunk_mode
+                st.session_state.chunk_tokens=int(chunk_tokens)
+                st.session_state.overlap_tokens=int(overlap_tokens)
+                st.session_state.embed_batch_size=int(embed_batch_size)
+                st.session_state.embed_concurrency=int(embed_concurrency)
+                st.session_state.incremental_ingest=bool(incremental)
+                st.session_state.hybrid_search=bool(hybrid)
+                st.session_state.rerank=bool(rerank)
+                st.session_state.rerank_candidates=int(rerank_candidates)
                 st.session_state.show_settings=False
                 st.success("已儲存")
                 st.rerun()
@@ -12,6 +12,6 @@ def render_sidebar(title:str)->None:
                 st.session_state.page=label
                 st.rerun()
 
-        # 只要兩個選項
         nav("提問")
         nav("資料庫")
+        nav("指標")
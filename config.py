@@ -1,4 +1,5 @@
 # config.py
+import os
 from pathlib import Path
 
 APP_TITLE="RAG_Llama"
@@ -6,6 +7,8 @@ APP_TITLE="RAG_Llama"
 # ===== 路徑設定 =====
 ROOT=Path(__file__).resolve().parent
 DB_DIR=ROOT/"chroma_db"
+# Chroma 以外的本機狀態（embedding 快取等），放在 DB_DIR 旁邊
+STATE_DIR=ROOT/"rag_state"
 KB_DIR=ROOT/"KnowledgeBase"
 UPLOAD_DIR=KB_DIR/"uploads"
 
@@ -16,6 +19,75 @@ DEFAULT_TOP_K=6
 DEFAULT_CHUNK_SIZE=800
 DEFAULT_OVERLAP=120
 DEFAULT_TEMPERATURE=0.2
+# 放進 prompt 的 context token 上限（估算值，相鄰段落合併、去掉 overlap 之後才算）；llama3.1 在 Ollama 預設 num_ctx 只有 2048~4096
+DEFAULT_CONTEXT_TOKENS=1500
+# 切段方式："char"＝以字數計（Chunk size / Overlap）；"token"＝以估算的 token 數計（Chunk tokens / Overlap tokens，見 tokenizer.py）
+DEFAULT_CHUNK_MODE="char"
+DEFAULT_CHUNK_TOKENS=256
+DEFAULT_OVERLAP_TOKENS=32
+
+# ===== 匯入效能 =====
+# 一次送給 Ollama /api/embed 的 chunk 數（模型不支援時會自動退回逐筆）
+DEFAULT_EMBED_BATCH_SIZE=32
+# 同時送給 Ollama 的 embedding request 上限（建議約等於 Ollama 主機的核心數）
+DEFAULT_EMBED_CONCURRENCY=4
+# 增量匯入：檔案內容與 chunk 參數都沒變就略過；有變只處理變動的 chunk
+DEFAULT_INCREMENTAL_INGEST=True
+# 多份 PDF 時平行抽字的 process 數、單份抽字逾時秒數
+EXTRACT_WORKERS=max(1,(os.cpu_count() or 2)-1)
+EXTRACT_TIMEOUT_S=120
+
+# ===== Embedding 快取（key = 模型 + chunk 文字 SHA-256）=====
+EMBED_CACHE_PATH=STATE_DIR/"embed_cache.sqlite3"
+EMBED_CACHE_MAX_MB=512
+# 問題向量（記憶體 LRU），啟動時會先把 FAQ 的問題算好
+QUERY_CACHE_MAX_ENTRIES=1024
+# 完整回答（記憶體 LRU），知識庫一有匯入/清空就整批作廢
+ANSWER_CACHE_MAX_ENTRIES=256
+
+# ===== 混合檢索（向量 + 關鍵字 BM25，用 RRF 合併）=====
+DEFAULT_HYBRID_SEARCH=True
+# 關鍵字索引檔；出現在超過 LEXICAL_MAX_DF 段的詞（太常見）查詢時略過
+LEXICAL_INDEX_PATH=STATE_DIR/"lexical_docs.sqlite3"
+LEXICAL_MAX_DF=2000
+
+# ===== 重新排序（rerank，選用：pip install sentence-transformers）=====
+# 先抓 RERANK_CANDIDATES 段候選，用 cross-encoder 重新打分後留 Top-k 段；超過 RERANK_BUDGET_MS 就照原順序
+DEFAULT_RERANK=False
+RERANK_MODEL="BAAI/bge-reranker-base"
+DEFAULT_RERANK_CANDIDATES=20
+RERANK_BUDGET_MS=800
+# 跨 session 合批：最多等 RERANK_BATCH_WINDOW_MS 湊一批，一批最多 RERANK_MAX_BATCH 對
+RERANK_BATCH_WINDOW_MS=10
+RERANK_MAX_BATCH=64
+
+# ===== 壓縮向量索引（選用）=====
+# None＝向量存在 Chroma、直接查 Chroma（預設）；"int8" / "float16"＝向量只存在壓縮向量索引：
+# 記憶體放壓縮過的矩陣挑候選，再從 memmap 讀 float32 原始向量（vectors.f32）精確重算前 VECTOR_RESCORE 倍的候選。
+# 記憶體約 float32 的 1/4（int8）/ 1/2（float16）；Chroma 改用 <COLLECTION_NAME>_docs 只放文字與 metadata。
+# 開/關的第一次啟動會自動把向量搬過去/搬回來（一次性，大資料庫要等一下）
+VECTOR_STORE_DTYPE=None
+VECTOR_STORE_PATH=STATE_DIR/"vectors.sqlite3"  # chunk ID → 列號；float32 向量在同資料夾的 vectors.f32
+VECTOR_RESCORE=4
+
+# ===== 文件清單（每份文件的 chunk 數、頁數、hash、匯入時間；資料庫頁面的狀態從這裡讀）=====
+MANIFEST_PATH=STATE_DIR/"manifest.sqlite3"
+
+# ===== Ollama 請求排程 =====
+# 整個 app 同時送進 Ollama 的請求數上限（跟 Ollama 的 OLLAMA_NUM_PARALLEL 一致）；其他請求排隊，問題 embedding 優先於生成
+OLLAMA_MAX_CONCURRENT=2
+# 排隊每 OLLAMA_PRIORITY_AGING_S 秒優先序往前一級，問答一直很忙時背景匯入也不會完全停住（0 = 嚴格優先序）
+OLLAMA_PRIORITY_AGING_S=10.0
+
+# ===== 背景匯入 =====
+# 上傳的 PDF 排進工作表，由背景 thread 匯入；資料庫頁面每 JOBS_POLL_S 秒更新一次進度
+JOBS_PATH=STATE_DIR/"jobs.sqlite3"
+JOBS_POLL_S=1.0
+
+# ===== 效能指標 =====
+# 各階段耗時 / token 數在「指標」頁看，也可以下載 Prometheus 格式；
+# 設成 port（例如 9108）會另外開 HTTP exporter（GET /metrics）給 Prometheus 定期抓
+METRICS_PORT=None
 
 # ===== Chroma collection =====
 COLLECTION_NAME="docs"
@@ -0,0 +1,238 @@
+# ingest_cli.py
+"""
+不開 Streamlit，直接從命令列把整個資料夾（含子資料夾）的 PDF 匯入知識庫
+
+- 跟介面共用同一套匯入流程（rag.ingest_pdf_paths）、同一份 embedding 快取、文件清單、關鍵字索引
+  （config.VECTOR_STORE_DTYPE 有設的話，向量只寫進壓縮向量索引，Chroma 只放文字與 metadata，見 rag.open_collection）
+- 預設增量匯入：內容與參數都沒變的檔案直接略過；中途中斷（Ctrl+C、當機）再跑一次，
+  只有文件清單裡沒記錄完成的檔案會重做，已完成的不會重新 embedding
+- 每份檔案印一行進度（--json 改印 JSON，一行一筆，方便接其他程式），最後印總吞吐量
+- --from-db：改從 Postgres 的 SIM_policies 表串流讀 PDF（連線參數讀 PG* 環境變數 / .env），
+  file_hash 已經在知識庫（同一組切段參數）的列不會抓內容；來源名稱是 SIM_policies/<filename>，
+  同一個 filename 有多筆時只匯最新的一筆（舊版不讀，摘要裡的 superseded）
+  --from-sqlite PATH：同上，但讀 SQLite 檔（沒有 Postgres 時測試用）
+
+注意：不要在 app 執行中對同一個 chroma_db/ 跑這支（Chroma 不支援多個 process 同時寫同一個資料庫），
+      要嘛先停 app，要嘛用 --db-dir 匯到別的資料夾
+
+用法（在專案根目錄）：
+    python ingest_cli.py
+    python ingest_cli.py KnowledgeBase/policies --workers 4 --embed-concurrency 8
+    python ingest_cli.py D:\\docs --root D:\\docs --chunk-mode token --json
+    python ingest_cli.py --from-db
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+from config import (
+    DB_DIR,KB_DIR,COLLECTION_NAME,MANIFEST_PATH,LEXICAL_INDEX_PATH,LEXICAL_MAX_DF,
+    VECTOR_STORE_DTYPE,VECTOR_STORE_PATH,VECTOR_RESCORE,
+    EMBED_CACHE_PATH,EMBED_CACHE_MAX_MB,EXTRACT_WORKERS,EXTRACT_TIMEOUT_S,
+    DEFAULT_EMBED_MODEL,DEFAULT_CHUNK_SIZE,DEFAULT_OVERLAP,
+    DEFAULT_CHUNK_MODE,DEFAULT_CHUNK_TOKENS,DEFAULT_OVERLAP_TOKENS,
+    DEFAULT_EMBED_BATCH_SIZE,DEFAULT_EMBED_CONCURRENCY,
+)
+
+
+def _find_pdfs(paths:list)->list:
+    # 資料夾就遞迴找 .pdf（不分大小寫），檔案就直接收
+    out=[]
+    for p in paths:
+        p=Path(p)
+        if p.is_dir():
+            out.extend(str(x) for x in sorted(p.rglob("*")) if x.is_file() and x.suffix.lower()==".pdf")
+        elif p.is_file():
+            out.append(str(p))
+        else:
+            raise FileNotFoundError(f"找不到：{p}")
+    # 同一份檔案給兩次只匯一次
+    return list(dict.fromkeys(os.path.abspath(x) for x in out))
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths",nargs="*",default=[str(KB_DIR/"policies")],help="PDF 檔或資料夾（預設 KnowledgeBase/policies）")
+    ap.add_argument("--root",default=str(KB_DIR),help="來源名稱用相對這個資料夾的路徑（預設 KnowledgeBase）")
+    ap.add_argument("--db-dir",default=str(DB_DIR))
+    ap.add_argument("--state-dir",default=None,help="文件清單、關鍵字索引放哪（預設跟著 --db-dir：預設資料庫用 rag_state/，其他用 <db-dir>_state/）")
+    ap.add_argument("--collection",default=COLLECTION_NAME)
+    ap.add_argument("--embed-model",default=DEFAULT_EMBED_MODEL)
+    ap.add_argument("--chunk-mode",choices=["char","token"],default=DEFAULT_CHUNK_MODE,help="token＝以估算的 token 數切段（tokenizer.py，不是模型實際的 token 數）")
+    ap.add_argument("--chunk-size",type=int,default=None,help=f"預設 char {DEFAULT_CHUNK_SIZE} / token {DEFAULT_CHUNK_TOKENS}")
+    ap.add_argument("--overlap",type=int,default=None,help=f"預設 char {DEFAULT_OVERLAP} / token {DEFAULT_OVERLAP_TOKENS}")
+    ap.add_argument("--workers",type=int,default=EXTRACT_WORKERS,help="平行抽字的 process 數")
+    ap.add_argument("--extract-timeout",type=float,default=float(EXTRACT_TIMEOUT_S),help="每份 PDF 抽字最多幾秒")
+    ap.add_argument("--embed-batch-size",type=int,default=DEFAULT_EMBED_BATCH_SIZE)
+    ap.add_argument("--embed-concurrency",type=int,default=DEFAULT_EMBED_CONCURRENCY)
+    ap.add_argument("--no-incremental",action="store_true",help="不管有沒有變，每份都重新匯入")
+    ap.add_argument("--json",action="store_true",help="進度與結果印成 JSON lines")
+    src=ap.add_mutually_exclusive_group()
+    src.add_argument("--from-db",action="store_true",help="從 Postgres 的 SIM_policies 表匯入（不看 paths）")
+    src.add_argument("--from-sqlite",metavar="PATH",help="從 SQLite 檔的 SIM_policies 表匯入（測試用）")
+    args=ap.parse_args(argv)
+    from_db=args.from_db or bool(args.from_sqlite)
+
+    token_mode=args.chunk_mode=="token"
+    chunk_size=args.chunk_size if args.chunk_size is not None else (DEFAULT_CHUNK_TOKENS if token_mode else DEFAULT_CHUNK_SIZE)
+    overlap=args.overlap if args.overlap is not None else (DEFAULT_OVERLAP_TOKENS if token_mode else DEFAULT_OVERLAP)
+
+    pdfs=[]
+    if not from_db:
+        try:
+            pdfs=_find_pdfs(args.paths)
+        except FileNotFoundError as e:
+            print(e,file=sys.stderr)
+            return 2
+        if not pdfs:
+            print("沒有找到 PDF",file=sys.stderr)
+            return 1
+
+    # 放在 main 裡才 import：--help 不用等 chromadb 載入
+    import rag
+    from caches import EmbeddingCache
+    from manifest import Manifest
+    from lexical import LexicalIndex
+
+    # 文件清單、關鍵字索引要跟資料庫配對；embedding 快取只看內容，可以共用
+    if args.state_dir:
+        state_dir=Path(args.state_dir)
+    elif Path(args.db_dir).resolve()==DB_DIR.resolve():
+        state_dir=MANIFEST_PATH.parent
+    else:
+        state_dir=Path(str(Path(args.db_dir).resolve())+"_state")
+    Path(args.db_dir).mkdir(parents=True,exist_ok=True)
+    state_dir.mkdir(parents=True,exist_ok=True)
+    vectors_path=str(state_dir/VECTOR_STORE_PATH.name)
+    vector_store=None
+    if VECTOR_STORE_DTYPE:
+        from vector_store import VectorStore
+        vector_store=VectorStore(vectors_path,dtype=VECTOR_STORE_DTYPE,rescore=VECTOR_RESCORE)
+    collection=rag.open_collection(rag.get_client(args.db_dir),args.collection,vector_store=vector_store,vectors_path=vectors_path)
+    embed_cache=EmbeddingCache(str(EMBED_CACHE_PATH),max_bytes=EMBED_CACHE_MAX_MB*1024*1024)
+    manifest=Manifest(str(state_dir/MANIFEST_PATH.name))
+    lexical=LexicalIndex(str(state_dir/LEXICAL_INDEX_PATH.name),max_df=LEXICAL_MAX_DF)
+    if lexical.count()!=collection.count():
+        rag.sync_lexical(collection,lexical)
+    if vector_store is not None and vector_store.count()!=collection.count():
+        rag.sync_vector_store(
+            collection,vector_store,args.embed_model,embed_cache=embed_cache,
+            embed_batch_size=args.embed_batch_size,embed_concurrency=args.embed_concurrency,
+        )
+    # 命令列匯入時沒有其他人在用 Ollama：同時請求數就照 --embed-concurrency
+    rag.get_scheduler().set_limit(args.embed_concurrency)
+
+    total=len(pdfs) or "?"
+    done={"n":0,"pages":0}
+
+    def _on_file(info:dict)->None:
+        done["n"]+=1
+        done["pages"]+=info["pages"]
+        if args.json:
+            print(json.dumps({"event":"file","n":done["n"],"total":total,**info},ensure_ascii=False),flush=True)
+            return
+        line=f"[{done['n']}/{total}] {info['status']:<9} {info['source']}  {info['pages']} 頁 / {info['chunks']} 段  {info['seconds']:.1f}s"
+        if info["note"]:
+            line+=f"  ({info['note']})"
+        print(line,flush=True)
+
+    stats={}
+    t0=time.perf_counter()
+    if from_db:
+        import policy_db
+        pool=None
+        if args.from_sqlite:
+            import sqlite3
+            conn=sqlite3.connect(args.from_sqlite)
+        else:
+            pool=policy_db.get_pool(maxconn=1)
+            conn=pool.getconn()
+        try:
+            # 舊的 Postgres 表補上 id 欄，才分得出同檔名哪筆最新
+            policy_db.ensure_table(conn)
+            # --no-incremental：全部重匯，不看已匯入的 hash
+            known=set() if args.no_incremental else rag.known_file_hashes(collection,chunk_size,overlap,args.chunk_mode,manifest=manifest)
+            db_stats={}
+            scanned,added,skipped,notes=rag.ingest_pdf_blobs(
+                policy_db.iter_policy_pdfs(conn,skip_hashes=known,stats=db_stats),
+                collection,
+                args.embed_model,
+                chunk_size,
+                overlap,
+                source_prefix=policy_db.POLICY_TABLE+"/",
+                on_file=_on_file,
+                chunk_mode=args.chunk_mode,
+                embed_batch_size=args.embed_batch_size,
+                embed_concurrency=args.embed_concurrency,
+                embed_cache=embed_cache,
+                incremental=not args.no_incremental,
+                manifest=manifest,
+                lexical=lexical,
+                vector_store=vector_store,
+            )
+        finally:
+            if pool is not None:
+                pool.putconn(conn)
+                pool.closeall()
+            else:
+                conn.close()
+        # 已經匯入過、沒抓內容的列也算「未變更」
+        scanned+=db_stats["skipped"]
+        stats["unchanged_files"]=db_stats["skipped"]
+        stats["superseded_rows"]=db_stats["superseded"]
+    else:
+        scanned,added,skipped,notes=rag.ingest_pdf_paths(
+            pdfs,
+            args.root,
+            collection,
+            args.embed_model,
+            chunk_size,
+            overlap,
+            chunk_mode=args.chunk_mode,
+            embed_batch_size=args.embed_batch_size,
+            embed_concurrency=args.embed_concurrency,
+            embed_cache=embed_cache,
+            incremental=not args.no_incremental,
+            extract_workers=args.workers,
+            extract_timeout=args.extract_timeout,
+            stats=stats,
+            manifest=manifest,
+            lexical=lexical,
+            vector_store=vector_store,
+            on_file=_on_file,
+        )
+    secs=max(time.perf_counter()-t0,1e-9)
+
+    summary={
+        "files":scanned,
+        "unchanged":stats.get("unchanged_files",0),
+        "failed":skipped,
+        "pages":done["pages"],
+        "chunks":added,
+        "seconds":round(secs,3),
+        "files_per_s":round(scanned/secs,2),
+        "pages_per_s":round(done["pages"]/secs,2),
+        "chunks_per_s":round(added/secs,2),
+        "total_chunks":collection.count(),
+    }
+    if "superseded_rows" in stats:
+        summary["superseded"]=stats["superseded_rows"]
+    if args.json:
+        print(json.dumps({"event":"summary",**summary,"notes":notes},ensure_ascii=False),flush=True)
+    else:
+        print(
+            f"完成：{summary['files']} 份（略過未變更 {summary['unchanged']}、失敗 {summary['failed']}），"
+            f"{summary['pages']} 頁、新增 {summary['chunks']} 段，{secs:.1f}s"
+        )
+        print(f"吞吐量：{summary['files_per_s']} files/s、{summary['pages_per_s']} pages/s、{summary['chunks_per_s']} chunks/s")
+        print(f"資料庫共 {summary['total_chunks']} 段")
+        if summary.get("superseded"):
+            print(f"同檔名的舊版 {summary['superseded']} 筆沒有匯入（只取最新一筆）")
+    return 1 if skipped and skipped==scanned else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# jobs.py
+"""
+背景匯入工作佇列：上傳的 PDF 先排進 SQLite 工作表，由背景 worker thread 匯入，頁面只負責輪詢進度
+
+- worker 每次領一批（同一個 collection、同一組參數的排隊工作，最多 batch_size 份）交給 runner，
+  一批多份時 runner 可以平行抽字（rag.run_ingest_jobs → ingest_pdf_paths 的 process pool），每份做完就回報結果
+
+- 工作表存在檔案裡：Streamlit rerun、重新整理頁面都不會中斷；整個 process 重開時，
+  上次跑到一半（running）的工作會改回 queued 重跑（增量匯入 + 文件清單，已寫好的 chunk 不會重新 embedding）
+- 同一份內容（file_hash）同時只會有一個排隊/執行中的工作：兩個人同時上傳同一份檔案，第二個直接拿到第一個的 job id
+- 同一個物件給整個 process 共用（app.py 用 st.cache_resource 建一個），內部有鎖
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Callable
+
+# 工作狀態
+QUEUED="queued"
+RUNNING="running"
+DONE="done"
+FAILED="failed"
+
+# runner(jobs, progress, finish)：
+#   progress(job_id, 進度 dict)：收 rag.ingest_pdf_path 的進度 dict
+#   finish(job_id, result dict)：每份做完就呼叫；result 有 note 就算失敗
+# runner 結束時還沒 finish 的工作記成失敗
+Runner=Callable[[List[Dict],Callable[[int,Dict],None],Callable[[int,Dict],None]],None]
+
+
+class JobQueue:
+    """
+    path：SQLite 檔
+    runner：真正做匯入的函式（app.py 組好 collection / 快取 / 清單再傳進來）
+    progress_interval：進度最多每幾秒寫一次 DB（每頁都寫太頻繁）
+    batch_size：worker 一次最多領幾份（同參數的）工作交給 runner
+    """
+
+    def __init__(self,path:str,runner:Runner,progress_interval:float=0.5,batch_size:int=16):
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path=path
+        self.runner=runner
+        self.progress_interval=float(progress_interval)
+        self.batch_size=max(1,int(batch_size))
+        self._lock=threading.Lock()
+        self._wake=threading.Event()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.row_factory=sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,name TEXT NOT NULL,path TEXT NOT NULL,file_hash TEXT NOT NULL,
+                params TEXT NOT NULL,status TEXT NOT NULL,
+                pages_done INTEGER NOT NULL DEFAULT 0,pages_total INTEGER,chunks_done INTEGER NOT NULL DEFAULT 0,
+                eta_s REAL,result TEXT,note TEXT,
+                created_at REAL NOT NULL,started_at REAL,finished_at REAL);
+            -- 同一份內容同時只能有一個排隊/執行中的工作（去重靠這個索引，不怕兩個 session 同時送出）
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs(collection,file_hash)
+                WHERE status IN ('queued','running');
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status,id);
+            """
+        )
+        # 上次 process 結束時還在跑的工作：重新排隊
+        self._conn.execute("UPDATE jobs SET status=?,started_at=NULL WHERE status=?",(QUEUED,RUNNING))
+        self._conn.commit()
+        self._worker=threading.Thread(target=self._run,name="ingest-jobs",daemon=True)
+        self._worker.start()
+
+    def submit(self,collection:str,name:str,path:str,file_hash:str,params:Dict)->int:
+        """
+        排一個匯入工作；同一份內容已經在排隊/執行中就回傳那一個的 id
+        """
+        now=time.time()
+        with self._lock:
+            try:
+                cur=self._conn.execute(
+                    "INSERT INTO jobs(collection,name,path,file_hash,params,status,created_at) VALUES (?,?,?,?,?,?,?)",
+                    (collection,name,path,file_hash,json.dumps(params,ensure_ascii=False),QUEUED,now),
+                )
+                job_id=cur.lastrowid
+            except sqlite3.IntegrityError:
+                job_id=self._conn.execute(
+                    "SELECT id FROM jobs WHERE collection=? AND file_hash=? AND status IN (?,?)",
+                    (collection,file_hash,QUEUED,RUNNING),
+                ).fetchone()["id"]
+            self._conn.commit()
+        self._wake.set()
+        return job_id
+
+    def _row(self,r:sqlite3.Row)->Dict:
+        d=dict(r)
+        d["params"]=json.loads(d["params"])
+        d["result"]=json.loads(d["result"]) if d["result"] else None
+        return d
+
+    def get(self,job_id:int)->Optional[Dict]:
+        with self._lock:
+            r=self._conn.execute("SELECT * FROM jobs WHERE id=?",(job_id,)).fetchone()
+        return self._row(r) if r else None
+
+    def list_jobs(self,collection:str,limit:int=20)->List[Dict]:
+        # 最新的在前
+        with self._lock:
+            rows=self._conn.execute(
+                "SELECT * FROM jobs WHERE collection=? ORDER BY id DESC LIMIT ?",(collection,int(limit)),
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def active_count(self,collection:Optional[str]=None)->int:
+        with self._lock:
+            if collection is None:
+                r=self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?,?)",(QUEUED,RUNNING)).fetchone()
+            else:
+                r=self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE collection=? AND status IN (?,?)",(collection,QUEUED,RUNNING),
+                ).fetchone()
+        return int(r[0])
+
+    def clear_finished(self,collection:str)->int:
+        with self._lock:
+            cur=self._conn.execute(
+                "DELETE FROM jobs WHERE collection=? AND status IN (?,?)",(collection,DONE,FAILED),
+            )
+            self._conn.commit()
+        return cur.rowcount
+
+    def _claim(self)->List[Dict]:
+        # 最早排隊的一個，加上同一個 collection、同一組參數的其他排隊工作（最多 batch_size 個），一起改成 running
+        with self._lock:
+            r=self._conn.execute("SELECT * FROM jobs WHERE status=? ORDER BY id LIMIT 1",(QUEUED,)).fetchone()
+            if r is None:
+                return []
+            rows=self._conn.execute(
+                "SELECT * FROM jobs WHERE status=? AND collection=? AND params=? ORDER BY id LIMIT ?",
+                (QUEUED,r["collection"],r["params"],self.batch_size),
+            ).fetchall()
+            now=time.time()
+            self._conn.executemany("UPDATE jobs SET status=?,started_at=? WHERE id=?",[(RUNNING,now,x["id"]) for x in rows])
+            self._conn.commit()
+        return [self._row(x) for x in rows]
+
+    def _update(self,job_id:int,**fields)->None:
+        cols=",".join(f"{k}=?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {cols} WHERE id=?",(*fields.values(),job_id))
+            self._conn.commit()
+
+    def _finish(self,job_id:int,result:Dict,last:Dict)->None:
+        note=result.get("note") or ""
+        # 最後一次進度可能被節流掉，結束時補寫
+        self._update(
+            job_id,
+            status=FAILED if note else DONE,
+            pages_done=int(last.get("pages_done") or 0),
+            pages_total=last.get("pages_total"),
+            chunks_done=int(result.get("chunks") or 0)+int(result.get("kept") or 0),
+            eta_s=None,
+            result=json.dumps(result,ensure_ascii=False),
+            note=note,
+            finished_at=time.time(),
+        )
+
+    def _run(self)->None:
+        while True:
+            batch=self._claim()
+            if not batch:
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+                continue
+            last={j["id"]:{"t":0.0,"p":{}} for j in batch}
+            finished=set()
+
+            def _progress(job_id:int,p:Dict)->None:
+                s=last.get(job_id)
+                if s is None or job_id in finished:
+                    return
+                s["p"]=p
+                now=time.perf_counter()
+                if now-s["t"]<self.progress_interval:
+                    return
+                s["t"]=now
+                self._update(
+                    job_id,pages_done=int(p.get("pages_done") or 0),pages_total=p.get("pages_total"),
+                    chunks_done=int(p.get("chunks_done") or 0),eta_s=p.get("eta_s"),
+                )
+
+            def _done(job_id:int,result:Dict)->None:
+                if job_id not in last or job_id in finished:
+                    return
+                finished.add(job_id)
+                self._finish(job_id,result or {},last[job_id]["p"])
+
+            err=""
+            try:
+                self.runner(batch,_progress,_done)
+            except Exception as e:
+                err=f"匯入失敗 -> {e}"
+            for j in batch:
+                if j["id"] not in finished:
+                    _done(j["id"],{"note":err or "匯入失敗 -> 沒有結果"})
@@ -0,0 +1,161 @@
+# lexical.py
+"""
+關鍵字索引（SQLite FTS5 + BM25），補向量檢索抓不到的精確字詞：條號、金額、專有名詞
+
+- 斷詞：中日韓字元切成相鄰兩字（bigram），英文小寫整個字，數字整串（去掉千分位逗號）
+- 斷好的詞用空白接起來存進 FTS5，排序用內建 bm25()
+- 查詢時先探測每個詞出現在幾段（最多數到 max_df+1 就停），太常見的詞（「員工」「規定」）不拿來查，
+  只留最稀有的幾個；百萬段等級時 OR 查詢才不會掃過大半個索引。
+  整句都是常見詞時關鍵字這邊回傳空的，交給向量檢索
+"""
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import List, Tuple, Iterable
+
+# 中日韓統一表意文字（含擴充 A）與相容字
+_CJK="㐀-䶿一-鿿豈-﫿"
+_TERM_RE=re.compile(rf"[{_CJK}]+|[a-z]+|\d+")
+_THOUSANDS_RE=re.compile(r"(?<=\d),(?=\d{3})")
+
+
+def lexical_terms(text:str)->List[str]:
+    """文字 → 詞（可重複，保留出現順序）"""
+    t=unicodedata.normalize("NFKC",text or "").lower()
+    t=_THOUSANDS_RE.sub("",t)
+    out=[]
+    for m in _TERM_RE.finditer(t):
+        w=m.group(0)
+        if "㐀"<=w[0]:
+            if len(w)==1:
+                out.append(w)
+            else:
+                out.extend(w[i:i+2] for i in range(len(w)-1))
+        else:
+            out.append(w)
+    return out
+
+
+class LexicalIndex:
+    """
+    一個 collection 一個 SQLite 檔；chunk ID 跟 Chroma 一樣（內容定址），由 rag.py 的匯入/刪除維護
+    同一個物件可以給多個 thread 共用（內部有鎖）
+    """
+
+    def __init__(self,path:str,max_df:int=2000,max_query_terms:int=12):
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path=path
+        self.max_df=int(max_df)
+        self.max_query_terms=int(max_query_terms)
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs(
+                rowid INTEGER PRIMARY KEY,chunk_id TEXT NOT NULL UNIQUE,source TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_docs_source ON docs(source);
+            CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(terms,tokenize='unicode61');
+            """
+        )
+        self._conn.commit()
+
+    def add(self,ids:List[str],docs:List[str],sources:List[str])->None:
+        """新增（同 ID 已存在就覆蓋）"""
+        if not ids:
+            return
+        with self._lock:
+            self._delete_ids_locked(ids)
+            for cid,doc,src in zip(ids,docs,sources):
+                cur=self._conn.execute("INSERT INTO docs(chunk_id,source) VALUES (?,?)",(cid,src))
+                self._conn.execute(
+                    "INSERT INTO fts(rowid,terms) VALUES (?,?)",
+                    (cur.lastrowid," ".join(lexical_terms(doc))),
+                )
+            self._conn.commit()
+
+    def _delete_ids_locked(self,ids:List[str])->int:
+        removed=0
+        for i in range(0,len(ids),500):
+            part=ids[i:i+500]
+            q=",".join("?"*len(part))
+            rows=[r[0] for r in self._conn.execute(f"SELECT rowid FROM docs WHERE chunk_id IN ({q})",part)]
+            if rows:
+                rq=",".join("?"*len(rows))
+                self._conn.execute(f"DELETE FROM fts WHERE rowid IN ({rq})",rows)
+                self._conn.execute(f"DELETE FROM docs WHERE rowid IN ({rq})",rows)
+                removed+=len(rows)
+        return removed
+
+    def delete_ids(self,ids:List[str])->int:
+        with self._lock:
+            n=self._delete_ids_locked(list(ids))
+            self._conn.commit()
+        return n
+
+    def delete_source(self,source:str)->int:
+        with self._lock:
+            rows=[r[0] for r in self._conn.execute("SELECT rowid FROM docs WHERE source=?",(source,))]
+            for i in range(0,len(rows),500):
+                part=rows[i:i+500]
+                q=",".join("?"*len(part))
+                self._conn.execute(f"DELETE FROM fts WHERE rowid IN ({q})",part)
+                self._conn.execute(f"DELETE FROM docs WHERE rowid IN ({q})",part)
+            self._conn.commit()
+        return len(rows)
+
+    def clear(self)->None:
+        with self._lock:
+            self._conn.execute("DELETE FROM fts")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def count(self)->int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _query_terms_locked(self,question:str)->List[str]:
+        # fts5vocab 的 doc 數要掃完整個 posting list，常見詞很慢；這裡數到 max_df+1 就停
+        found=[]
+        for t in dict.fromkeys(lexical_terms(question)):
+            df=self._conn.execute(
+                "SELECT COUNT(*) FROM (SELECT rowid FROM fts WHERE fts MATCH ? LIMIT ?)",
+                ('"'+t.replace('"','""')+'"',self.max_df+1),
+            ).fetchone()[0]
+            if 0<df<=self.max_df:
+                found.append((df,t))
+        found.sort()
+        return [t for _,t in found[:self.max_query_terms]]
+
+    def search(self,question:str,k:int=20)->List[Tuple[str,float]]:
+        """回傳 [(chunk_id, score)]，score 越大越相關（bm25 取負號）"""
+        with self._lock:
+            terms=self._query_terms_locked(question)
+            if not terms:
+                return []
+            match=" OR ".join('"'+t.replace('"','""')+'"' for t in terms)
+            rows=self._conn.execute(
+                "SELECT d.chunk_id,-bm25(fts) AS s FROM fts JOIN docs d ON d.rowid=fts.rowid "
+                "WHERE fts MATCH ? ORDER BY bm25(fts) LIMIT ?",
+                (match,int(k)),
+            ).fetchall()
+        return [(cid,float(s)) for cid,s in rows]
+
+    def rebuild(self,items:Iterable[Tuple[str,str,str]],batch_size:int=1000)->int:
+        """整個重建：items 是 (chunk_id, doc, source)；回傳筆數"""
+        self.clear()
+        n=0
+        buf=[]
+        for it in items:
+            buf.append(it)
+            if len(buf)>=batch_size:
+                self.add([x[0] for x in buf],[x[1] for x in buf],[x[2] for x in buf])
+                n+=len(buf)
+                buf=[]
+        if buf:
+            self.add([x[0] for x in buf],[x[1] for x in buf],[x[2] for x in buf])
+            n+=len(buf)
+        return n
@@ -0,0 +1,124 @@
+# manifest.py
+import os
+import time
+import sqlite3
+import threading
+from typing import List, Dict, Optional
+
+
+class Manifest:
+    """
+    每份已匯入文件的摘要（SQLite）：chunk 數、頁數、file_hash、匯入時間、切段參數
+    - ingest / 刪除時順手更新，資料庫頁面看狀態就不用把所有 chunk 的 metadata 抓回來
+    - totals 表由 trigger 維護，文件數 / chunk 總數是 O(1) 查詢
+    - 以 collection 名稱分開記；同一個物件可以給多個 thread 共用（內部有鎖）
+    """
+
+    def __init__(self,path:str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path=path
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources(
+                collection TEXT NOT NULL,source TEXT NOT NULL,
+                chunks INTEGER NOT NULL,pages INTEGER NOT NULL,file_hash TEXT,
+                ingested_at REAL NOT NULL,chunk_size INTEGER,overlap INTEGER,
+                chunk_mode TEXT,embed_model TEXT,
+                PRIMARY KEY(collection,source));
+            CREATE TABLE IF NOT EXISTS totals(
+                collection TEXT PRIMARY KEY,sources INTEGER NOT NULL,chunks INTEGER NOT NULL);
+            CREATE TRIGGER IF NOT EXISTS trg_sources_ins AFTER INSERT ON sources BEGIN
+                INSERT OR IGNORE INTO totals(collection,sources,chunks) VALUES (NEW.collection,0,0);
+                UPDATE totals SET sources=sources+1,chunks=chunks+NEW.chunks WHERE collection=NEW.collection;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_sources_upd AFTER UPDATE ON sources BEGIN
+                UPDATE totals SET chunks=chunks-OLD.chunks+NEW.chunks WHERE collection=NEW.collection;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_sources_del AFTER DELETE ON sources BEGIN
+                UPDATE totals SET sources=sources-1,chunks=chunks-OLD.chunks WHERE collection=OLD.collection;
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def upsert(
+        self,
+        collection:str,
+        source:str,
+        chunks:int,
+        pages:int,
+        file_hash:Optional[str]=None,
+        chunk_size:Optional[int]=None,
+        overlap:Optional[int]=None,
+        chunk_mode:Optional[str]=None,
+        embed_model:Optional[str]=None,
+        ingested_at:Optional[float]=None,
+    )->None:
+        row=(
+            collection,source,int(chunks),int(pages),file_hash,
+            time.time() if ingested_at is None else float(ingested_at),
+            chunk_size,overlap,chunk_mode,embed_model,
+        )
+        with self._lock:
+            # 用 UPSERT（不是 INSERT OR REPLACE），才會觸發 UPDATE trigger
+            self._conn.execute(
+                "INSERT INTO sources(collection,source,chunks,pages,file_hash,ingested_at,chunk_size,overlap,chunk_mode,embed_model) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT(collection,source) DO UPDATE SET "
+                "chunks=excluded.chunks,pages=excluded.pages,file_hash=excluded.file_hash,"
+                "ingested_at=excluded.ingested_at,chunk_size=excluded.chunk_size,overlap=excluded.overlap,"
+                "chunk_mode=excluded.chunk_mode,embed_model=excluded.embed_model",
+                row,
+            )
+            self._conn.commit()
+
+    def remove(self,collection:str,source:str)->None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sources WHERE collection=? AND source=?",(collection,source))
+            self._conn.commit()
+
+    def clear(self,collection:str)->None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sources WHERE collection=?",(collection,))
+            self._conn.execute("DELETE FROM totals WHERE collection=?",(collection,))
+            self._conn.commit()
+
+    def totals(self,collection:str)->Dict:
+        with self._lock:
+            row=self._conn.execute("SELECT sources,chunks FROM totals WHERE collection=?",(collection,)).fetchone()
+        return {"unique_sources":row[0] if row else 0,"total_chunks":row[1] if row else 0}
+
+    def get(self,collection:str,source:str)->Optional[Dict]:
+        rows=self._select("WHERE collection=? AND source=?",(collection,source))
+        return rows[0] if rows else None
+
+    def list_sources(self,collection:str)->List[Dict]:
+        return self._select("WHERE collection=? ORDER BY source",(collection,))
+
+    def _select(self,where:str,args:tuple)->List[Dict]:
+        cols=["source","chunks","pages","file_hash","ingested_at","chunk_size","overlap","chunk_mode","embed_model"]
+        with self._lock:
+            rows=self._conn.execute(f"SELECT {','.join(cols)} FROM sources {where}",args).fetchall()
+        return [dict(zip(cols,r)) for r in rows]
+
+    def rebuild(self,collection:str,entries:List[Dict])->None:
+        """整個 collection 的紀錄換成 entries（每筆欄位同 upsert 的參數）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM sources WHERE collection=?",(collection,))
+            self._conn.execute("DELETE FROM totals WHERE collection=?",(collection,))
+            now=time.time()
+            self._conn.executemany(
+                "INSERT INTO sources(collection,source,chunks,pages,file_hash,ingested_at,chunk_size,overlap,chunk_mode,embed_model) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?)",
+                [
+                    (
+                        collection,e["source"],int(e.get("chunks",0)),int(e.get("pages",0)),e.get("file_hash"),
+                        e.get("ingested_at") or now,e.get("chunk_size"),e.get("overlap"),e.get("chunk_mode"),e.get("embed_model"),
+                    )
+                    for e in entries
+                ],
+            )
+            self._conn.commit()
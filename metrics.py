@@ -0,0 +1,206 @@
+# metrics.py
+"""
+行程內的效能指標：每個階段花多少時間、Ollama 用了多少 token
+
+- 直方圖（observe）：最近 window 筆算 p50/p95/p99（畫面用），另外累計固定 bucket 的次數（Prometheus 用）
+- 計數器（inc）：只會增加，例如 prompt / eval token 數
+- gauge：登記一個函式，匯出時才呼叫（例如排程器的佇列深度）
+- to_prometheus()：Prometheus text format（0.0.4），可以下載或開 HTTP exporter 給監控系統抓
+- 整個 process 共用一份（get_metrics()），同一個物件可以給多個 thread 共用（內部有鎖）
+"""
+import time
+import threading
+import contextlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from typing import List, Dict, Tuple, Callable, Optional, Iterator
+
+# 秒數用的 bucket：從幾毫秒（查詢）到幾分鐘（大檔匯入）
+DEFAULT_BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0,120.0,300.0)
+
+LabelKey=Tuple[Tuple[str,str],...]
+
+
+def _label_key(labels:Dict)->LabelKey:
+    return tuple(sorted((k,str(v)) for k,v in labels.items()))
+
+
+def _esc(v:str)->str:
+    return v.replace("\\","\\\\").replace("\n","\\n").replace('"','\\"')
+
+
+def _fmt_labels(key:LabelKey,extra:Optional[Tuple[str,str]]=None)->str:
+    items=list(key)+([extra] if extra else [])
+    if not items:
+        return ""
+    return "{"+",".join(f'{k}="{_esc(v)}"' for k,v in items)+"}"
+
+
+def _pct(s:List[float],q:float)->float:
+    return s[min(len(s)-1,int(q*len(s)))] if s else 0.0
+
+
+class _Histogram:
+    def __init__(self,buckets:Tuple[float,...],window:int):
+        self.buckets=buckets
+        self.counts=[0]*len(buckets)
+        self.count=0
+        self.sum=0.0
+        self.recent=deque(maxlen=window)
+
+    def observe(self,v:float)->None:
+        self.count+=1
+        self.sum+=v
+        self.recent.append(v)
+        for i,b in enumerate(self.buckets):
+            if v<=b:
+                self.counts[i]+=1
+                break
+
+
+class Metrics:
+    """
+    window：每組標籤保留最近幾筆算百分位數
+    """
+
+    def __init__(self,window:int=2048,buckets:Tuple[float,...]=DEFAULT_BUCKETS):
+        self.window=int(window)
+        self.buckets=tuple(buckets)
+        self._lock=threading.Lock()
+        self._hist:Dict[str,Dict[LabelKey,_Histogram]]={}
+        self._counters:Dict[str,Dict[LabelKey,float]]={}
+        self._gauges:Dict[str,Callable[[],Dict]]={}
+        self._help:Dict[str,str]={}
+
+    def describe(self,name:str,text:str)->None:
+        # Prometheus 的 # HELP
+        with self._lock:
+            self._help[name]=text
+
+    def observe(self,name:str,value:float,**labels)->None:
+        key=_label_key(labels)
+        with self._lock:
+            h=self._hist.setdefault(name,{}).get(key)
+            if h is None:
+                h=self._hist[name][key]=_Histogram(self.buckets,self.window)
+            h.observe(float(value))
+
+    def inc(self,name:str,value:float=1.0,**labels)->None:
+        key=_label_key(labels)
+        with self._lock:
+            c=self._counters.setdefault(name,{})
+            c[key]=c.get(key,0.0)+float(value)
+
+    def gauge(self,name:str,fn:Callable[[],Dict])->None:
+        """
+        fn() 回傳 {標籤 dict 的 tuple 或 (): 數值}；最簡單是回傳 {(): 值}
+        匯出時才呼叫，不用一直更新
+        """
+        with self._lock:
+            self._gauges[name]=fn
+
+    @contextlib.contextmanager
+    def timer(self,name:str,**labels)->Iterator[None]:
+        t0=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name,time.perf_counter()-t0,**labels)
+
+    def snapshot(self)->Dict:
+        """
+        histograms：[{name, labels, count, sum, mean, p50, p95, p99, max}]（百分位數只看最近 window 筆）
+        counters：[{name, labels, value}]
+        """
+        with self._lock:
+            hs=[]
+            for name,series in self._hist.items():
+                for key,h in series.items():
+                    s=sorted(h.recent)
+                    hs.append({
+                        "name":name,"labels":dict(key),"count":h.count,"sum":h.sum,
+                        "mean":(h.sum/h.count) if h.count else 0.0,
+                        "p50":_pct(s,0.5),"p95":_pct(s,0.95),"p99":_pct(s,0.99),"max":s[-1] if s else 0.0,
+                    })
+            cs=[{"name":n,"labels":dict(k),"value":v} for n,series in self._counters.items() for k,v in series.items()]
+        return {"histograms":hs,"counters":cs}
+
+    def reset(self)->None:
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+    def to_prometheus(self)->str:
+        lines=[]
+        with self._lock:
+            helps=dict(self._help)
+            hist={n:{k:(list(h.counts),h.count,h.sum) for k,h in s.items()} for n,s in self._hist.items()}
+            counters={n:dict(s) for n,s in self._counters.items()}
+            gauges=dict(self._gauges)
+        for name,series in sorted(hist.items()):
+            if name in helps:
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key,(counts,count,total) in sorted(series.items()):
+                cum=0
+                for b,c in zip(self.buckets,counts):
+                    cum+=c
+                    lines.append(f"{name}_bucket{_fmt_labels(key,('le',repr(float(b))))} {cum}")
+                lines.append(f"{name}_bucket{_fmt_labels(key,('le','+Inf'))} {count}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {total!r}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {count}")
+        for name,series in sorted(counters.items()):
+            if name in helps:
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key,v in sorted(series.items()):
+                lines.append(f"{name}{_fmt_labels(key)} {v!r}")
+        for name,fn in sorted(gauges.items()):
+            try:
+                values=fn()
+            except Exception:
+                continue
+            if name in helps:
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels,v in values.items():
+                key=_label_key(dict(labels))
+                lines.append(f"{name}{_fmt_labels(key)} {float(v)!r}")
+        return "\n".join(lines)+"\n"
+
+    def start_http_exporter(self,port:int,host:str="0.0.0.0")->ThreadingHTTPServer:
+        """
+        背景開一個 HTTP server：GET /metrics 回 Prometheus text
+        """
+        registry=self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def log_message(self,fmt,*args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0]!="/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body=registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type","text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length",str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        srv=ThreadingHTTPServer((host,int(port)),_Handler)
+        srv.daemon_threads=True
+        threading.Thread(target=srv.serve_forever,name="metrics-exporter",daemon=True).start()
+        return srv
+
+
+_METRICS=Metrics()
+_METRICS.describe("rag_stage_seconds","Seconds per pipeline stage (embed_query, vector_query, lexical_query, rerank, retrieve, build_prompt, chat_queue, chat_ttft, chat, ingest_extract, ingest_chunk, ingest_embed, ingest_write, ingest_file)")
+_METRICS.describe("rag_llm_tokens_total","Tokens reported by Ollama (kind=prompt|eval)")
+_METRICS.describe("rag_llm_requests_total","Chat requests sent to Ollama")
+
+
+def get_metrics()->Metrics:
+    return _METRICS
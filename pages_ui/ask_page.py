@@ -1,6 +1,7 @@
 # pages_ui/ask_page.py
 import streamlit as st
 from config import FAQ
+from caches import AnswerCache
 from components.settings_dialog import render_settings_button
 
 def _set_faq_and_jump(q:str):
@@ -8,6 +9,11 @@ def _set_faq_and_jump(q:str):
     st.session_state.pending_question=q
     st.session_state.auto_ask=True
 
+def _submit_callback():
+    # 送出只記下問題；真正的檢索/生成在「回答」區塊裡跑，串流文字才會出現在對的位置
+    st.session_state.pending_question=st.session_state.q_input.strip()
+    st.session_state.auto_ask=True
+
 def _clear_chat_callback():
     # ✅ 用 callback 避免 StreamlitAPIException（不要在 widget 之後直接改 key）
     st.session_state.history=[]
@@ -16,43 +22,218 @@ def _clear_chat_callback():
     st.session_state.pending_question=""
     st.session_state.auto_ask=False
 
-def _ask_flow(question:str,retrieve_fn,build_prompt_fn,chat_fn,collection):
+def _follow_flight(q:str,flight)->bool:
+    """
+    同一題已經有人在跑：跟著看同一段串流，結束後拿同一份引用內容
+    帶頭的被中斷（沒有結果）就回傳 False，呼叫端自己重跑
+    """
+    notice=st.info("🔁 同樣的問題正在回答中，一起等結果…")
+    box=st.empty()
+
+    def _pieces():
+        for i,piece in enumerate(flight.stream()):
+            if i==0:
+                notice.empty()
+            yield piece
+    with box:
+        st.write_stream(_pieces())
+    flight.wait()
+    notice.empty()
+    if flight.aborted or flight.result is None:
+        box.empty()
+        return False
+    r=flight.result
+    st.session_state.last_hits=r["hits"]
+    st.session_state.history.append({**r,"q":q,"shared":True})
+    return True
+
+def _ask_flow(question:str,retrieve_fn,build_prompt_fn,chat_fn,collection,query_cache=None,answer_cache=None,version_fn=None,chat_stream_fn=None,lexical=None,reranker=None,rerank_budget:float=0.8,single_flight=None):
     q=(question or "").strip()
     if not q:
         return
 
+    # 設定裡關掉混合檢索時只用向量
+    if not st.session_state.get("hybrid_search",True):
+        lexical=None
+
+    # 同一題、同樣參數、知識庫沒變過 → 直接拿之前的回答；正在有人跑 → 一起等同一份回答
+    key=None
+    if version_fn is not None and (answer_cache is not None or single_flight is not None):
+        key=AnswerCache.key(
+            q,
+            top_k=int(st.session_state.top_k),
+            model=st.session_state.llm_model,
+            temperature=float(st.session_state.temperature),
+            version=version_fn(collection),
+            embed_model=st.session_state.embed_model,
+            retrieval=(
+                ("hybrid" if lexical is not None else "vector")
+                +(f"+rerank{int(st.session_state.rerank_candidates)}" if reranker is not None else "")
+                +f"+ctx{int(st.session_state.context_tokens)}"
+            ),
+        )
+    if answer_cache is not None and key is not None:
+        cached=answer_cache.get(key)
+        if cached is not None:
+            st.session_state.last_hits=cached["hits"]
+            st.session_state.history.append({"q":q,"a":cached["answer"],"hits":cached["hits"],"cached":True})
+            return
+
+    if single_flight is None or key is None:
+        _run_pipeline(q,key,None,retrieve_fn,build_prompt_fn,chat_fn,collection,query_cache,answer_cache,chat_stream_fn,lexical,reranker,rerank_budget)
+        return
+    while True:
+        flight,leader=single_flight.begin(key)
+        if leader:
+            break
+        if _follow_flight(q,flight):
+            return
+    try:
+        _run_pipeline(q,key,flight,retrieve_fn,build_prompt_fn,chat_fn,collection,query_cache,answer_cache,chat_stream_fn,lexical,reranker,rerank_budget)
+    finally:
+        single_flight.end(key,flight)
+
+def _run_pipeline(q:str,key,flight,retrieve_fn,build_prompt_fn,chat_fn,collection,query_cache,answer_cache,chat_stream_fn,lexical,reranker,rerank_budget:float):
+    # 檢索 → 組 prompt → 生成；flight 不是 None 時邊生成邊分給同時問同一題的人
     notice=st.info("🔎 檢索中…")  # 不要全畫面空白，只顯示字樣
-    hits=retrieve_fn(q,collection,embed_model=st.session_state.embed_model,top_k=int(st.session_state.top_k))
-    st.session_state.last_hits=hits
+    ret={}
+    hits=retrieve_fn(
+        q,collection,
+        embed_model=st.session_state.embed_model,
+        top_k=int(st.session_state.top_k),
+        query_cache=query_cache,
+        lexical=lexical,
+        reranker=reranker,
+        rerank_candidates=int(st.session_state.rerank_candidates),
+        rerank_budget=rerank_budget,
+        stats=ret,
+    )
 
     notice.info("🧠 生成中…")
-    system,user=build_prompt_fn(q,hits)
+    pst={}
+    system,user=build_prompt_fn(q,hits,max_context_tokens=int(st.session_state.context_tokens),stats=pst)
+    # 相鄰段落合併過，引用內容要跟 prompt 裡的 [1]、[2] 對得上
+    hits=pst.get("hits",hits)
+    st.session_state.last_hits=hits
 
+    failed=False
+    gen={}
     try:
-        ans=chat_fn(system,user,model=st.session_state.llm_model,temperature=float(st.session_state.temperature)).strip()
+        if chat_stream_fn is not None:
+            # 邊生成邊顯示；第一段文字出來就把「生成中」拿掉
+            def _on_queue(pos:int):
+                # Ollama 忙的時候顯示排第幾個；輪到了（pos=0）再換回「生成中」
+                if pos:
+                    notice.info(f"⏳ 排隊中：第 {pos} 位（其他人的問題正在生成）")
+                else:
+                    notice.info("🧠 生成中…")
+
+            def _pieces():
+                for i,piece in enumerate(chat_stream_fn(
+                    system,user,
+                    model=st.session_state.llm_model,
+                    temperature=float(st.session_state.temperature),
+                    stats=gen,
+                    on_queue=_on_queue,
+                )):
+                    if i==0:
+                        notice.empty()
+                    if flight is not None:
+                        flight.publish(piece)
+                    yield piece
+            ans=st.write_stream(_pieces())
+            ans=(ans if isinstance(ans,str) else "".join(str(x) for x in ans)).strip()
+        else:
+            ans=chat_fn(system,user,model=st.session_state.llm_model,temperature=float(st.session_state.temperature)).strip()
     except Exception as e:
         ans=f"⚠️ 模型無法回覆：{e}"
+        failed=True
 
     notice.empty()
 
     if not ans:
         ans="⚠️ 模型回覆是空白。請確認 Ollama 服務有在跑，且已下載模型。"
+        failed=True
+
+    # 錯誤訊息不快取，Ollama 恢復後才會重新回答
+    if answer_cache is not None and key is not None and not failed:
+        answer_cache.put(key,ans,hits)
+
+    entry={"q":q,"a":ans,"hits":hits,"gen":gen,"rerank":ret.get("rerank"),"prompt":{k:v for k,v in pst.items() if k!="hits"}}
+    if flight is not None:
+        # 沒串流（或失敗）時跟著的人還沒看到任何文字：整段補上
+        if chat_stream_fn is None or failed:
+            flight.publish(ans)
+        flight.finish(entry)
+    st.session_state.history.append(entry)
+
+def _render_cache_stats(query_cache,answer_cache,single_flight=None)->None:
+    if query_cache is not None:
+        cs=query_cache.stats()
+        st.caption(
+            f"⚡ 問題向量快取：{cs['entries']} 題｜命中 {cs['hits']}／未命中 {cs['misses']}"
+            f"（命中率 {cs['hit_rate']*100:.1f}%）｜約省下 {cs['saved_seconds']:.1f} 秒"
+        )
+    if answer_cache is not None:
+        cs=answer_cache.stats()
+        st.caption(
+            f"💬 回答快取：{cs['entries']} 題｜命中 {cs['hits']}／未命中 {cs['misses']}"
+            f"（命中率 {cs['hit_rate']*100:.1f}%）"
+        )
+    if single_flight is not None:
+        fs=single_flight.stats()
+        st.caption(f"🔁 同時提問合併：共用 {fs['shared']} 次｜進行中 {fs['in_flight']} 題")
 
-    st.session_state.history.append({"q":q,"a":ans,"hits":hits})
+def _render_gen_stats(gen:dict)->None:
+    if not gen or "ttft_s" not in gen:
+        return
+    msg=(
+        f"⏱️ 首字 {gen['ttft_s']:.2f} 秒｜{gen.get('tokens_per_s',0.0):.1f} tokens/s"
+        f"｜共 {gen.get('tokens',0)} tokens、{gen.get('total_s',0.0):.1f} 秒"
+    )
+    if gen.get("queue_s",0.0)>=0.05:
+        msg+=f"｜排隊 {gen['queue_s']:.1f} 秒"
+    st.caption(msg)
+
+def _render_queue_stats(scheduler)->None:
+    if scheduler is None:
+        return
+    s=scheduler.stats()
+    chat=s["by_priority"].get("chat",{})
+    st.caption(
+        f"🚦 Ollama 佇列：排隊 {s['depth']}／執行中 {s['running']}（上限 {s['limit']}）"
+        f"｜生成等待 p95 {chat.get('wait_p95',0.0):.1f} 秒、生成 p50 {chat.get('service_p50',0.0):.1f} 秒"
+    )
 
-def render_ask_page(retrieve_fn,build_prompt_fn,chat_fn,collection,get_db_status_fn):
+def _render_prompt_info(info)->None:
+    if not info:
+        return
+    saved=info["context_tokens_raw"]-info["context_tokens"]
+    msg=f"🧾 Prompt 約 {info['prompt_tokens']} tokens（context {info['context_tokens']}，合併/去重/上限省下 {saved}）"
+    if info.get("dropped"):
+        msg+=f"｜{info['dropped']} 段超過上限沒放入"
+    st.caption(msg)
+
+def _render_rerank_info(info)->None:
+    if not info:
+        return
+    if info["reranked"]:
+        st.caption(f"🔀 已重新排序（{info['seconds']*1000:.0f} ms）")
+    else:
+        st.caption(f"🔀 未重新排序：{info['reason']}（照原本檢索順序）")
+
+def render_ask_page(retrieve_fn,build_prompt_fn,chat_fn,collection,get_db_status_fn,query_cache=None,answer_cache=None,get_version_fn=None,chat_stream_fn=None,lexical=None,reranker=None,rerank_budget:float=0.8,scheduler=None,single_flight=None):
     # 上方留幾行空間（你說不要太貼頂）
     st.write("")
     st.write("")
 
-    # 若是從常用問題跳過來：先切到提問頁，再開始回答
+    # 有待回答的問題（送出或從常用問題跳過來）：先把問題放進輸入框，下面「回答」區塊再開始跑
+    pending=""
     if st.session_state.get("auto_ask",False) and st.session_state.get("pending_question",""):
-        pq=st.session_state.pending_question
-        st.session_state.q_input=pq
-        _ask_flow(pq,retrieve_fn,build_prompt_fn,chat_fn,collection)
+        pending=st.session_state.pending_question
+        st.session_state.q_input=pending
         st.session_state.auto_ask=False
         st.session_state.pending_question=""
-        st.rerun()
 
     left,right=st.columns([1.25,1],gap="large")
 
@@ -62,23 +243,48 @@ def render_ask_page(retrieve_fn,build_prompt_fn,chat_fn,collection,get_db_status
 
         c1,c2=st.columns(2)
         with c1:
-            if st.button("送出",type="primary",use_container_width=True,disabled=not st.session_state.q_input.strip()):
-                _ask_flow(st.session_state.q_input,retrieve_fn,build_prompt_fn,chat_fn,collection)
-                st.rerun()
+            st.button(
+                "送出",type="primary",use_container_width=True,
+                disabled=not st.session_state.q_input.strip(),
+                on_click=_submit_callback,
+            )
         with c2:
             st.button("清空對話",use_container_width=True,on_click=_clear_chat_callback)
 
         st.subheader("回答")
-        if not st.session_state.history:
+        if pending:
+            _ask_flow(
+                pending,retrieve_fn,build_prompt_fn,chat_fn,collection,
+                query_cache=query_cache,answer_cache=answer_cache,version_fn=get_version_fn,
+                chat_stream_fn=chat_stream_fn,lexical=lexical,
+                reranker=reranker,rerank_budget=rerank_budget,
+                single_flight=single_flight,
+            )
+            # 引用內容、歷史問題要用新結果重畫
+            st.rerun()
+        elif not st.session_state.history:
             st.caption("尚未提問。")
         else:
-            st.write(st.session_state.history[-1]["a"])
+            last=st.session_state.history[-1]
+            st.write(last["a"])
+            if last.get("cached"):
+                st.caption("⚡ 來自回答快取（知識庫與設定都沒變）")
+            else:
+                if last.get("shared"):
+                    st.caption("🔁 有人同時問了同一題，共用這次的檢索與回答")
+                _render_gen_stats(last.get("gen"))
+                _render_rerank_info(last.get("rerank"))
+                _render_prompt_info(last.get("prompt"))
 
     with right:
         st.subheader("常用問題")
         cat=st.selectbox("分類",list(FAQ.keys()))
         for item in FAQ[cat]:
             st.button(item,use_container_width=True,on_click=_set_faq_and_jump,args=(item,))
+        _render_cache_stats(query_cache,answer_cache,single_flight)
+        _render_queue_stats(scheduler)
+        if st.session_state.get("rerank") and reranker is None:
+            st.caption("🔀 重新排序未啟用：需要安裝 sentence-transformers（見 requirements.txt）")
 
     st.write("")
     st.markdown('<div class="glass">',unsafe_allow_html=True)
@@ -1,50 +1,192 @@
 # pages_ui/db_page.py
+import datetime
 import streamlit as st
 from components.settings_dialog import render_settings_button
 
-def render_db_page(ingest_uploaded_pdfs_fn,clear_all_fn,get_db_status_fn,collection,upload_dir:str):
+def _render_cache_stats(embed_cache)->None:
+    cs=embed_cache.stats()
+    mb=cs["bytes"]/1024/1024
+    max_mb=cs["max_bytes"]/1024/1024
+    st.markdown(
+        f'<div class="glass">🗃️ Embedding 快取：<b>{cs["entries"]}</b> 筆（{mb:.1f} / {max_mb:.0f} MB）'
+        f'　｜　命中 <b>{cs["hits"]}</b>／未命中 <b>{cs["misses"]}</b>（命中率 {cs["hit_rate"]*100:.1f}%）</div>',
+        unsafe_allow_html=True,
+    )
+
+def _chunk_params()->dict:
+    # token 模式時 chunk_size / overlap 改用 token 數
+    if st.session_state.chunk_mode=="token":
+        return {
+            "chunk_size":int(st.session_state.chunk_tokens),
+            "overlap":int(st.session_state.overlap_tokens),
+            "chunk_mode":"token",
+        }
+    return {
+        "chunk_size":int(st.session_state.chunk_size),
+        "overlap":int(st.session_state.overlap),
+        "chunk_mode":"char",
+    }
+
+_JOB_STATUS={"queued":"⏳ 排隊中","running":"⚙️ 匯入中","done":"✅ 完成","failed":"⚠️ 失敗"}
+
+def _fmt_eta(secs)->str:
+    if secs is None:
+        return ""
+    secs=int(round(secs))
+    return f"{secs//60} 分 {secs%60} 秒" if secs>=60 else f"{secs} 秒"
+
+def _job_row(j:dict)->dict:
+    r=j["result"] or {}
+    total=j["pages_total"]
+    if j["status"]=="done":
+        frac=1.0
+    elif total:
+        frac=min(1.0,j["pages_done"]/total)
+    else:
+        frac=0.0
+    note=j["note"] or ("內容沒變，已略過" if r.get("unchanged") else "")
+    return {
+        "檔案":j["name"],
+        "狀態":_JOB_STATUS.get(j["status"],j["status"]),
+        "進度":frac,
+        "頁數":f"{j['pages_done']}/{total}" if total else "",
+        "段數":j["chunks_done"],
+        "剩餘時間":_fmt_eta(j["eta_s"]) if j["status"]=="running" else "",
+        "說明":note,
+    }
+
+def _render_jobs(jobs,collection,poll_s:float)->None:
+    # 有工作在跑才定時更新；全部跑完就整頁 rerun 一次，上面的文件數/段數才會更新
+    active=jobs.active_count(collection.name)
+    if not active and not jobs.list_jobs(collection.name,limit=1):
+        return
+
+    @st.fragment(run_every=poll_s if active else None)
+    def _panel():
+        rows=jobs.list_jobs(collection.name)
+        now_active=jobs.active_count(collection.name)
+        st.markdown(f"**匯入工作**（排隊/匯入中 {now_active} 份）")
+        st.dataframe(
+            [_job_row(j) for j in rows],
+            use_container_width=True,
+            hide_index=True,
+            column_config={"進度":st.column_config.ProgressColumn("進度",min_value=0.0,max_value=1.0,format="percent")},
+        )
+        if now_active<len(rows):
+            if st.button("清除已結束的工作",key="clear_finished_jobs"):
+                jobs.clear_finished(collection.name)
+                st.rerun()
+        if active and not now_active:
+            st.rerun()
+
+    _panel()
+
+def _render_last_delete()->None:
+    msg=st.session_state.get("last_delete")
+    if msg:
+        st.success(msg)
+        st.session_state.last_delete=None
+
+def _render_documents(manifest,collection,delete_source_fn=None,lexical=None)->None:
+    rows=manifest.list_sources(collection.name)
+    if not rows:
+        return
+    with st.expander(f"文件清單（{len(rows)} 份）"):
+        st.dataframe(
+            [
+                {
+                    "文件":r["source"],
+                    "頁數":r["pages"],
+                    "段數":r["chunks"],
+                    "切段":(f"{r['chunk_mode'] or 'char'} {r['chunk_size']}/{r['overlap']}" if r["chunk_size"] is not None else ""),
+                    "Embedding 模型":r["embed_model"] or "",
+                    "匯入時間":datetime.datetime.fromtimestamp(r["ingested_at"]).strftime("%Y-%m-%d %H:%M"),
+                    "SHA-256":(r["file_hash"] or "")[:12],
+                }
+                for r in rows
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
+        if delete_source_fn is not None:
+            d1,d2=st.columns([3,1])
+            with d1:
+                target=st.selectbox("刪除文件",[r["source"] for r in rows],label_visibility="collapsed")
+            with d2:
+                if st.button("刪除這份文件",use_container_width=True):
+                    try:
+                        removed,secs=delete_source_fn(collection,target,manifest=manifest,lexical=lexical)
+                        st.session_state.last_delete=f"已刪除 {target}：{removed} 段（{secs:.2f} 秒）。"
+                    except Exception as e:
+                        st.session_state.last_delete=None
+                        st.error(f"刪除失敗 -> {e}")
+                        return
+                    st.rerun()
+
+def render_db_page(clear_all_fn,get_db_status_fn,collection,upload_dir:str,jobs,enqueue_fn,embed_cache=None,manifest=None,sync_manifest_fn=None,delete_source_fn=None,lexical=None,jobs_poll_s:float=1.0):
     st.write("")
     st.write("")
 
     st.markdown("## 資料庫")
 
-    status=get_db_status_fn(collection)
+    status=get_db_status_fn(collection,manifest=manifest) if manifest is not None else get_db_status_fn(collection)
     st.markdown(
         f'<div class="glass">📦 已匯入文件數：<b>{status["unique_sources"]}</b>　｜　🧩 內容段數：<b>{status["total_chunks"]}</b></div>',
         unsafe_allow_html=True,
     )
+    busy=jobs.active_count(collection.name)
+    # 背景匯入中，清單本來就會跟段數對不起來
+    if status.get("stale") and sync_manifest_fn is not None and not busy:
+        st.warning("文件清單跟資料庫的段數對不起來（可能有匯入中途失敗）。")
+        if st.button("重建文件清單"):
+            sync_manifest_fn(collection,manifest)
+            st.rerun()
+    _render_last_delete()
+    if manifest is not None:
+        _render_documents(manifest,collection,delete_source_fn=delete_source_fn,lexical=lexical)
+    if embed_cache is not None:
+        _render_cache_stats(embed_cache)
     st.write("")
 
     st.markdown('<div class="glass">',unsafe_allow_html=True)
     st.subheader("上傳 PDF")
-    up_files=st.file_uploader(" ",type=["pdf"],accept_multiple_files=True)
+    # 排進佇列後換一個 key，清掉已選的檔案
+    st.session_state.setdefault("uploader_key",0)
+    up_files=st.file_uploader(" ",type=["pdf"],accept_multiple_files=True,key=f"uploader_{st.session_state.uploader_key}")
+
+    _render_jobs(jobs,collection,jobs_poll_s)
 
     c1,c2=st.columns([1,1])
     with c1:
         if st.button("匯入到資料庫",type="primary",use_container_width=True,disabled=not up_files):
-            notice=st.info("📥 匯入中…")
-            scanned,added,skipped,notes=ingest_uploaded_pdfs_fn(
-                uploaded_files=up_files,
-                upload_dir=upload_dir,
-                collection=collection,
-                embed_model=st.session_state.embed_model,
-                chunk_size=int(st.session_state.chunk_size),
-                overlap=int(st.session_state.overlap),
+            job_ids,notes=enqueue_fn(
+                jobs,
+                up_files,
+                upload_dir,
+                collection,
+                {
+                    "embed_model":st.session_state.embed_model,
+                    **_chunk_params(),
+                    "embed_batch_size":int(st.session_state.embed_batch_size),
+                    "embed_concurrency":int(st.session_state.embed_concurrency),
+                    "incremental":bool(st.session_state.incremental_ingest),
+                },
             )
-            notice.empty()
-            st.success(f"完成：處理 {scanned} 份 PDF，新增/更新 {added} 段內容。")
-            if skipped>0:
-                st.warning(f"有 {skipped} 份 PDF 抽不到文字或匯入失敗（可能需要 OCR）。")
-                with st.expander("查看原因"):
-                    for n in notes:
-                        st.write("• "+n)
-            st.rerun()
+            for n in notes:
+                st.error(n)
+            if job_ids:
+                st.session_state.uploader_key+=1
+                st.rerun()
 
     with c2:
-        if st.button("清空資料庫",use_container_width=True):
-            clear_all_fn(collection)
-            st.success("已清空。")
-            st.rerun()
+        if st.button("清空資料庫",use_container_width=True,disabled=bool(busy),help="匯入工作跑完才能清空" if busy else None):
+            try:
+                removed,secs=clear_all_fn(collection,manifest=manifest,lexical=lexical)
+            except Exception as e:
+                st.error(f"清空失敗 -> {e}")
+            else:
+                st.session_state.last_delete=f"已清空：刪除 {removed} 段（{secs:.2f} 秒）。"
+                st.rerun()
 
     st.markdown("</div>",unsafe_allow_html=True)
 
@@ -0,0 +1,124 @@
+# pages_ui/metrics_page.py
+import streamlit as st
+from components.settings_dialog import render_settings_button
+
+# (stage, 顯示名稱)；依一題 / 一份文件實際經過的順序排
+_ASK_STAGES=[
+    ("embed_query","問題 embedding"),
+    ("vector_query","向量查詢"),
+    ("lexical_query","關鍵字查詢"),
+    ("retrieve","檢索合計"),
+    ("rerank","重新排序"),
+    ("build_prompt","組 prompt"),
+    ("chat_queue","生成排隊"),
+    ("chat_ttft","首字時間（不含排隊）"),
+    ("chat","生成（不含排隊）"),
+]
+_INGEST_STAGES=[
+    ("ingest_extract","抽字"),
+    ("ingest_chunk","切段"),
+    ("ingest_embed","Embedding"),
+    ("ingest_write","寫入 Chroma"),
+    ("ingest_file","整份文件"),
+]
+
+def _stage_rows(snap:dict,stages:list)->list:
+    by_stage={h["labels"].get("stage"):h for h in snap["histograms"] if h["name"]=="rag_stage_seconds"}
+    rows=[]
+    for stage,label in stages:
+        h=by_stage.get(stage)
+        if h is None or not h["count"]:
+            continue
+        rows.append({
+            "階段":label,
+            "次數":h["count"],
+            "p50 (ms)":round(h["p50"]*1000,1),
+            "p95 (ms)":round(h["p95"]*1000,1),
+            "p99 (ms)":round(h["p99"]*1000,1),
+            "平均 (ms)":round(h["mean"]*1000,1),
+            "最大 (ms)":round(h["max"]*1000,1),
+        })
+    return rows
+
+def _token_rows(snap:dict)->list:
+    by_model={}
+    for c in snap["counters"]:
+        model=c["labels"].get("model","")
+        row=by_model.setdefault(model,{"模型":model,"請求數":0,"Prompt tokens":0,"生成 tokens":0})
+        if c["name"]=="rag_llm_requests_total":
+            row["請求數"]+=int(c["value"])
+        elif c["name"]=="rag_llm_tokens_total":
+            key="Prompt tokens" if c["labels"].get("kind")=="prompt" else "生成 tokens"
+            row[key]+=int(c["value"])
+    return list(by_model.values())
+
+def _render_scheduler(scheduler)->None:
+    s=scheduler.stats()
+    st.markdown(f"**Ollama 佇列**：排隊 {s['depth']}／執行中 {s['running']}（上限 {s['limit']}）")
+    rows=[
+        {
+            "類型":name,
+            "請求數":p["requests"],
+            "排隊中":p["waiting"],
+            "等待 p50 (s)":round(p["wait_p50"],2),
+            "等待 p95 (s)":round(p["wait_p95"],2),
+            "服務 p50 (s)":round(p["service_p50"],2),
+            "服務 p95 (s)":round(p["service_p95"],2),
+        }
+        for name,p in s["by_priority"].items()
+    ]
+    st.dataframe(rows,use_container_width=True,hide_index=True)
+
+def render_metrics_page(metrics,scheduler=None,exporter_port=None):
+    st.write("")
+    st.write("")
+
+    st.markdown("## 效能指標")
+    st.caption("從這個 process 啟動後開始累計；百分位數只看每個階段最近的資料。各階段會重疊進行（例如匯入時抽字和 embedding 同時跑），加起來不等於總時間。")
+
+    snap=metrics.snapshot()
+
+    st.markdown('<div class="glass">',unsafe_allow_html=True)
+    st.subheader("提問")
+    rows=_stage_rows(snap,_ASK_STAGES)
+    if rows:
+        st.dataframe(rows,use_container_width=True,hide_index=True)
+    else:
+        st.caption("還沒有人提問。")
+    tokens=_token_rows(snap)
+    if tokens:
+        st.dataframe(tokens,use_container_width=True,hide_index=True)
+    st.markdown("</div>",unsafe_allow_html=True)
+
+    st.write("")
+    st.markdown('<div class="glass">',unsafe_allow_html=True)
+    st.subheader("匯入（每份文件）")
+    rows=_stage_rows(snap,_INGEST_STAGES)
+    if rows:
+        st.dataframe(rows,use_container_width=True,hide_index=True)
+    else:
+        st.caption("還沒有匯入過文件。")
+    st.markdown("</div>",unsafe_allow_html=True)
+
+    if scheduler is not None:
+        st.write("")
+        _render_scheduler(scheduler)
+
+    st.write("")
+    c1,c2,c3=st.columns([1,1,2])
+    with c1:
+        st.download_button(
+            "下載 Prometheus 格式",
+            data=metrics.to_prometheus(),
+            file_name="rag_metrics.prom",
+            mime="text/plain",
+            use_container_width=True,
+        )
+    with c2:
+        if st.button("重新整理",use_container_width=True):
+            st.rerun()
+    with c3:
+        if exporter_port:
+            st.caption(f"📡 Prometheus 可直接抓 http://<主機>:{exporter_port}/metrics")
+
+    render_settings_button(button_key="settings_btn_metrics")
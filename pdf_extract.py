@@ -0,0 +1,141 @@
+# pdf_extract.py
+"""
+PDF 抽字（只依賴 pypdf，讓子 process 啟動時不用 import chromadb / ollama）
+"""
+import re
+import time
+import queue
+import multiprocessing
+from typing import List, Tuple, Iterable, Iterator, Optional
+
+from pypdf import PdfReader
+
+
+def normalize_text(s:str)->str:
+    s=(s or "").replace("\r\n","\n").replace("\r","\n")
+    s=re.sub(r"[ \t]+"," ",s)
+    s=re.sub(r"\n{3,}","\n\n",s)
+    return s.strip()
+
+
+def iter_pdf_pages(pdf_path:str)->Iterator[Tuple[int,str]]:
+    # 一次抽一頁：下游可以邊抽邊 embedding
+    reader=PdfReader(pdf_path)
+    for i,page in enumerate(reader.pages,start=1):
+        t=page.extract_text() or ""
+        t=normalize_text(t)
+        if t:
+            yield (i,t)
+
+
+def pdf_page_count(pdf_path:str)->int:
+    # 只讀頁面樹，不抽字（進度條 / ETA 用）
+    return len(PdfReader(pdf_path).pages)
+
+
+def extract_pdf_pages(pdf_path:str)->List[Tuple[int,str]]:
+    return list(iter_pdf_pages(pdf_path))
+
+
+# 子 process 開始處理一份檔案時回報 (key, 開始時間)；逾時從這裡算，不含排隊、也不含消費端忙著 embedding 的時間
+_STARTED=None
+
+
+def _init_worker(started)->None:
+    global _STARTED
+    _STARTED=started
+
+
+def _extract_timed(pdf_path:str,key:int=0)->Tuple[List[Tuple[int,str]],float]:
+    # 在子 process 裡計時，排隊等待的時間不算進去
+    if _STARTED is not None:
+        _STARTED.put((key,time.time()))
+    t0=time.perf_counter()
+    pages=extract_pdf_pages(pdf_path)
+    return pages,time.perf_counter()-t0
+
+
+def iter_extract_pdfs(
+    paths:Iterable[str],
+    workers:int=4,
+    timeout:Optional[float]=120.0,
+    poll:float=0.2,
+)->Iterator[Tuple[str,List[Tuple[int,str]],float,Optional[str]]]:
+    """
+    用 process pool 平行抽字，yield (path, pages, seconds, error)
+    - 最多先送出 workers*2 份，消費端（embedding）慢的時候不會把所有文件的文字堆在記憶體裡
+    - 單一檔案從 worker 開始處理起超過 timeout 秒就記成失敗（排隊、消費端處理前面檔案的時間都不算）；
+      卡住的 worker 會連同 pool 一起砍掉重開，其他還沒做完的檔案重新排進新的 pool，不會被一份壞掉的 PDF 拖住
+    - 平常依輸入順序；重開 pool 時已經有結果的先交出去，順序可能跟輸入不同
+    """
+    todo=list(paths)
+    workers=max(1,int(workers))
+    window=workers*2
+    # spawn：Streamlit 本身有很多 thread，fork 不安全
+    ctx=multiprocessing.get_context("spawn")
+    started={}
+
+    def _drain()->None:
+        while True:
+            try:
+                key,t=started_q.get_nowait()
+            except queue.Empty:
+                return
+            started[key]=t
+
+    def _result(p:str,res)->Tuple[str,List[Tuple[int,str]],float,Optional[str]]:
+        try:
+            pages,secs=res.get(0)
+            return (p,pages,secs,None)
+        except Exception as e:
+            return (p,[],0.0,f"抽字失敗 -> {e}")
+
+    seq=0
+    while todo:
+        # 每個 pool 一個新的 queue：砍掉 worker 時可能剛好卡在 put，舊的 queue 不再用
+        started_q=ctx.Queue()
+        pool=ctx.Pool(processes=min(workers,len(todo)),initializer=_init_worker,initargs=(started_q,))
+        restart=False
+        try:
+            inflight=[]
+            pos=0
+            while pos<len(todo) or inflight:
+                while pos<len(todo) and len(inflight)<window:
+                    p=todo[pos]
+                    inflight.append((p,seq,pool.apply_async(_extract_timed,(p,seq))))
+                    seq+=1
+                    pos+=1
+
+                p,_,res=inflight[0]
+                expired=set()
+                while not res.ready():
+                    _drain()
+                    if timeout:
+                        now=time.time()
+                        expired={k for _,k,r in inflight if k in started and not r.ready() and now-started[k]>=timeout}
+                        if expired:
+                            break
+                    res.wait(poll)
+                if not expired:
+                    inflight.pop(0)
+                    yield _result(p,res)
+                    continue
+
+                # 有檔案逾時：逾時的記失敗、已經做完的先收下，其餘（含還沒送出的）換新 pool 重跑
+                rest=[]
+                for q,k,r in inflight:
+                    if k in expired:
+                        yield (q,[],float(timeout),f"抽字超過 {timeout:g} 秒，已略過")
+                    elif r.ready():
+                        yield _result(q,r)
+                    else:
+                        rest.append(q)
+                todo=rest+todo[pos:]
+                restart=True
+                break
+            if not restart:
+                todo=[]
+        finally:
+            pool.terminate()
+            pool.join()
+            started_q.close()
@@ -0,0 +1,279 @@
+# policy_db.py
+"""
+PDF 原檔的資料庫（Postgres 的 SIM_policies 表）：存進去（upload_pdf.py）、串流讀出來匯入知識庫（ingest_cli.py --from-db）
+
+- 表結構：filename、sha256（UNIQUE）、file_content（bytea / BLOB）；Postgres 另外有 id（BIGSERIAL，判斷新舊版用）
+- 同一個 filename 有多筆（舊版、新版）時只取最新的一筆（Postgres 看 id、SQLite 看 rowid），
+  知識庫的來源名稱是 SIM_policies/<filename>，每次都選同一筆才不會兩個版本輪流重匯
+- 讀：先用 server-side cursor 只拉 (filename, sha256)，濾掉已經在知識庫的 hash，
+  需要的再一小批一小批抓內容，記憶體只放一批 PDF，跟表有多大無關
+- 寫：一份一份讀檔、算 hash，已經在表裡的不讀內容；每批湊到 batch_bytes 就 execute_values 一次
+- 連線：Postgres 用 psycopg2 的 ThreadedConnectionPool（PG* 環境變數 / .env）；
+  也可以直接傳 sqlite3 連線進來（沒有 Postgres 時本機測試用，SQL 相同、只差 placeholder）
+"""
+import os
+import hashlib
+import contextlib
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Set
+
+POLICY_SCHEMA="public"
+POLICY_TABLE="SIM_policies"
+CONTENT_COL="file_content"  # 若你的欄位叫 pdf_content 就改這行（或設 POLICY_CONTENT_COL）
+
+
+def get_pool(minconn:int=1,maxconn:int=4):
+    """
+    Postgres 連線池；連線參數讀 PGHOST / PGPORT / PGDATABASE / PGUSER / PGPASSWORD（有 .env 也會讀）
+    """
+    import psycopg2.pool
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    return psycopg2.pool.ThreadedConnectionPool(
+        minconn,
+        maxconn,
+        host=os.getenv("PGHOST","localhost"),
+        port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","RAG_Llama"),
+        user=os.getenv("PGUSER","postgres"),
+        password=os.getenv("PGPASSWORD"),
+    )
+
+
+@contextlib.contextmanager
+def pooled(pool):
+    # 借一條連線，用完還回去（出錯時 rollback）
+    conn=pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def _is_postgres(conn)->bool:
+    return type(conn).__module__.startswith("psycopg2")
+
+
+def _ph(conn)->str:
+    return "%s" if _is_postgres(conn) else "?"
+
+
+def _table(conn)->str:
+    # sqlite 沒有 schema
+    return f'{POLICY_SCHEMA}."{POLICY_TABLE}"' if _is_postgres(conn) else f'"{POLICY_TABLE}"'
+
+
+def _content_col()->str:
+    return os.getenv("POLICY_CONTENT_COL",CONTENT_COL)
+
+
+def ensure_table(conn)->None:
+    # 表不存在就建（sqlite 測試、全新的 Postgres 用）；舊的 Postgres 表補上 id 欄
+    blob="BYTEA" if _is_postgres(conn) else "BLOB"
+    cur=conn.cursor()
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {_table(conn)}("
+        f"filename TEXT NOT NULL,sha256 TEXT NOT NULL UNIQUE,{_content_col()} {blob} NOT NULL)"
+    )
+    if _is_postgres(conn):
+        cur.execute(f"ALTER TABLE {_table(conn)} ADD COLUMN IF NOT EXISTS id BIGSERIAL")
+    cur.close()
+    conn.commit()
+
+
+def _version_col(conn)->str:
+    """
+    同檔名多筆時用來判斷哪筆最新的欄位：SQLite 用 rowid；Postgres 有 id 欄（ensure_table 會補）就用 id，
+    沒有的話退回 sha256（不一定是最新，但每次都選到同一筆）
+    """
+    if not _is_postgres(conn):
+        return "rowid"
+    cur=conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema=%s AND table_name=%s AND column_name='id'",
+        (POLICY_SCHEMA,POLICY_TABLE),
+    )
+    found=cur.fetchone() is not None
+    cur.close()
+    return "id" if found else "sha256"
+
+
+def sha256_file(path:str,block_size:int=1024*1024)->str:
+    # 分段讀，大檔也不會整份讀進記憶體
+    h=hashlib.sha256()
+    with open(path,"rb") as f:
+        for b in iter(lambda:f.read(block_size),b""):
+            h.update(b)
+    return h.hexdigest()
+
+
+def _existing_hashes(conn,hashes:List[str])->Set[str]:
+    if not hashes:
+        return set()
+    cur=conn.cursor()
+    if _is_postgres(conn):
+        cur.execute(f"SELECT sha256 FROM {_table(conn)} WHERE sha256 = ANY(%s)",(hashes,))
+    else:
+        cur.execute(f"SELECT sha256 FROM {_table(conn)} WHERE sha256 IN ({','.join('?'*len(hashes))})",hashes)
+    out={r[0] for r in cur.fetchall()}
+    cur.close()
+    return out
+
+
+def _insert_rows(conn,rows:List[Tuple[str,str,bytes]])->int:
+    if not rows:
+        return 0
+    cur=conn.cursor()
+    if _is_postgres(conn):
+        import psycopg2
+        from psycopg2.extras import execute_values
+        execute_values(
+            cur,
+            f"INSERT INTO {_table(conn)}(filename,sha256,{_content_col()}) VALUES %s ON CONFLICT (sha256) DO NOTHING",
+            [(n,h,psycopg2.Binary(b)) for n,h,b in rows],
+            page_size=len(rows),
+        )
+    else:
+        cur.executemany(
+            f"INSERT OR IGNORE INTO {_table(conn)}(filename,sha256,{_content_col()}) VALUES (?,?,?)",
+            rows,
+        )
+    n=cur.rowcount
+    cur.close()
+    conn.commit()
+    return max(0,n)
+
+
+def load_policy_files(
+    conn,
+    paths:Iterable[str],
+    batch_bytes:int=64*1024*1024,
+    check_batch:int=256,
+    stats:Optional[Dict]=None,
+)->int:
+    """
+    把檔案存進 SIM_policies
+    - 先只算 hash（串流讀），每 check_batch 份查一次哪些已經在表裡，已存在的不讀內容
+    - 要寫的才讀進記憶體，湊到 batch_bytes 就寫一批；記憶體上限約 batch_bytes + 一份檔案
+    stats 回填：files、skipped（已存在）、inserted、bytes
+    return: inserted
+    """
+    if stats is None:
+        stats={}
+    stats.update({"files":0,"skipped":0,"inserted":0,"bytes":0})
+    pending=[]  # (path, sha256)
+    rows=[]
+    size=0
+
+    def _flush_rows():
+        nonlocal size
+        stats["inserted"]+=_insert_rows(conn,rows)
+        rows.clear()
+        size=0
+
+    def _flush_pending():
+        nonlocal size
+        have=_existing_hashes(conn,[h for _,h in pending])
+        for path,h in pending:
+            if h in have:
+                stats["skipped"]+=1
+                continue
+            have.add(h)  # 同一批裡重複的檔案只寫一次
+            with open(path,"rb") as f:
+                b=f.read()
+            rows.append((os.path.basename(path),h,b))
+            size+=len(b)
+            stats["bytes"]+=len(b)
+            if size>=batch_bytes:
+                _flush_rows()
+        pending.clear()
+
+    for path in paths:
+        stats["files"]+=1
+        pending.append((path,sha256_file(path)))
+        if len(pending)>=check_batch:
+            _flush_pending()
+    _flush_pending()
+    _flush_rows()
+    return stats["inserted"]
+
+
+def count_policies(conn)->int:
+    cur=conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {_table(conn)}")
+    n=cur.fetchone()[0]
+    cur.close()
+    return int(n)
+
+
+def iter_policy_hashes(conn,itersize:int=2000)->Iterator[Tuple[str,str]]:
+    """
+    逐筆 (filename, sha256)，每個 filename 只有最新的一筆，依 filename 排序；
+    Postgres 用 server-side（named）cursor，不會把整張表拉回來
+    """
+    sql=(
+        f"SELECT filename,sha256 FROM ("
+        f"SELECT filename,sha256,ROW_NUMBER() OVER (PARTITION BY filename ORDER BY {_version_col(conn)} DESC) AS rn "
+        f"FROM {_table(conn)}) AS latest WHERE rn=1 ORDER BY filename"
+    )
+    if _is_postgres(conn):
+        cur=conn.cursor(name="sim_policies_hashes")
+        cur.itersize=itersize
+    else:
+        cur=conn.cursor()
+    try:
+        cur.execute(sql)
+        for row in cur:
+            yield (row[0],row[1])
+    finally:
+        cur.close()
+
+
+def iter_policy_pdfs(
+    conn,
+    skip_hashes:Optional[Set[str]]=None,
+    fetch_batch:int=8,
+    stats:Optional[Dict]=None,
+)->Iterator[Tuple[str,str,bytes]]:
+    """
+    串流讀出 SIM_policies 的 PDF：逐筆 (filename, sha256, content)
+    skip_hashes：已經在知識庫的 file_hash，這些不抓內容
+    同一個 filename 只讀最新的一筆（見 iter_policy_hashes），舊版不抓
+    記憶體裡最多 fetch_batch 份 PDF；需要處理的 hash 清單（只有字串）會先整份收集
+    stats 回填：rows（每個 filename 一筆）、skipped、superseded（被新版取代、沒讀的舊版筆數）
+    """
+    if stats is None:
+        stats={}
+    stats.update({"rows":0,"skipped":0,"superseded":0})
+    skip=skip_hashes or set()
+    todo=[]
+    for _,h in iter_policy_hashes(conn):
+        stats["rows"]+=1
+        if h in skip:
+            stats["skipped"]+=1
+            continue
+        todo.append(h)
+    # named cursor 用完要 commit 才會結束交易
+    conn.commit()
+    stats["superseded"]=count_policies(conn)-stats["rows"]
+
+    ph=_ph(conn)
+    for i in range(0,len(todo),max(1,fetch_batch)):
+        part=todo[i:i+fetch_batch]
+        cur=conn.cursor()
+        if _is_postgres(conn):
+            cur.execute(f"SELECT filename,sha256,{_content_col()} FROM {_table(conn)} WHERE sha256 = ANY(%s)",(part,))
+        else:
+            cur.execute(
+                f"SELECT filename,sha256,{_content_col()} FROM {_table(conn)} WHERE sha256 IN ({','.join([ph]*len(part))})",
+                part,
+            )
+        rows=cur.fetchall()
+        cur.close()
+        for name,h,content in rows:
+            yield (name,h,bytes(content))
@@ -1,101 +1,431 @@
 # rag.py
 import os
 import re
+import math
+import time
 import uuid
 import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable
 
 import chromadb
-from pypdf import PdfReader
+import numpy as np
 import ollama
 
+from tokenizer import count_tokens,token_spans
+from scheduler import Scheduler,PRIORITY_QUERY,PRIORITY_CHAT,PRIORITY_INGEST
+from metrics import get_metrics
+from pdf_extract import (
+    normalize_text as _normalize_text,
+    iter_pdf_pages as _iter_pdf_pages,
+    pdf_page_count as _pdf_page_count,
+    iter_extract_pdfs,
+)
+
 
 @dataclass
 class Hit:
     text:str
     meta:Dict
     distance:float
+    id:str=""
+    score:float=0.0   # 混合檢索時的 RRF 分數
 
 
 def _sha256_bytes(b:bytes)->str:
     return hashlib.sha256(b).hexdigest()
 
 
-def _normalize_text(s:str)->str:
-    s=(s or "").replace("\r\n","\n").replace("\r","\n")
-    s=re.sub(r"[ \t]+"," ",s)
-    s=re.sub(r"\n{3,}","\n\n",s)
-    return s.strip()
+_CHUNK_SEPS=["\n\n","\n",". ","。","！","？"," "]
+
+
+@dataclass
+class Chunk:
+    text:str
+    start:int     # 本段內容（不含 overlap 前綴）在頁面文字中的起點
+    end:int       # 終點（不含）；text[head:] 與 page_text[start:end] 只差在被 strip 掉的空白
+    head:int=0    # text 開頭有幾個字是從上一段複製過來的 overlap
+
+
+def _lstrip_at(text:str,a:int,b:int)->int:
+    while a<b and text[a].isspace():
+        a+=1
+    return a
+
+
+def _rstrip_at(text:str,a:int,b:int)->int:
+    while b>a and text[b-1].isspace():
+        b-=1
+    return b
+
+
+def _chunk_spans(text:str,chunk_size:int=800,overlap:int=120)->List[Chunk]:
+    """
+    單趟、以位置（offset）為基礎的切段；輸出跟舊版遞迴 _smart_chunk 完全一樣，但：
+    - 不再每加一個片段就重組一次字串，也不會在最後一層一直複製剩下的字串（舊版是平方時間，還會遞迴過深）
+    - text 必須已經 normalize 過（pdf_extract.extract_pdf_pages 已經做了），這裡不再重做
+    - 回傳每段在 text 中的位置，後面要做 highlight 不用再找字串
+
+    演算法跟舊版一樣：依分隔符號由粗到細切，湊到 chunk_size 就收一段，
+    單一片段太長才往下一層分隔符號切；每一段只記錄 [start,end) 區間，最後才組字串一次。
+    """
+    C=int(chunk_size)
+    n=len(text)
+    if n==0:
+        return []
+    base=[]  # 每段是 [(a,b), ...]：段內由原文片段組成（中間可能被 strip 掉空白）
+
+    def _strip(a:int,b:int)->Tuple[int,int]:
+        a=_lstrip_at(text,a,b)
+        return a,_rstrip_at(text,a,b)
+
+    def _emit(a:int,b:int)->None:
+        a,b=_strip(a,b)
+        if a<b:
+            base.append([(a,b)])
+
+    def _flush(segs:List[Tuple[int,int]],blen:int,sep_idx:int)->None:
+        if blen<=C:
+            if blen:
+                base.append(segs)
+            return
+        # 超過 chunk_size 的 buf 一定是單一片段（p.strip()），可以直接用位置往下切
+        _split(segs[0][0],segs[0][1],sep_idx)
+
+    def _split(a:int,b:int,sep_idx:int)->None:
+        if b-a<=C:
+            _emit(a,b)
+            return
+        if sep_idx>=len(_CHUNK_SEPS):
+            # 沒有分隔符號可用：每 chunk_size 個字硬切
+            while b-a>C:
+                _emit(a,a+C)
+                a+=C
+                if _strip(a,b)[0]>=b:
+                    return
+            _emit(a,b)
+            return
+
+        sep=_CHUNK_SEPS[sep_idx]
+        L=len(sep)
+        sep_keep=len(sep.rstrip())
+        segs=[]
+        blen=0
+        pos=a
+        while True:
+            j=text.find(sep,pos,b)
+            pe=j if j!=-1 else b
+            if blen==0:
+                pa,pb=_strip(pos,pe)
+                segs=[(pa,pb)] if pb>pa else []
+                blen=pb-pa
+            else:
+                # buf 非空：候選 = buf + sep + p.rstrip()；p 全是空白時 = buf + sep.rstrip()
+                pr=_rstrip_at(text,pos,pe)
+                if pr>pos:
+                    add=(pos-L,pr)
+                else:
+                    add=(pos-L,pos-L+sep_keep) if sep_keep else None
+                clen=blen+((add[1]-add[0]) if add else 0)
+                if clen<=C:
+                    if add:
+                        if segs[-1][1]==add[0]:
+                            segs[-1]=(segs[-1][0],add[1])
+                        else:
+                            segs.append(add)
+                    blen=clen
+                else:
+                    _flush(segs,blen,sep_idx+1)
+                    pa,pb=_strip(pos,pe)
+                    segs=[(pa,pb)] if pb>pa else []
+                    blen=pb-pa
+            if j==-1:
+                break
+            pos=j+L
+        if blen:
+            _flush(segs,blen,sep_idx+1)
+
+    _split(0,n,0)
+
+    out=[]
+    prev=""
+    for segs in base:
+        core="".join(text[x:y] for x,y in segs)
+        if overlap>0 and prev and len(base)>1:
+            # prev 已 strip，尾巴一定不是空白，所以只需要 lstrip
+            tail=prev[-overlap:].lstrip()
+            out.append(Chunk(text=tail+"\n"+core,start=segs[0][0],end=segs[-1][1],head=len(tail)+1))
+        else:
+            out.append(Chunk(text=core,start=segs[0][0],end=segs[-1][1]))
+        prev=core
+    return out
+
+
+# token 模式的斷句：中文句末/分句標點（含 ；：」』）、全形空白、換行、英文句點
+_UNIT_END_RE=re.compile(r"[。！？；：!?;]+[」』）)]*|[」』]+[。！？；：!?;]*|\u3000+|\n+|\.(?=\s)")
+# 條文/章節標題（第五條、一、）：段落已經過半時，從標題前面另起一段
+_HEADING_RE=re.compile(
+    r"^[ \t\u3000]*(?P<h>第[一二三四五六七八九十百零〇\d]+[條章節款項]|[一二三四五六七八九十]+、)",
+    re.M,
+)
+# 清單項目（(一)、1.、•）：只當斷句點
+_LIST_RE=re.compile(r"^[ \t\u3000]*(?P<h>[（(][一二三四五六七八九十\d]+[)）]|\d+[.、．](?!\d)|[•●▪■◆◇※\-–*])",re.M)
+
+
+def _text_units(text:str)->List[Tuple[int,int,bool,int]]:
+    """把頁面切成最小單位（句子、標題行、清單項目）：(start, end, is_heading, tokens)"""
+    cuts={0,len(text)}
+    heads=set()
+    for m in _HEADING_RE.finditer(text):
+        cuts.add(m.start("h"))
+        heads.add(m.start("h"))
+    # 清單編號本身的句點（「1. 」）不算句尾
+    marks=set()
+    for m in _LIST_RE.finditer(text):
+        cuts.add(m.start("h"))
+        marks.add(m.end("h"))
+    for m in _UNIT_END_RE.finditer(text):
+        if m.end() not in marks:
+            cuts.add(m.end())
+    cuts=sorted(cuts)
+    out=[]
+    for a,b in zip(cuts,cuts[1:]):
+        a=_lstrip_at(text,a,b)
+        b=_rstrip_at(text,a,b)
+        if a<b:
+            out.append((a,b,a in heads,count_tokens(text[a:b])))
+    return out
+
+
+def _chunk_spans_tokens(text:str,max_tokens:int=256,overlap_tokens:int=32)->List[Chunk]:
+    """
+    以估算的 token 數（tokenizer.count_tokens，不是模型實際的 token 數）為預算的切段，斷點優先落在中文標點、標題、清單項目上
+    - 每段（含 overlap）不超過 max_tokens；本段內容的預算是 max_tokens - overlap_tokens
+    - overlap 取上一段結尾的整句（總和不超過 overlap_tokens）；最後一句太長就取它最後幾個 token
+    - 同一頁裡的 overlap 是原文連續的一段，所以 text 就是 page_text[start-head:end]
+    """
+    overlap_tokens=max(0,min(int(overlap_tokens),int(max_tokens)//2))
+    budget=max(1,int(max_tokens)-overlap_tokens)
+
+    units=[]
+    for a,b,is_head,tok in _text_units(text):
+        if tok<=budget:
+            units.append((a,b,is_head,tok))
+            continue
+        # 單句就超過預算：照 token 硬切
+        spans=token_spans(text,a,b)
+        for k in range(0,len(spans),budget):
+            part=spans[k:k+budget]
+            units.append((part[0][0],part[-1][1],is_head and k==0,len(part)))
 
+    groups=[]
+    cur=[]
+    cur_tok=0
+    for u in units:
+        if cur and (cur_tok+u[3]>budget or (u[2] and cur_tok>=budget//2)):
+            groups.append(cur)
+            cur=[]
+            cur_tok=0
+        cur.append(u)
+        cur_tok+=u[3]
+    if cur:
+        groups.append(cur)
 
-def _extract_pdf_pages(pdf_path:str)->List[Tuple[int,str]]:
-    reader=PdfReader(pdf_path)
     out=[]
-    for i,page in enumerate(reader.pages,start=1):
-        t=page.extract_text() or ""
-        t=_normalize_text(t)
-        if t:
-            out.append((i,t))
+    prev=None
+    for g in groups:
+        start,end=g[0][0],g[-1][1]
+        ov_start=start
+        if prev and overlap_tokens>0:
+            used=0
+            for u in reversed(prev):
+                if used+u[3]>overlap_tokens:
+                    break
+                used+=u[3]
+                ov_start=u[0]
+            if ov_start==start:
+                tail=token_spans(text,prev[-1][0],prev[-1][1])[-overlap_tokens:]
+                if tail:
+                    ov_start=tail[0][0]
+        out.append(Chunk(text=text[ov_start:end],start=start,end=end,head=start-ov_start))
+        prev=g
     return out
 
 
+CHUNK_MODES=("char","token")
+
+
+def _chunk_page(text:str,chunk_size:int,overlap:int,chunk_mode:str="char")->List[Chunk]:
+    """chunk_mode="token" 時，chunk_size / overlap 的單位是 token，否則是字數"""
+    if chunk_mode=="token":
+        return _chunk_spans_tokens(text,max_tokens=chunk_size,overlap_tokens=overlap)
+    return _chunk_spans(text,chunk_size=chunk_size,overlap=overlap)
+
+
 def _smart_chunk(text:str,chunk_size:int=800,overlap:int=120)->List[str]:
     text=_normalize_text(text)
     if not text:
         return []
+    return [c.text for c in _chunk_spans(text,chunk_size=chunk_size,overlap=overlap)]
 
-    seps=["\n\n","\n",". ","。","！","？"," "]
-    chunks=[]
 
-    def split_rec(s:str,sep_idx:int)->None:
-        if len(s)<=chunk_size:
-            chunks.append(s.strip())
-            return
-        if sep_idx>=len(seps):
-            chunks.append(s[:chunk_size].strip())
-            rest=s[chunk_size:]
-            if rest.strip():
-                split_rec(rest,sep_idx)
+# 伺服器沒有 /api/embed（舊版 Ollama）時用到的模型：記起來，之後直接逐筆呼叫
+_NO_BATCH_MODELS=set()
+
+
+def _embed_endpoint_missing(e:Exception)->bool:
+    """
+    只有「伺服器沒有這個 endpoint」才算不支援批次：404 / 405 / 501，而且不是模型找不到（那也是 404）
+    其他錯誤（5xx、模型不存在、輸入太長…）照常往外丟，不會把模型永久記成不支援
+    """
+    status=getattr(e,"status_code",-1)
+    msg=str(getattr(e,"error",e)).lower()
+    return status in (404,405,501) and "model" not in msg
+
+
+def _l2_normalize(v)->np.ndarray:
+    v=np.asarray(v,dtype=np.float32)
+    n=float(np.linalg.norm(v))
+    return v/n if n>0 else v.copy()
+
+
+# 所有 Ollama 請求（embedding、生成）都經過這個排程器：整個 process 共用，限制同時請求數、依優先序排隊
+_SCHEDULER=Scheduler()
+
+
+def get_scheduler()->Scheduler:
+    return _SCHEDULER
+
+
+# 各階段耗時、token 數都記在這裡（rag_stage_seconds{stage=...}），指標頁和 Prometheus 匯出用
+_METRICS=get_metrics()
+
+
+def _timed_iter(it:Iterable,acc:Dict,key:str)->Iterator:
+    # 把每次 next() 花的時間加到 acc[key]（量邊讀邊抽字的抽字時間）
+    it=iter(it)
+    while True:
+        t0=time.perf_counter()
+        try:
+            item=next(it)
+        except StopIteration:
             return
+        finally:
+            acc[key]=acc.get(key,0.0)+time.perf_counter()-t0
+        yield item
 
-        sep=seps[sep_idx]
-        parts=s.split(sep)
-        buf=""
-        for p in parts:
-            candidate=(buf+(sep if buf else "")+p).strip()
-            if len(candidate)<=chunk_size:
-                buf=candidate
-            else:
-                if buf:
-                    split_rec(buf,sep_idx+1)
-                buf=p.strip()
-        if buf:
-            split_rec(buf,sep_idx+1)
-
-    split_rec(text,0)
-    chunks=[c for c in chunks if c]
-
-    if overlap>0 and len(chunks)>1:
-        out=[]
-        prev=""
-        for c in chunks:
-            if prev:
-                tail=prev[-overlap:]
-                out.append((tail+"\n"+c).strip())
-            else:
-                out.append(c)
-            prev=c
-        return out
-    return chunks
+
+def _embed_one(text:str,embed_model:str,priority:int=PRIORITY_INGEST)->np.ndarray:
+    # 舊的 /api/embeddings 不會正規化、/api/embed 會；兩條路徑要一致才能放進同一個 collection
+    with _SCHEDULER.slot(priority):
+        r=ollama.embeddings(model=embed_model,prompt=text)
+    return _l2_normalize(r["embedding"])
+
+
+def _embed_batch(texts:List[str],embed_model:str,batch_size:int=32,cache=None,priority:int=PRIORITY_INGEST)->np.ndarray:
+    """
+    一次送多段文字給 Ollama（/api/embed），回傳 (len(texts), dim) 的 float32 陣列，順序與 texts 相同
+    （Ollama 回的是 JSON 數字；轉成 float32 陣列後一個維度 4 bytes，Python list of float 要 32 bytes）
+    伺服器沒有 /api/embed 時自動退回逐筆呼叫；回傳筆數對不起來時只有那一批逐筆重做
+    cache：caches.EmbeddingCache，有給就只對沒命中的文字呼叫 Ollama
+    priority：排程優先序；預設是匯入用的最低優先，問題 embedding 用 PRIORITY_QUERY
+    """
+    if cache is not None:
+        out=cache.get_many(embed_model,texts)
+        miss=[i for i,v in enumerate(out) if v is None]
+        if miss:
+            miss_texts=[texts[i] for i in miss]
+            fresh=_embed_batch(miss_texts,embed_model,batch_size=batch_size,priority=priority)
+            cache.put_many(embed_model,miss_texts,fresh)
+            for i,v in zip(miss,fresh):
+                out[i]=v
+        return np.stack(out) if out else np.zeros((0,0),dtype=np.float32)
+
+    parts=[]
+    step=max(1,int(batch_size))
+    for i in range(0,len(texts),step):
+        batch=texts[i:i+step]
+        if embed_model not in _NO_BATCH_MODELS:
+            try:
+                with _SCHEDULER.slot(priority):
+                    embs=ollama.embed(model=embed_model,input=batch)["embeddings"]
+            except ollama.ResponseError as e:
+                if not _embed_endpoint_missing(e):
+                    raise
+                _NO_BATCH_MODELS.add(embed_model)
+                embs=None
+            if embs is not None and len(embs)==len(batch):
+                parts.append(np.asarray(embs,dtype=np.float32))
+                continue
+            # 筆數對不起來：這一批改逐筆，下一批還是先試批次
+        parts.append(np.stack([_embed_one(t,embed_model,priority) for t in batch]))
+    return np.concatenate(parts) if parts else np.zeros((0,0),dtype=np.float32)
 
 
-def _embed(text:str,embed_model:str)->List[float]:
-    r=ollama.embeddings(model=embed_model,prompt=text)
-    return r["embedding"]
+def _embed(text:str,embed_model:str)->np.ndarray:
+    # 問題 embedding：排在生成前面，等待中的人先做完檢索
+    with _METRICS.timer("rag_stage_seconds",stage="embed_query"):
+        return _embed_batch([text],embed_model,priority=PRIORITY_QUERY)[0]
+
+
+def _iter_embedded(
+    items:Iterable[Tuple[str,str,Dict]],
+    embed_model:str,
+    batch_size:int=32,
+    concurrency:int=4,
+    cache=None,
+    timings:Optional[Dict]=None,
+)->Iterator[Tuple[List[str],List[str],List[Dict],np.ndarray]]:
+    """
+    items：逐筆 (id, doc, meta)，通常是「抽字 → chunk」的 generator
+    每湊滿 batch_size 筆就丟給 thread pool 做 embedding，同時在途的 request 最多 concurrency 個；
+    滿了就先等最早那批回來（back-pressure），上游才會繼續抽下一頁，所以記憶體不會跟著文件大小長。
+    依輸入順序 yield 每一批 (ids, docs, metas, embs)；embs 是 (n, dim) 的 float32 陣列
+    timings：有給 dict 就把每批 embedding 的秒數（含排隊）加到 timings["embed"]
+    """
+    step=max(1,int(batch_size))
+    workers=max(1,int(concurrency))
+    pending=deque()
+    if timings is None:
+        timings={}
+
+    def _run(docs):
+        t0=time.perf_counter()
+        embs=_embed_batch(docs,embed_model,step,cache)
+        return embs,time.perf_counter()-t0
+
+    def _take(fut_entry):
+        ids,docs,metas,fut=fut_entry
+        embs,secs=fut.result()
+        timings["embed"]=timings.get("embed",0.0)+secs
+        return (ids,docs,metas,embs)
+
+    with ThreadPoolExecutor(max_workers=workers,thread_name_prefix="embed") as pool:
+        ids,docs,metas=[],[],[]
+        for item_id,doc,meta in items:
+            ids.append(item_id)
+            docs.append(doc)
+            metas.append(meta)
+            if len(ids)<step:
+                continue
+            if len(pending)>=workers:
+                yield _take(pending.popleft())
+            pending.append((ids,docs,metas,pool.submit(_run,docs)))
+            ids,docs,metas=[],[],[]
+        if ids:
+            pending.append((ids,docs,metas,pool.submit(_run,docs)))
+        while pending:
+            yield _take(pending.popleft())
 
 
 def get_client(db_dir:str)->chromadb.PersistentClient:
+    """
+    同一個 DB_DIR 在一個 process 裡只開一個（app.py 用 st.cache_resource 共用）；
+    client / collection 可以同時給多個 thread 用
+    """
     os.makedirs(db_dir,exist_ok=True)
     return chromadb.PersistentClient(path=db_dir)
 
@@ -104,16 +434,243 @@ def get_collection(client:chromadb.PersistentClient,name:str):
     return client.get_or_create_collection(name=name)
 
 
-def clear_all(collection)->None:
+# 壓縮向量索引（vector_store.VectorStore）開著時，向量只存在它那裡；Chroma 用另一個 collection（名稱加 _docs）
+# 只放文字與 metadata。Chroma 每筆一定要有向量，給一個 1 維的 0 當佔位，HNSW 幾乎不佔空間
+DOCS_COLLECTION_SUFFIX="_docs"
+
+
+def _placeholder_embeddings(n:int)->np.ndarray:
+    return np.zeros((n,1),dtype=np.float32)
+
+
+def _existing_collection(client:chromadb.PersistentClient,name:str):
+    # 不存在就回傳 None（不要順手建一個空的）
     try:
-        ids=collection.get(include=[])["ids"]
+        return client.get_collection(name=name)
+    except Exception:
+        return None
+
+
+def _copy_collection(src,dst,vector_store,to_store:bool,page_size:int)->int:
+    # 分頁搬：to_store=True 時向量從 src 搬進 vector_store、dst 只放佔位向量；False 時反過來，向量從 vector_store 讀回 dst
+    n=0
+    offset=0
+    include=["documents","metadatas","embeddings"] if to_store else ["documents","metadatas"]
+    while True:
+        res=src.get(include=include,limit=page_size,offset=offset)
+        ids=res.get("ids") or []
         if ids:
-            collection.delete(ids=ids)
+            docs=res.get("documents")
+            metas=res.get("metadatas")
+            if to_store:
+                embs=np.asarray(res.get("embeddings"),dtype=np.float32)
+                vector_store.add(ids,embs,[(m or {}).get("source","unknown") for m in metas])
+                dst.add(ids=ids,documents=docs,metadatas=metas,embeddings=_placeholder_embeddings(len(ids)))
+            else:
+                dst.add(ids=ids,documents=docs,metadatas=metas,embeddings=vector_store.get_vectors(ids))
+            n+=len(ids)
+        if len(ids)<page_size:
+            return n
+        offset+=page_size
+
+
+def open_collection(
+    client:chromadb.PersistentClient,
+    name:str,
+    vector_store=None,
+    vectors_path:Optional[str]=None,
+    page_size:int=500,
+):
+    """
+    依有沒有開壓縮向量索引，回傳要用的 collection；兩種模式之間切換時自動搬一次資料（只在啟動時、一次性）
+    vector_store 有給：回傳只放文字/metadata 的 <name>_docs；舊的 <name>（向量存在 Chroma）還有資料的話，
+      向量搬進 vector_store、文字搬進 <name>_docs，搬完刪掉 <name>，磁碟上就只剩一份向量
+    沒給：回傳 <name>；<name>_docs 還有資料（之前開過壓縮索引）而且 vectors_path 存在，就把 float32 向量搬回 <name>
+    中途中斷也沒關係：來源那邊搬完才刪，下次開啟會整個重搬
+    """
+    docs_name=name+DOCS_COLLECTION_SUFFIX
+    if vector_store is not None:
+        legacy=_existing_collection(client,name)
+        docs=get_collection(client,docs_name)
+        if legacy is not None and legacy.count():
+            _delete_paged(docs)
+            vector_store.clear()
+            _copy_collection(legacy,docs,vector_store,to_store=True,page_size=page_size)
+            _bump_collection_version(docs)
+        if legacy is not None:
+            client.delete_collection(name=name)
+        return docs
+
+    docs=_existing_collection(client,docs_name)
+    collection=get_collection(client,name)
+    if docs is not None and docs.count() and vectors_path and os.path.exists(vectors_path):
+        from vector_store import VectorStore
+        # 只是讀出 float32：不用壓縮，直接在 memmap 上讀
+        vs=VectorStore(vectors_path,dtype="float32")
+        if vs.count()==docs.count():
+            _delete_paged(collection)
+            _copy_collection(docs,collection,vs,to_store=False,page_size=page_size)
+            _bump_collection_version(collection)
+            client.delete_collection(name=docs_name)
+            vs.clear()
+    return collection
+
+
+# 知識庫版本：存在 collection metadata，每次匯入/清空就換一個新值（回答快取靠它判斷過期）
+_VERSION_KEY="kb_version"
+
+
+def get_collection_version(collection)->str:
+    return str((collection.metadata or {}).get(_VERSION_KEY,"0"))
+
+
+def _bump_collection_version(collection)->str:
+    v=uuid.uuid4().hex[:12]
+    meta=dict(collection.metadata or {})
+    meta[_VERSION_KEY]=v
+    try:
+        collection.modify(metadata=meta)
     except Exception:
         pass
+    return v
+
+
+def _delete_paged(collection,where:Optional[Dict]=None,batch_size:int=1000)->int:
+    # 每次只拿一頁 ID 來刪（刪掉的不會再出現，所以 offset 一直是 0），記憶體跟 request 大小都有上限
+    removed=0
+    while True:
+        ids=collection.get(where=where,include=[],limit=batch_size)["ids"]
+        if not ids:
+            return removed
+        collection.delete(ids=ids)
+        removed+=len(ids)
 
 
-def get_db_status(collection)->Dict:
+def clear_all(collection,manifest=None,batch_size:int=1000,lexical=None,vector_store=None)->Tuple[int,float]:
+    """
+    分頁刪除所有 chunk（不刪 collection 本身，外面拿著的 collection 物件還能繼續用）
+    失敗會往外丟；return: (removed_chunks, seconds)
+    """
+    t0=time.perf_counter()
+    try:
+        removed=_delete_paged(collection,batch_size=batch_size)
+        if manifest is not None:
+            manifest.clear(collection.name)
+        if lexical is not None:
+            lexical.clear()
+        if vector_store is not None:
+            vector_store.clear()
+    finally:
+        _bump_collection_version(collection)
+    return removed,time.perf_counter()-t0
+
+
+def sync_manifest(collection,manifest,page_size:int=5000)->Dict:
+    """
+    從 collection 的 metadata 重建 manifest（舊資料庫第一次用、或 manifest 跟 collection 對不起來時）
+    分頁讀，記憶體只跟來源數有關；回傳重建後的 totals
+    """
+    agg={}
+    offset=0
+    while True:
+        res=collection.get(include=["metadatas"],limit=page_size,offset=offset)
+        metas=res.get("metadatas") or []
+        for m in metas:
+            m=m or {}
+            src=m.get("source","unknown")
+            e=agg.get(src)
+            if e is None:
+                e=agg[src]={
+                    "source":src,"chunks":0,"page_set":set(),"file_hash":m.get("file_hash"),
+                    "chunk_size":m.get("chunk_size"),"overlap":m.get("overlap"),"chunk_mode":m.get("chunk_mode","char"),
+                }
+            e["chunks"]+=1
+            e["page_set"].add(m.get("page"))
+        if len(metas)<page_size:
+            break
+        offset+=page_size
+    entries=[]
+    for e in agg.values():
+        e["pages"]=len(e.pop("page_set"))
+        entries.append(e)
+    manifest.rebuild(collection.name,entries)
+    return manifest.totals(collection.name)
+
+
+def sync_lexical(collection,lexical,page_size:int=1000)->int:
+    """
+    從 collection 重建關鍵字索引（舊資料庫第一次用、或兩邊段數對不起來時）；分頁讀，回傳筆數
+    """
+    def _items():
+        offset=0
+        while True:
+            res=collection.get(include=["documents","metadatas"],limit=page_size,offset=offset)
+            ids=res.get("ids") or []
+            for cid,d,m in zip(ids,res.get("documents") or [],res.get("metadatas") or []):
+                yield (cid,d or "",(m or {}).get("source","unknown"))
+            if len(ids)<page_size:
+                return
+            offset+=page_size
+    return lexical.rebuild(_items(),batch_size=page_size)
+
+
+def sync_vector_store(
+    collection,
+    vector_store,
+    embed_model:str,
+    embed_cache=None,
+    page_size:int=1000,
+    embed_batch_size:int=32,
+    embed_concurrency:int=4,
+)->Dict:
+    """
+    讓 vector_store.VectorStore 跟 collection（open_collection 回傳的 <name>_docs）的 chunk 對得起來
+    （例如匯入途中當掉、.f32 不見了）：vector_store 多的刪掉，少的拿 collection 的文字重新 embedding
+    （embed_cache 有的直接用，不用再呼叫 Ollama）；分頁讀，回傳 {"added", "removed"}
+    """
+    have=set(vector_store.ids())
+    seen=set()
+
+    def _missing():
+        offset=0
+        while True:
+            res=collection.get(include=["documents","metadatas"],limit=page_size,offset=offset)
+            ids=res.get("ids") or []
+            for cid,d,m in zip(ids,res.get("documents") or [],res.get("metadatas") or []):
+                seen.add(cid)
+                if cid not in have:
+                    yield (cid,d or "",m or {})
+            if len(ids)<page_size:
+                return
+            offset+=page_size
+
+    added=0
+    for ids,_,metas,embs in _iter_embedded(
+        _missing(),embed_model,batch_size=embed_batch_size,concurrency=embed_concurrency,cache=embed_cache,
+    ):
+        vector_store.add(ids,embs,[m.get("source","unknown") for m in metas])
+        added+=len(ids)
+    extra=[cid for cid in have if cid not in seen]
+    if extra:
+        vector_store.delete_ids(extra)
+    return {"added":added,"removed":len(extra)}
+
+
+def get_db_status(collection,manifest=None)->Dict:
+    """
+    manifest：manifest.Manifest，有給就直接讀摘要（O(1)），不用把所有 metadata 抓回來
+      - 第一次用（manifest 裡沒有這個 collection）會自動從 collection 重建一次
+      - total_chunks 以 collection.count() 為準；跟 manifest 對不起來時 stale=True（可手動重建）
+    """
+    if manifest is not None:
+        try:
+            n=collection.count()
+            t=manifest.totals(collection.name)
+            if n and not t["unique_sources"]:
+                t=sync_manifest(collection,manifest)
+            return {**t,"total_chunks":n,"stale":t["total_chunks"]!=n}
+        except Exception:
+            return {"unique_sources":0,"total_chunks":0,"stale":False}
     try:
         meta=collection.get(include=["metadatas"])
         metas=meta.get("metadatas",[]) or []
@@ -126,12 +683,98 @@ def get_db_status(collection)->Dict:
         return {"unique_sources":0,"total_chunks":0}
 
 
-def _delete_by_source(collection,source:str)->None:
+def _delete_by_source(collection,source:str,batch_size:int=1000)->Tuple[int,float]:
+    """
+    分批刪掉某個來源的所有 chunk；失敗會往外丟（不再默默吞掉）
+    return: (removed_chunks, seconds)
+    """
+    t0=time.perf_counter()
+    removed=_delete_paged(collection,where={"source":source},batch_size=batch_size)
+    return removed,time.perf_counter()-t0
+
+
+def delete_source(collection,source:str,manifest=None,lexical=None,vector_store=None)->Tuple[int,float]:
+    """
+    從知識庫移除一份文件（資料庫頁面的「刪除文件」）
+    return: (removed_chunks, seconds)
+    """
     try:
-        collection.delete(where={"source":source})
-    except Exception:
-        # 有些版本 where delete 可能不支援
-        pass
+        removed,secs=_delete_by_source(collection,source)
+        if manifest is not None:
+            manifest.remove(collection.name,source)
+        if lexical is not None:
+            lexical.delete_source(source)
+        if vector_store is not None:
+            vector_store.delete_source(source)
+    finally:
+        _bump_collection_version(collection)
+    return removed,secs
+
+
+def _source_of(pdf_path:str,root_dir:str)->str:
+    # 來源用相對路徑：uploads/xxx.pdf
+    return os.path.relpath(pdf_path,root_dir).replace("\\","/")
+
+
+def _file_sha256(path:str,block_size:int=1024*1024)->str:
+    # 分段讀，大檔也不會整份讀進記憶體
+    h=hashlib.sha256()
+    with open(path,"rb") as f:
+        for block in iter(lambda:f.read(block_size),b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _chunk_id(source:str,page_no:int,text:str,dup:int=1)->str:
+    # 內容定址：同來源、同頁、同文字 → 同一個 ID；文字改了 ID 才會變（同頁重複的段落用 dup 區分）
+    base=f"{_sha256_bytes(source.encode('utf-8'))[:16]}:{page_no}:{_sha256_bytes(text.encode('utf-8'))[:24]}"
+    return base if dup<=1 else f"{base}:{dup}"
+
+
+def _source_chunk_ids(collection,source:str)->set:
+    # 只拿 ID（不拿 metadata / 向量），用來算新舊 chunk 的差集
+    got=collection.get(where={"source":source},include=[])
+    return set(got.get("ids",[]) or [])
+
+
+def _is_unchanged(collection,source:str,file_hash:str,chunk_size:int,overlap:int,chunk_mode:str="char",manifest=None)->bool:
+    """
+    這個來源已經有 chunk，而且每一段的 file_hash / chunk 參數都跟這次一樣
+    只查 limit=1，不把整份文件的 metadata 拉回來
+    manifest：有給的話還要 manifest 裡有這份文件、hash 與參數相同才算；manifest 是整份寫完才更新，
+      所以匯入到一半中斷（已寫入的 chunk 都是新 hash）的文件，下次會接著做完而不是被略過
+    """
+    if manifest is not None:
+        e=manifest.get(collection.name,source)
+        if (
+            e is None or e["file_hash"]!=file_hash or e["chunk_size"]!=chunk_size
+            or e["overlap"]!=overlap or (e["chunk_mode"] or "char")!=chunk_mode
+        ):
+            return False
+    first=collection.get(where={"source":source},limit=1,include=["metadatas"])
+    metas=first.get("metadatas",[]) or []
+    if not metas:
+        return False
+    m=metas[0] or {}
+    if (
+        m.get("file_hash")!=file_hash or m.get("chunk_size")!=chunk_size
+        or m.get("overlap")!=overlap or m.get("chunk_mode")!=chunk_mode
+    ):
+        return False
+    diff=collection.get(
+        where={"$and":[
+            {"source":source},
+            {"$or":[
+                {"file_hash":{"$ne":file_hash}},
+                {"chunk_size":{"$ne":chunk_size}},
+                {"overlap":{"$ne":overlap}},
+                {"chunk_mode":{"$ne":chunk_mode}},
+            ]},
+        ]},
+        limit=1,
+        include=[],
+    )
+    return not (diff.get("ids",[]) or [])
 
 
 def ingest_pdf_path(
@@ -141,129 +784,791 @@ def ingest_pdf_path(
     chunk_size:int,
     overlap:int,
     root_dir:str,
+    chunk_mode:str="char",
+    embed_batch_size:int=32,
+    embed_concurrency:int=4,
+    pages:Optional[Iterable[Tuple[int,str]]]=None,
+    embed_cache=None,
+    incremental:bool=True,
+    stats:Optional[Dict]=None,
+    write_batch_size:int=256,
+    manifest=None,
+    lexical=None,
+    progress:Optional[Callable[[Dict],None]]=None,
+    source:Optional[str]=None,
+    vector_store=None,
+    file_hash:Optional[str]=None,
+    known_changed:bool=False,
 )->Tuple[int,int,Optional[str]]:
     """
+    整條流程是串流的：分段算 hash → 一頁一頁抽字 → chunk → 批次 embedding → 每滿 write_batch_size 段就寫進 Chroma
+    記憶體上限取決於 batch 大小（在途 embedding + 一個寫入 batch），跟文件有幾頁無關；
+    整份文件只留 chunk ID（增量比對用）
+    chunk_mode："char"（chunk_size / overlap 以字數計）或 "token"（以 token 計，斷點優先落在中文標點與條文標題）
+    pages：已經抽好（並 normalize）的 (page_no, text)；不給就邊讀 PDF 邊抽
+    embed_cache：caches.EmbeddingCache；內容沒變的 chunk 直接用快取，不再呼叫 Ollama
+    incremental：
+      - 這個來源已存的 file_hash 與 chunk 參數都一樣 → 整份略過（不抽字、不 embedding）
+      - 有變 → 只新增變動的 chunk、刪掉消失的 chunk，沒變的 chunk 只更新 metadata
+      關掉就跟以前一樣：整份刪掉重建
+    stats：有給 dict 就回填 unchanged / kept / removed，以及 timings（extract / chunk / embed / write 各花幾秒；
+      各階段是重疊進行的，加起來會比實際經過的時間長）
+    manifest：manifest.Manifest，匯入完更新這份文件的摘要（chunk 數、頁數、hash、參數）
+    lexical：lexical.LexicalIndex，跟 Chroma 同步新增/刪除 chunk
+    progress：每抽完一頁、每寫入一批就呼叫一次，收一個 dict：
+      pages_done、pages_total（讀不到頁數時是 None）、chunks_done（已寫入 + 沿用）、eta_s（依抽頁速度估，估不出來是 None）
+    source：來源名稱；不給就用 pdf_path 相對 root_dir 的路徑
+    vector_store：vector_store.VectorStore；有給的話向量只寫進它，collection 要是 open_collection 回傳的 <name>_docs
+    file_hash：呼叫端已經算好的 sha256（不用再讀一次檔案）
+    known_changed：呼叫端已經用同一個 file_hash 查過、確定有變，這裡不再查 _is_unchanged
     return: (scanned_pages, added_chunks, note_if_failed)
     """
+    if stats is None:
+        stats={}
+    stats.update({"unchanged":False,"kept":0,"removed":0})
+    timings=stats["timings"]={}
+    touched=False
+    label=source or os.path.basename(pdf_path)
     try:
-        # 來源用相對路徑：uploads/xxx.pdf
-        source=os.path.relpath(pdf_path,root_dir).replace("\\","/")
-        _delete_by_source(collection,source)
+        if source is None:
+            source=_source_of(pdf_path,root_dir)
+        if file_hash is None:
+            file_hash=_file_sha256(pdf_path)
 
-        b=open(pdf_path,"rb").read()
-        file_hash=_sha256_bytes(b)
+        existing=set()
+        if incremental:
+            if not known_changed and _is_unchanged(collection,source,file_hash,chunk_size,overlap,chunk_mode,manifest=manifest):
+                stats["unchanged"]=True
+                return (0,0,None)
+            existing=_source_chunk_ids(collection,source)
+        # 接下來會動到 collection：不管成功失敗，結束時都要換版本
+        touched=True
+        if not incremental:
+            stats["removed"],_=_delete_by_source(collection,source)
+            if lexical is not None:
+                lexical.delete_source(source)
+            if vector_store is not None:
+                vector_store.delete_source(source)
 
-        pages=_extract_pdf_pages(pdf_path)
-        if not pages:
-            return (0,0,f"{source}：抽不到文字（可能是掃描檔，需要 OCR）")
+        if pages is None:
+            pages=_timed_iter(_iter_pdf_pages(pdf_path),timings,"extract")
 
-        docs=[]
-        metas=[]
-        ids=[]
-        embs=[]
-
-        chunk_count=0
-        for page_no,page_text in pages:
-            chunks=_smart_chunk(page_text,chunk_size=chunk_size,overlap=overlap)
-            for idx,c in enumerate(chunks,start=1):
-                c=c.strip()
-                if not c:
-                    continue
-                chunk_count+=1
-                # 用 file_hash+page+idx 做穩定 ID：同檔重匯不會一直累積
-                stable_id=f"{file_hash}:{page_no}:{idx}"
-                ids.append(stable_id)
-                docs.append(c)
-                metas.append({"source":source,"page":page_no,"chunk":idx,"file_hash":file_hash})
-                embs.append(_embed(c,embed_model))
+        pages_total=None
+        if progress is not None:
+            try:
+                pages_total=_pdf_page_count(pdf_path)
+            except Exception:
+                pass
+        t_start=time.perf_counter()
+        last_page=0
 
-        if not ids:
-            return (len(pages),0,f"{source}：沒有可用內容（chunk 後為空）")
+        def _report():
+            if progress is None:
+                return
+            eta=None
+            if pages_total and last_page:
+                eta=(time.perf_counter()-t_start)/last_page*max(0,pages_total-last_page)
+            progress({
+                "pages_done":last_page,"pages_total":pages_total,
+                "chunks_done":added+stats["kept"]+len(keep_ids),"eta_s":eta,
+            })
 
-        # 先刪再加（避免 Chroma 對同 ID add 的行為不一致）
-        try:
-            collection.delete(ids=ids)
-        except Exception:
-            pass
+        page_count=0
+        seen=set()
+        keep_ids=[]
+        keep_metas=[]
+
+        def _flush_keep():
+            # 沒變的 chunk 不重新 embedding，只把 metadata（file_hash、參數）更新成這一版
+            if keep_ids:
+                t0=time.perf_counter()
+                collection.update(ids=list(keep_ids),metadatas=list(keep_metas))
+                timings["write"]=timings.get("write",0.0)+time.perf_counter()-t0
+                stats["kept"]+=len(keep_ids)
+                keep_ids.clear()
+                keep_metas.clear()
+
+        def _items():
+            nonlocal page_count,last_page
+            for page_no,page_text in pages:
+                page_count+=1
+                last_page=page_no
+                _report()
+                dups={}
+                # 頁面文字抽出來時已經 normalize 過，直接用位置版切段
+                t0=time.perf_counter()
+                chunks=_chunk_page(page_text,chunk_size=chunk_size,overlap=overlap,chunk_mode=chunk_mode)
+                timings["chunk"]=timings.get("chunk",0.0)+time.perf_counter()-t0
+                for idx,ch in enumerate(chunks,start=1):
+                    c=ch.text
+                    dups[c]=dups.get(c,0)+1
+                    stable_id=_chunk_id(source,page_no,c,dups[c])
+                    seen.add(stable_id)
+                    meta={
+                        "source":source,"page":page_no,"chunk":idx,"file_hash":file_hash,
+                        "chunk_size":chunk_size,"overlap":overlap,"chunk_mode":chunk_mode,
+                        # 在該頁文字中的位置；head = 開頭從上一段複製來的 overlap 字數
+                        "start":ch.start,"end":ch.end,"head":ch.head,
+                    }
+                    if stable_id in existing:
+                        keep_ids.append(stable_id)
+                        keep_metas.append(meta)
+                        if len(keep_ids)>=256:
+                            _flush_keep()
+                        continue
+                    yield (stable_id,c,meta)
+
+        added=0
+        buf_ids,buf_docs,buf_metas,buf_embs=[],[],[],[]
+
+        def _flush_write():
+            nonlocal added
+            if not buf_ids:
+                return
+            t0=time.perf_counter()
+            # 先刪再加（避免 Chroma 對同 ID add 的行為不一致）
+            try:
+                collection.delete(ids=buf_ids)
+            except Exception:
+                pass
+            embs=np.concatenate(buf_embs)
+            if vector_store is not None:
+                # 向量只存在 vector_store，Chroma 放佔位向量；先寫向量，Chroma 查得到的段落就一定有向量
+                vector_store.add(buf_ids,embs,[source]*len(buf_ids))
+                collection.add(ids=buf_ids,documents=buf_docs,metadatas=buf_metas,embeddings=_placeholder_embeddings(len(buf_ids)))
+            else:
+                collection.add(ids=buf_ids,documents=buf_docs,metadatas=buf_metas,embeddings=embs)
+            if lexical is not None:
+                lexical.add(buf_ids,buf_docs,[source]*len(buf_ids))
+            timings["write"]=timings.get("write",0.0)+time.perf_counter()-t0
+            added+=len(buf_ids)
+            buf_ids.clear()
+            buf_docs.clear()
+            buf_metas.clear()
+            buf_embs.clear()
+            _report()
 
-        collection.add(ids=ids,documents=docs,metadatas=metas,embeddings=embs)
-        return (len(pages),len(ids),None)
+        for ids,docs,metas,embs in _iter_embedded(
+            _items(),
+            embed_model,
+            batch_size=embed_batch_size,
+            concurrency=embed_concurrency,
+            cache=embed_cache,
+            timings=timings,
+        ):
+            buf_ids.extend(ids)
+            buf_docs.extend(docs)
+            buf_metas.extend(metas)
+            buf_embs.append(embs)
+            if len(buf_ids)>=write_batch_size:
+                _flush_write()
+        _flush_write()
+        _flush_keep()
+        if pages_total:
+            last_page=pages_total
+        _report()
+
+        # 新版本已經寫好了才刪舊的，避免匯入途中這份文件整個查不到
+        stale=[i for i in existing if i not in seen]
+        t0=time.perf_counter()
+        for i in range(0,len(stale),1000):
+            collection.delete(ids=stale[i:i+1000])
+        if lexical is not None and stale:
+            lexical.delete_ids(stale)
+        if vector_store is not None and stale:
+            vector_store.delete_ids(stale)
+        timings["write"]=timings.get("write",0.0)+time.perf_counter()-t0
+        stats["removed"]+=len(stale)
+
+        for stage,secs in timings.items():
+            _METRICS.observe("rag_stage_seconds",secs,stage=f"ingest_{stage}")
+        _METRICS.observe("rag_stage_seconds",time.perf_counter()-t_start,stage="ingest_file")
+
+        if manifest is not None:
+            if seen:
+                manifest.upsert(
+                    collection.name,source,chunks=len(seen),pages=page_count,file_hash=file_hash,
+                    chunk_size=chunk_size,overlap=overlap,chunk_mode=chunk_mode,embed_model=embed_model,
+                )
+            else:
+                manifest.remove(collection.name,source)
+
+        if page_count==0:
+            return (0,0,f"{source}：抽不到文字（可能是掃描檔，需要 OCR）")
+        if added==0 and stats["kept"]==0:
+            return (page_count,0,f"{source}：沒有可用內容（chunk 後為空）")
+        return (page_count,added,None)
 
     except Exception as e:
-        return (0,0,f"{os.path.basename(pdf_path)}：匯入失敗 -> {e}")
+        return (0,0,f"{label}：匯入失敗 -> {e}")
+    finally:
+        if touched:
+            _bump_collection_version(collection)
 
 
-def ingest_uploaded_pdfs(
-    uploaded_files,
-    upload_dir:str,
+def ingest_pdf_paths(
+    pdf_paths:List[str],
+    root_dir:str,
     collection,
     embed_model:str,
     chunk_size:int,
     overlap:int,
+    chunk_mode:str="char",
+    embed_batch_size:int=32,
+    embed_concurrency:int=4,
+    embed_cache=None,
+    incremental:bool=True,
+    extract_workers:int=1,
+    extract_timeout:Optional[float]=120.0,
+    stats:Optional[Dict]=None,
+    manifest=None,
+    lexical=None,
+    on_file:Optional[Callable[[Dict],None]]=None,
+    vector_store=None,
+    sources:Optional[Dict[str,str]]=None,
+    progress:Optional[Callable[[str,Dict],None]]=None,
 )->Tuple[int,int,int,List[str]]:
     """
-    專給 Streamlit file_uploader 用
+    多份 PDF 一起匯入（上傳佇列、命令列、整個資料夾都走這裡）
+    - 多於一份且 extract_workers>1 時用 process pool 平行抽字（每份有 extract_timeout），抽好的依序交給 embedding，兩邊同時進行
+      （spawn 子 process：呼叫端的主程式要有 if __name__=="__main__" 保護）
+    - 只有一份時直接在本 process 邊抽邊 embedding
+    - incremental 時，內容與參數都沒變的檔案在抽字前就略過
+    stats 回填：unchanged_files、extract_seconds（檔名 → 抽字秒數）
+    manifest：manifest.Manifest，每份匯入完就更新摘要
+    lexical：lexical.LexicalIndex，跟 Chroma 同步
+    vector_store：vector_store.VectorStore，同 ingest_pdf_path（向量只寫進它）
+    on_file：每份檔案處理完呼叫一次，收一個 dict：path、source、status（added / unchanged / failed）、pages、chunks、kept、seconds、note
+    sources：path → 來源名稱；沒列到的用相對 root_dir 的路徑（上傳的檔案存檔名跟顯示名稱不同時用）
+    progress：progress(path, 進度 dict)，進度 dict 同 ingest_pdf_path
     return: scanned_files, added_chunks, skipped_files, notes
     """
-    os.makedirs(upload_dir,exist_ok=True)
+    if stats is None:
+        stats={}
+    stats["unchanged_files"]=0
+    stats["extract_seconds"]={}
+
+    def _source(path:str)->str:
+        return (sources or {}).get(path) or _source_of(path,root_dir)
+
+    def _notify(info:Dict)->None:
+        if on_file is not None:
+            info.setdefault("note","")
+            info.setdefault("kept",0)
+            info["source"]=_source(info["path"])
+            on_file(info)
+
     scanned=0
     added=0
     skipped=0
     notes=[]
 
-    for f in uploaded_files or []:
+    todo=[]
+    # 這裡算好的 hash 直接交給 ingest_pdf_path，每份檔案只讀一次
+    hashes={}
+    for path in pdf_paths:
+        scanned+=1
         try:
-            save_path=os.path.join(upload_dir,f.name)
-            with open(save_path,"wb") as out:
-                out.write(f.getbuffer())
+            h=_file_sha256(path)
+            if incremental:
+                if _is_unchanged(collection,_source(path),h,chunk_size,overlap,chunk_mode,manifest=manifest):
+                    stats["unchanged_files"]+=1
+                    _notify({"path":path,"status":"unchanged","pages":0,"chunks":0,"seconds":0.0})
+                    continue
+            hashes[path]=h
+            todo.append(path)
+        except Exception as e:
+            skipped+=1
+            notes.append(f"{os.path.basename(path)}：匯入失敗 -> {e}")
+            _notify({"path":path,"status":"failed","pages":0,"chunks":0,"seconds":0.0,"note":notes[-1]})
 
-            scanned+=1
+    if len(todo)>1 and extract_workers>1:
+        extracted=iter_extract_pdfs(todo,workers=extract_workers,timeout=extract_timeout)
+    else:
+        extracted=((p,None,None,None) for p in todo)
+
+    for path,pages,secs,err in extracted:
+        name=os.path.basename(path)
+        if secs is not None:
+            stats["extract_seconds"][name]=secs
+            if not err:
+                _METRICS.observe("rag_stage_seconds",secs,stage="ingest_extract")
+        if err:
+            skipped+=1
+            notes.append(f"{name}：{err}")
+            _notify({"path":path,"status":"failed","pages":0,"chunks":0,"seconds":secs or 0.0,"note":notes[-1]})
+            continue
+        t0=time.perf_counter()
+        try:
+            file_stats={}
             pages_cnt,added_cnt,note=ingest_pdf_path(
-                pdf_path=save_path,
+                pdf_path=path,
                 collection=collection,
                 embed_model=embed_model,
                 chunk_size=chunk_size,
                 overlap=overlap,
-                root_dir=upload_dir,
+                root_dir=root_dir,
+                chunk_mode=chunk_mode,
+                embed_batch_size=embed_batch_size,
+                embed_concurrency=embed_concurrency,
+                pages=pages,
+                embed_cache=embed_cache,
+                incremental=incremental,
+                stats=file_stats,
+                manifest=manifest,
+                lexical=lexical,
+                vector_store=vector_store,
+                file_hash=hashes[path],
+                known_changed=incremental,
+                source=_source(path),
+                progress=(lambda d,path=path:progress(path,d)) if progress is not None else None,
             )
             added+=added_cnt
+            if file_stats.get("unchanged"):
+                stats["unchanged_files"]+=1
             if note:
                 skipped+=1
                 notes.append(note)
+            _notify({
+                "path":path,
+                "status":"failed" if note else ("unchanged" if file_stats.get("unchanged") else "added"),
+                "pages":pages_cnt,
+                "chunks":added_cnt,
+                "kept":file_stats.get("kept",0),
+                "seconds":(secs or 0.0)+time.perf_counter()-t0,
+                "note":note or "",
+            })
 
         except Exception as e:
             skipped+=1
-            notes.append(f"{getattr(f,'name','(unknown)')}：匯入失敗 -> {e}")
+            notes.append(f"{name}：匯入失敗 -> {e}")
+            _notify({"path":path,"status":"failed","pages":0,"chunks":0,"seconds":time.perf_counter()-t0,"note":notes[-1]})
+
+    return scanned,added,skipped,notes
+
+
+def enqueue_uploaded_pdfs(jobs,uploaded_files,upload_dir:str,collection,params:Dict)->Tuple[List[int],List[str]]:
+    """
+    上傳的 PDF：存檔後排進 jobs（jobs.JobQueue），馬上回傳，不等匯入（由 run_ingest_jobs 在背景匯入）
+    params：ingest_pdf_path 的參數（embed_model、chunk_size、overlap、chunk_mode、embed_batch_size、embed_concurrency、incremental）
+    同一份內容已經在排隊/匯入中就沿用那個工作
+    檔案存在 upload_dir/<hash 前 16 碼>/<檔名>：同名但內容不同的上傳存成另一個檔，不會蓋掉排隊中工作要讀的檔；
+    來源名稱還是檔名（job 的 name），新版照樣取代舊版
+    return: job_ids, notes
+    """
+    os.makedirs(upload_dir,exist_ok=True)
+    job_ids=[]
+    notes=[]
+    for f in uploaded_files or []:
+        name=getattr(f,"name","(unknown)")
+        try:
+            data=f.getbuffer()
+            file_hash=_sha256_bytes(bytes(data))
+            save_dir=os.path.join(upload_dir,file_hash[:16])
+            save_path=os.path.join(save_dir,os.path.basename(name))
+            if not os.path.exists(save_path):
+                os.makedirs(save_dir,exist_ok=True)
+                # 先寫暫存檔再換名：兩個人同時上傳同一份也不會讀到寫一半的檔
+                tmp=f"{save_path}.{uuid.uuid4().hex}.part"
+                with open(tmp,"wb") as out:
+                    out.write(data)
+                os.replace(tmp,save_path)
+            job_id=jobs.submit(collection.name,name,save_path,file_hash,{**params,"root_dir":upload_dir})
+            if job_id not in job_ids:
+                job_ids.append(job_id)
+        except Exception as e:
+            notes.append(f"{name}：排入匯入佇列失敗 -> {e}")
+    return job_ids,notes
+
+
+def run_ingest_jobs(
+    jobs:List[Dict],
+    progress:Callable[[int,Dict],None],
+    finish:Callable[[int,Dict],None],
+    collection,
+    embed_cache=None,
+    manifest=None,
+    lexical=None,
+    vector_store=None,
+    extract_workers:int=1,
+    extract_timeout:Optional[float]=120.0,
+)->None:
+    """
+    jobs.JobQueue 的 runner：一批同參數的工作一起交給 ingest_pdf_paths（多份時用 process pool 平行抽字，
+    不會在 Streamlit process 裡一份一份抽）；來源名稱用 job["name"]（上傳時的檔名）
+    progress(job_id, 進度 dict)、finish(job_id, result)：result 有 pages、chunks（新增）、kept、unchanged、note
+    """
+    p=jobs[0]["params"]
+    by_path={j["path"]:j for j in jobs}
+
+    def _on_file(info:Dict)->None:
+        j=by_path.get(info["path"])
+        if j is not None:
+            finish(j["id"],{
+                "pages":info["pages"],"chunks":info["chunks"],"kept":info.get("kept",0),
+                "unchanged":info["status"]=="unchanged","note":info["note"],
+            })
+
+    ingest_pdf_paths(
+        list(by_path),
+        root_dir=p["root_dir"],
+        collection=collection,
+        embed_model=p["embed_model"],
+        chunk_size=int(p["chunk_size"]),
+        overlap=int(p["overlap"]),
+        chunk_mode=p.get("chunk_mode","char"),
+        embed_batch_size=int(p.get("embed_batch_size",32)),
+        embed_concurrency=int(p.get("embed_concurrency",4)),
+        embed_cache=embed_cache,
+        incremental=bool(p.get("incremental",True)),
+        extract_workers=extract_workers,
+        extract_timeout=extract_timeout,
+        manifest=manifest,
+        lexical=lexical,
+        vector_store=vector_store,
+        sources={path:j["name"] for path,j in by_path.items()},
+        progress=lambda path,d:progress(by_path[path]["id"],d),
+        on_file=_on_file,
+    )
+
+
+def known_file_hashes(collection,chunk_size:int,overlap:int,chunk_mode:str="char",manifest=None,page_size:int=5000)->set:
+    """
+    已經用同一組切段參數匯入過的 file_hash（參數不同的不算，要重切）
+    有 manifest 就查 manifest，沒有就分頁掃 collection 的 metadata
+    """
+    out=set()
+    if manifest is not None:
+        for r in manifest.list_sources(collection.name):
+            if r["file_hash"] and r["chunk_size"]==chunk_size and r["overlap"]==overlap and (r["chunk_mode"] or "char")==chunk_mode:
+                out.add(r["file_hash"])
+        return out
+    offset=0
+    while True:
+        metas=collection.get(include=["metadatas"],limit=page_size,offset=offset).get("metadatas") or []
+        for m in metas:
+            m=m or {}
+            if (
+                m.get("file_hash") and m.get("chunk_size")==chunk_size and m.get("overlap")==overlap
+                and m.get("chunk_mode","char")==chunk_mode
+            ):
+                out.add(m["file_hash"])
+        if len(metas)<page_size:
+            break
+        offset+=page_size
+    return out
 
+
+def ingest_pdf_bytes(data:bytes,source:str,collection,embed_model:str,chunk_size:int,overlap:int,**kwargs)->Tuple[int,int,Optional[str]]:
+    """
+    記憶體裡的 PDF（例如從資料庫讀出來的）：先寫成暫存檔再交給 ingest_pdf_path，結束就刪
+    source：來源名稱（例如 SIM_policies/xxx.pdf）；其他參數同 ingest_pdf_path
+    """
+    fd,tmp=tempfile.mkstemp(suffix=".pdf",prefix="rag_ingest_")
+    try:
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+        return ingest_pdf_path(
+            pdf_path=tmp,
+            collection=collection,
+            embed_model=embed_model,
+            chunk_size=chunk_size,
+            overlap=overlap,
+            root_dir=os.path.dirname(tmp),
+            source=source,
+            **kwargs,
+        )
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def ingest_pdf_blobs(
+    blobs:Iterable[Tuple[str,str,bytes]],
+    collection,
+    embed_model:str,
+    chunk_size:int,
+    overlap:int,
+    source_prefix:str="",
+    on_file:Optional[Callable[[Dict],None]]=None,
+    **kwargs,
+)->Tuple[int,int,int,List[str]]:
+    """
+    逐筆 (filename, sha256, content) 匯入，例如 policy_db.iter_policy_pdfs 的輸出；一次只處理一份，記憶體不跟筆數長
+    來源名稱是 source_prefix + filename；其他參數同 ingest_pdf_path
+    on_file：同 ingest_pdf_paths（path 欄位放 filename）
+    return: scanned_files, added_chunks, skipped_files, notes
+    """
+    scanned=0
+    added=0
+    skipped=0
+    notes=[]
+    for name,_,data in blobs:
+        scanned+=1
+        source=source_prefix+name
+        t0=time.perf_counter()
+        file_stats={}
+        pages_cnt,added_cnt,note=ingest_pdf_bytes(
+            data,source,collection,embed_model,chunk_size,overlap,stats=file_stats,**kwargs,
+        )
+        added+=added_cnt
+        if note:
+            skipped+=1
+            notes.append(note)
+        if on_file is not None:
+            on_file({
+                "path":name,
+                "source":source,
+                "status":"failed" if note else ("unchanged" if file_stats.get("unchanged") else "added"),
+                "pages":pages_cnt,
+                "chunks":added_cnt,
+                "seconds":time.perf_counter()-t0,
+                "note":note or "",
+            })
     return scanned,added,skipped,notes
 
 
-def retrieve(question:str,collection,embed_model:str,top_k:int=6)->List[Hit]:
+def _rrf(rankings:List[List[str]],k:int=60)->List[Tuple[str,float]]:
+    # reciprocal rank fusion：每個排名貢獻 1/(k+名次)，不用管兩邊分數的尺度
+    scores={}
+    for ids in rankings:
+        for rank,cid in enumerate(ids,start=1):
+            scores[cid]=scores.get(cid,0.0)+1.0/(k+rank)
+    return sorted(scores.items(),key=lambda x:-x[1])
+
+
+def retrieve(
+    question:str,
+    collection,
+    embed_model:str,
+    top_k:int=6,
+    query_cache=None,
+    lexical=None,
+    fetch_k:Optional[int]=None,
+    rrf_k:int=60,
+    reranker=None,
+    rerank_candidates:int=20,
+    rerank_budget:float=0.8,
+    stats:Optional[Dict]=None,
+    vector_store=None,
+)->List[Hit]:
+    """
+    query_cache：caches.QueryEmbeddingCache，有給就先查快取，同一題不用再算一次向量
+    lexical：lexical.LexicalIndex，有給就做混合檢索：
+      向量、關鍵字各取 fetch_k 筆（預設 top_k*4），用 RRF 合併後取前 top_k；
+      只有關鍵字命中的段落 distance 是 inf
+    reranker：rerank.Reranker，有給就先抓 rerank_candidates 段候選，重新打分後留前 top_k；
+      超過 rerank_budget 秒就照原本順序
+    stats：有給 dict 就回填 rerank（rerank.Reranker.rerank 的 info）
+    vector_store：vector_store.VectorStore，有給就用它（壓縮矩陣挑候選 + float32 精確重算）做向量查詢，
+      文字/metadata 再跟 collection（<name>_docs，見 open_collection）拿；distance 換算成 Chroma 預設的
+      squared L2（單位向量：2 - 2·cosine）
+    耗時記在 metrics：embed_query、vector_query、lexical_query、retrieve（到取得候選為止）、rerank
+    """
     q=(question or "").strip()
     if not q:
         return []
 
-    q_emb=_embed(q,embed_model)
-    res=collection.query(
-        query_embeddings=[q_emb],
-        n_results=top_k,
-        include=["documents","metadatas","distances"],
-    )
+    if reranker is not None:
+        cands=retrieve(
+            q,collection,embed_model,
+            top_k=max(int(top_k),int(rerank_candidates)),
+            query_cache=query_cache,lexical=lexical,fetch_k=fetch_k,rrf_k=rrf_k,vector_store=vector_store,
+        )
+        with _METRICS.timer("rag_stage_seconds",stage="rerank"):
+            hits,info=reranker.rerank(q,cands,int(top_k),budget=rerank_budget)
+        if stats is not None:
+            stats["rerank"]=info
+        return hits
+
+    t_start=time.perf_counter()
+    if query_cache is not None:
+        q_emb=query_cache.get_or_embed(embed_model,q,_embed)
+    else:
+        q_emb=_embed(q,embed_model)
+    fetch=max(int(top_k),int(fetch_k or top_k*4)) if lexical is not None else int(top_k)
+    vec={}
+    if vector_store is not None:
+        with _METRICS.timer("rag_stage_seconds",stage="vector_query"):
+            found=vector_store.search(q_emb,fetch)
+        if found:
+            got=collection.get(ids=[cid for cid,_ in found],include=["documents","metadatas"])
+            rows={cid:(d,m) for cid,d,m in zip(got.get("ids") or [],got.get("documents") or [],got.get("metadatas") or [])}
+            for cid,score in found:
+                # 兩邊對不起來（例如剛刪掉）時略過
+                if cid in rows:
+                    d,m=rows[cid]
+                    vec[cid]=Hit(text=d,meta=m or {},distance=2.0-2.0*score,id=cid)
+    else:
+        with _METRICS.timer("rag_stage_seconds",stage="vector_query"):
+            res=collection.query(
+                query_embeddings=[q_emb],
+                n_results=fetch,
+                include=["documents","metadatas","distances"],
+            )
+        ids=res.get("ids",[[]])[0] or []
+        docs=res.get("documents",[[]])[0] or []
+        metas=res.get("metadatas",[[]])[0] or []
+        dists=res.get("distances",[[]])[0] or []
+        for cid,d,m,dist in zip(ids,docs,metas,dists):
+            vec[cid]=Hit(text=d,meta=m or {},distance=float(dist),id=cid)
+    if lexical is None:
+        _METRICS.observe("rag_stage_seconds",time.perf_counter()-t_start,stage="retrieve")
+        return list(vec.values())[:top_k]
+
+    with _METRICS.timer("rag_stage_seconds",stage="lexical_query"):
+        lex_ids=[cid for cid,_ in lexical.search(q,fetch)]
+    fused=_rrf([list(vec),lex_ids],k=rrf_k)[:top_k]
 
-    docs=res.get("documents",[[]])[0] or []
-    metas=res.get("metadatas",[[]])[0] or []
-    dists=res.get("distances",[[]])[0] or []
+    # 只有關鍵字命中的段落，文字/metadata 從 Chroma 補
+    missing=[cid for cid,_ in fused if cid not in vec]
+    extra={}
+    if missing:
+        got=collection.get(ids=missing,include=["documents","metadatas"])
+        for cid,d,m in zip(got.get("ids") or [],got.get("documents") or [],got.get("metadatas") or []):
+            extra[cid]=Hit(text=d,meta=m or {},distance=math.inf,id=cid)
 
     out=[]
-    for d,m,dist in zip(docs,metas,dists):
-        out.append(Hit(text=d,meta=m or {},distance=float(dist)))
+    for cid,score in fused:
+        h=vec.get(cid) or extra.get(cid)
+        # 關鍵字索引跟 Chroma 對不起來（例如還在重建）時略過
+        if h is not None:
+            h.score=score
+            out.append(h)
+    _METRICS.observe("rag_stage_seconds",time.perf_counter()-t_start,stage="retrieve")
     return out
 
 
-def build_prompt(question:str,hits:List[Hit])->Tuple[str,str]:
+def prewarm_query_cache(query_cache,questions:List[str],embed_model:str,batch_size:int=32)->int:
+    """
+    把常用問題的向量先算進 query_cache（用批次 embedding），回傳新算的筆數
+    """
+    return query_cache.warm(
+        embed_model,
+        questions,
+        lambda texts:_embed_batch(texts,embed_model,batch_size=batch_size),
+    )
+
+
+def _strip_overlap(prev:str,nxt:str,max_scan:int=2000)->str:
+    """
+    舊資料沒有 head metadata 時：nxt 開頭若是「prev 的結尾 + 換行」（切段時加的 overlap），把它去掉
+    """
+    p=nxt.find("\n",0,max_scan)
+    while p!=-1:
+        if p>0 and prev.endswith(nxt[:p]):
+            return nxt[p+1:]
+        p=nxt.find("\n",p+1,max_scan)
+    return nxt
+
+
+def _core_text(h:Hit)->str:
+    # 去掉開頭從上一段複製來的 overlap（ingest 時記在 metadata 的 head）
+    head=int(h.meta.get("head") or 0)
+    return h.text[head:] if 0<head<len(h.text) else h.text
+
+
+def _merge_adjacent(hits:List[Hit])->List[Hit]:
+    """
+    同一來源、同一頁、chunk 編號相連的段落合併成一段，並去掉重複的 overlap
+    順序照每個合併段裡排名最前面的那一段；合併後的 meta 用第一段的，end / chunk_last 更新
+    """
+    groups={}
+    order=[]
+    for rank,h in enumerate(hits):
+        m=h.meta or {}
+        key=(m.get("source"),m.get("page"))
+        if key not in groups:
+            groups[key]=[]
+            order.append(key)
+        groups[key].append((rank,h))
+
+    blocks=[]
+    for key in order:
+        items=groups[key]
+        if key[0] is None or any(h.meta.get("chunk") is None for _,h in items):
+            blocks.extend(items)
+            continue
+        items.sort(key=lambda x:int(x[1].meta["chunk"]))
+        cur_rank,cur=items[0]
+        parts=[cur.text]
+        last=int(cur.meta["chunk"])
+        meta=dict(cur.meta)
+        for rank,h in items[1:]:
+            idx=int(h.meta["chunk"])
+            if idx==last:
+                continue
+            if idx==last+1:
+                core=_core_text(h) if "head" in h.meta else _strip_overlap(parts[-1],h.text)
+                parts.append(core)
+                last=idx
+                cur_rank=min(cur_rank,rank)
+                if "end" in h.meta:
+                    meta["end"]=h.meta["end"]
+                meta["chunk_last"]=idx
+                continue
+            blocks.append((cur_rank,Hit(text="\n".join(parts),meta=meta,distance=cur.distance,id=cur.id,score=cur.score)))
+            cur_rank,cur=rank,h
+            parts=[h.text]
+            last=idx
+            meta=dict(h.meta)
+        blocks.append((cur_rank,Hit(text="\n".join(parts),meta=meta,distance=cur.distance,id=cur.id,score=cur.score)))
+    blocks.sort(key=lambda x:x[0])
+    return [h for _,h in blocks]
+
+
+def _truncate_tokens(text:str,max_tokens:int)->str:
+    # 截斷後補的 "…" 本身算一個 token：內容只留 max_tokens-1 個，整段才不會超過上限
+    spans=token_spans(text)
+    if len(spans)<=max_tokens:
+        return text
+    if max_tokens<=0:
+        return ""
+    keep=max_tokens-1
+    return (text[:spans[keep-1][1]].rstrip() if keep else "")+"…"
+
+
+def build_prompt(
+    question:str,
+    hits:List[Hit],
+    max_context_tokens:Optional[int]=None,
+    min_block_tokens:int=64,
+    stats:Optional[Dict]=None,
+)->Tuple[str,str]:
+    """
+    - 同來源同頁、相鄰的段落合併，去掉 overlap 重複的文字
+    - max_context_tokens：context 的 token 上限（tokenizer.count_tokens 估算）；照排名放，
+      放不下的那段剩不到 min_block_tokens 就不放，夠的話截斷放進去
+    stats：有給 dict 就回填
+      - hits：實際放進 prompt 的段落（合併後，編號就是 [1]、[2]…）
+      - context_tokens_raw / context_tokens：原始 / 處理後的 context token 數
+      - prompt_tokens：system + user 的 token 數（估算）
+      - dropped：因為超過上限沒放進去的段數
+    """
+    t_start=time.perf_counter()
+    raw_tokens=sum(count_tokens(h.text) for h in hits)
+    blocks=_merge_adjacent(hits)
+
+    used=[]
+    used_tokens=0
+    dropped=0
+    for h in blocks:
+        n=count_tokens(h.text)
+        if max_context_tokens is not None and used_tokens+n>max_context_tokens:
+            left=max_context_tokens-used_tokens
+            if left<min_block_tokens:
+                dropped+=1
+                continue
+            h=Hit(text=_truncate_tokens(h.text,left),meta=h.meta,distance=h.distance,id=h.id,score=h.score)
+            n=count_tokens(h.text)
+        used.append(h)
+        used_tokens+=n
+
     ctx_lines=[]
     src_lines=[]
-    for i,h in enumerate(hits,start=1):
+    for i,h in enumerate(used,start=1):
         src=h.meta.get("source","unknown")
         page=h.meta.get("page",None)
         src_label=f"{src}（第{page}頁）" if page else src
@@ -284,13 +1589,99 @@ def build_prompt(question:str,hits:List[Hit])->Tuple[str,str]:
         f"Question:\n{question}\n\n"
         "Answer in Traditional Chinese. Keep it concise and actionable."
     )
+    if stats is not None:
+        stats.update({
+            "hits":used,
+            "context_tokens_raw":raw_tokens,
+            "context_tokens":used_tokens,
+            "prompt_tokens":count_tokens(system)+count_tokens(user),
+            "dropped":dropped,
+        })
+    _METRICS.observe("rag_stage_seconds",time.perf_counter()-t_start,stage="build_prompt")
     return system,user
 
 
+def _record_chat(model:str,resp:Optional[Dict])->None:
+    # Ollama 最後一段回應帶 prompt_eval_count / eval_count
+    resp=resp or {}
+    for kind,key in (("prompt","prompt_eval_count"),("eval","eval_count")):
+        n=resp.get(key) or 0
+        if n:
+            _METRICS.inc("rag_llm_tokens_total",n,model=model,kind=kind)
+
+
 def chat_llm(system_prompt:str,user_prompt:str,model:str,temperature:float=0.2)->str:
     messages=[
         {"role":"system","content":system_prompt},
         {"role":"user","content":user_prompt},
     ]
-    r=ollama.chat(model=model,messages=messages,options={"temperature":temperature})
+    _METRICS.inc("rag_llm_requests_total",model=model)
+    with _SCHEDULER.slot(PRIORITY_CHAT) as waited:
+        _METRICS.observe("rag_stage_seconds",waited,stage="chat_queue")
+        with _METRICS.timer("rag_stage_seconds",stage="chat"):
+            r=ollama.chat(model=model,messages=messages,options={"temperature":temperature})
+    _record_chat(model,r)
     return (r.get("message",{}) or {}).get("content","") or ""
+
+
+def chat_llm_stream(
+    system_prompt:str,
+    user_prompt:str,
+    model:str,
+    temperature:float=0.2,
+    stats:Optional[Dict]=None,
+    on_queue:Optional[Callable[[int],None]]=None,
+)->Iterator[str]:
+    """
+    串流版 chat_llm：模型每吐出一小段文字就 yield 一次（可直接丟給 st.write_stream）
+    整段生成期間佔住排程器的一個名額；on_queue(n)：需要排隊時回報名次（輪到時是 0），見 Scheduler.slot
+    stats：有給 dict 就回填
+      - queue_s：排隊等了幾秒
+      - ttft_s：送出到第一段文字的秒數（含排隊）
+      - total_s：整段回答的秒數
+      - tokens / tokens_per_s：Ollama 最後回報的 eval_count / eval_duration（舊版沒有就用收到的段數估）
+      - prompt_tokens：Ollama 回報的 prompt_eval_count
+    metrics 記 chat_queue、chat_ttft、chat（不含排隊）與 token 數；中途不讀了（generator 被關掉）就只記到排隊
+    """
+    if stats is None:
+        stats={}
+    messages=[
+        {"role":"system","content":system_prompt},
+        {"role":"user","content":user_prompt},
+    ]
+    t0=time.perf_counter()
+    t_first=None
+    pieces=0
+    last=None
+    _METRICS.inc("rag_llm_requests_total",model=model)
+    with _SCHEDULER.slot(PRIORITY_CHAT,on_position=on_queue) as waited:
+        stats["queue_s"]=waited
+        _METRICS.observe("rag_stage_seconds",waited,stage="chat_queue")
+        t_run=time.perf_counter()
+        for part in ollama.chat(model=model,messages=messages,options={"temperature":temperature},stream=True):
+            last=part
+            text=(part.get("message",{}) or {}).get("content","") or ""
+            if not text:
+                continue
+            if t_first is None:
+                t_first=time.perf_counter()
+                stats["ttft_s"]=t_first-t0
+                _METRICS.observe("rag_stage_seconds",t_first-t_run,stage="chat_ttft")
+            pieces+=1
+            yield text
+
+    t_end=time.perf_counter()
+    _METRICS.observe("rag_stage_seconds",t_end-t_run,stage="chat")
+    _record_chat(model,last)
+    stats["total_s"]=t_end-t0
+    stats.setdefault("ttft_s",stats["total_s"])
+    eval_count=(last or {}).get("eval_count") or 0
+    eval_ns=(last or {}).get("eval_duration") or 0
+    if eval_count and eval_ns:
+        stats["tokens"]=int(eval_count)
+        stats["tokens_per_s"]=eval_count/(eval_ns/1e9)
+    else:
+        gen_s=t_end-(t_first or t_end)
+        stats["tokens"]=pieces
+        stats["tokens_per_s"]=(pieces/gen_s) if gen_s>0 else 0.0
+    stats["prompt_tokens"]=int((last or {}).get("prompt_eval_count") or 0)
@@ -0,0 +1,157 @@
+# scheduler.py
+"""
+Ollama 請求排程：整個 process 共用一個佇列，同時送進 Ollama 的請求最多 max_concurrent 個
+
+- 30 個人同時問，Ollama（單機 CPU）同時跑 30 個生成只會每個都很慢；排隊依序跑，平均與尾端延遲都比較好
+- 優先序（數字小的先）：問題 embedding > 生成回答 > 匯入/預熱的 embedding
+  問題 embedding 很短，先做完檢索，等待中的人才不會卡在別人的長生成後面；背景匯入不會擠掉線上問答
+- 同一個優先序內先來先做（FIFO）
+- 老化（aging）：每排隊 aging_s 秒優先序往前一級（最多到問題 embedding 那級），
+  線上問答一直有人問時，背景匯入最久也只會等大約 2×aging_s 就輪得到，不會餓死；aging_s=0 就是純粹的嚴格優先序
+- 等待中可以回報排第幾個（給畫面顯示）；stats() 給佇列深度、等待時間、服務時間
+"""
+import time
+import itertools
+import threading
+import contextlib
+from collections import deque
+from typing import Dict, Callable, Optional, Iterator
+
+PRIORITY_QUERY=0   # 問題 embedding（檢索）
+PRIORITY_CHAT=1    # 生成回答
+PRIORITY_INGEST=2  # 匯入 / 預熱的 embedding
+
+PRIORITY_NAMES={PRIORITY_QUERY:"query_embed",PRIORITY_CHAT:"chat",PRIORITY_INGEST:"ingest_embed"}
+
+
+def _pct(vals,q:float)->float:
+    if not vals:
+        return 0.0
+    s=sorted(vals)
+    return s[min(len(s)-1,int(q*len(s)))]
+
+
+class Scheduler:
+    """
+    max_concurrent：同時送進 Ollama 的請求數（Ollama 的 OLLAMA_NUM_PARALLEL 設多少就跟著設）
+    window：等待/服務時間的百分位數用最近幾筆算
+    aging_s：排隊每多久優先序往前一級（0 = 不老化）
+    """
+
+    def __init__(self,max_concurrent:int=2,window:int=1000,aging_s:float=10.0):
+        self.max_concurrent=max(1,int(max_concurrent))
+        self.window=int(window)
+        self.aging_s=max(0.0,float(aging_s))
+        self._cv=threading.Condition()
+        # 排隊中的 (priority, seq, 進來的時間)；人數不多（同時在線的人數等級），挑下一個直接掃一遍
+        self._waiting=[]
+        self._seq=itertools.count()
+        self._running=0
+        self._stats={p:self._new_stats() for p in PRIORITY_NAMES}
+
+    def _new_stats(self)->Dict:
+        return {"requests":0,"wait_total":0.0,"service_total":0.0,"waits":deque(maxlen=self.window),"services":deque(maxlen=self.window)}
+
+    def set_limit(self,max_concurrent:int)->None:
+        with self._cv:
+            self.max_concurrent=max(1,int(max_concurrent))
+            self._cv.notify_all()
+
+    def set_aging(self,aging_s:float)->None:
+        with self._cv:
+            self.aging_s=max(0.0,float(aging_s))
+            self._cv.notify_all()
+
+    def _key(self,ticket,now:float):
+        # 老化後的排序鍵：(目前的優先序, 先來後到)
+        priority,seq,t0=ticket
+        if self.aging_s>0:
+            priority=max(PRIORITY_QUERY,priority-int((now-t0)/self.aging_s))
+        return (priority,seq)
+
+    def _head_locked(self,now:float):
+        return min(self._waiting,key=lambda t:self._key(t,now))
+
+    def _position_locked(self,ticket,now:float)->int:
+        # 1 = 下一個輪到
+        k=self._key(ticket,now)
+        return 1+sum(1 for t in self._waiting if self._key(t,now)<k)
+
+    @contextlib.contextmanager
+    def slot(self,priority:int=PRIORITY_CHAT,on_position:Optional[Callable[[int],None]]=None)->Iterator[float]:
+        """
+        with scheduler.slot(PRIORITY_CHAT): 呼叫 Ollama
+        輪到之前一直擋著；yield 等了幾秒
+        on_position(n)：排隊時名次有變就呼叫（n 從 1 開始），輪到時呼叫 on_position(0)；
+          只有真的需要排隊才會被呼叫，在排隊的那個 thread 裡呼叫（Streamlit 可以直接更新畫面）
+        """
+        t0=time.perf_counter()
+        ticket=(priority,next(self._seq),time.monotonic())
+        shown=None
+        with self._cv:
+            self._waiting.append(ticket)
+            try:
+                while not (self._running<self.max_concurrent and self._head_locked(time.monotonic())==ticket):
+                    pos=self._position_locked(ticket,time.monotonic())
+                    if on_position is not None and pos!=shown:
+                        shown=pos
+                        # callback 可能會更新畫面，不要拿著鎖呼叫
+                        self._cv.release()
+                        try:
+                            on_position(pos)
+                        finally:
+                            self._cv.acquire()
+                        continue
+                    self._cv.wait(timeout=1.0)
+            except BaseException:
+                # 排隊中被中斷（例如 Streamlit rerun）：把自己移出佇列
+                self._waiting.remove(ticket)
+                self._cv.notify_all()
+                raise
+            self._waiting.remove(ticket)
+            self._running+=1
+            # 後面的人名次都往前了
+            self._cv.notify_all()
+        waited=time.perf_counter()-t0
+        t1=time.perf_counter()
+        try:
+            if shown is not None:
+                on_position(0)
+            yield waited
+        finally:
+            service=time.perf_counter()-t1
+            with self._cv:
+                self._running-=1
+                s=self._stats.get(priority)
+                if s is None:
+                    s=self._stats[priority]=self._new_stats()
+                s["requests"]+=1
+                s["wait_total"]+=waited
+                s["service_total"]+=service
+                s["waits"].append(waited)
+                s["services"].append(service)
+                self._cv.notify_all()
+
+    def stats(self)->Dict:
+        """
+        depth：排隊中、running：執行中、limit：上限、aging_s：老化間隔
+        by_priority：每個優先序的 requests、waiting、wait_p50/p95/mean、service_p50/p95/mean（秒）
+        """
+        with self._cv:
+            waiting={}
+            for p,_,_ in self._waiting:
+                waiting[p]=waiting.get(p,0)+1
+            out={"depth":len(self._waiting),"running":self._running,"limit":self.max_concurrent,"aging_s":self.aging_s,"by_priority":{}}
+            for p,s in self._stats.items():
+                n=s["requests"]
+                out["by_priority"][PRIORITY_NAMES.get(p,str(p))]={
+                    "requests":n,
+                    "waiting":waiting.get(p,0),
+                    "wait_p50":_pct(s["waits"],0.5),
+                    "wait_p95":_pct(s["waits"],0.95),
+                    "wait_mean":(s["wait_total"]/n) if n else 0.0,
+                    "service_p50":_pct(s["services"],0.5),
+                    "service_p95":_pct(s["services"],0.95),
+                    "service_mean":(s["service_total"]/n) if n else 0.0,
+                }
+        return out
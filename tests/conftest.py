@@ -0,0 +1,8 @@
+# tests/conftest.py
+# 測試直接 import 專案根目錄的模組（rag、caches…），跟 app.py / ingest_cli.py 一樣
+import sys
+from pathlib import Path
+
+ROOT=Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0,str(ROOT))
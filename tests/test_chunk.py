@@ -0,0 +1,99 @@
+# tests/test_chunk.py
+"""
+切段黃金測試：單趟的 rag._chunk_spans / _smart_chunk 必須跟舊版遞迴實作一字不差
+
+- GOLDEN：固定輸入的舊版輸出，直接凍結成字面值（舊版改壞了也抓得到）
+- 隨機比對：跟 benchmarks.bench_chunk.legacy_smart_chunk（舊版原封不動的副本）比
+"""
+import random
+
+import pytest
+
+import rag
+from rag import _normalize_text
+from benchmarks.bench_chunk import legacy_smart_chunk,_check_one
+
+_NO_SEP="員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理"*4
+
+# (text, chunk_size, overlap, 舊版輸出)
+GOLDEN=[
+    (
+        "第一條 員工應準時上下班。遲到三次者記申誡一次。\n\n第二條 加班須事先申請，經主管核准後始得加班。加班費依勞基法計算。\n第三條 本規則經總經理核准後施行。",
+        40,10,
+        [
+            "第一條 員工應準時上下班。遲到三次者記申誡一次。",
+            "到三次者記申誡一次。\n第二條 加班須事先申請，經主管核准後始得加班。加班費依勞基法計算。",
+            "加班費依勞基法計算。\n第三條 本規則經總經理核准後施行。",
+        ],
+    ),
+    # 沒有任何分隔符號：每 chunk_size 個字硬切
+    (
+        _NO_SEP,50,0,
+        [
+            "員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理員工請假出勤加班薪資獎金規則公司主",
+            "管核准申請時數計算依照本辦法辦理員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理員",
+            "工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理",
+        ],
+    ),
+    (
+        _NO_SEP,50,8,
+        [
+            "員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理員工請假出勤加班薪資獎金規則公司主",
+            "資獎金規則公司主\n管核准申請時數計算依照本辦法辦理員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理員",
+            "依照本辦法辦理員\n工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理",
+        ],
+    ),
+    (
+        "Employees must submit leave requests. Managers approve within two days. Overtime is paid hourly.",
+        30,5,
+        ["Employees must submit leave","leave\nrequests","uests\nManagers approve within two","n two\ndays","days\nOvertime is paid hourly."],
+    ),
+    # overlap >= chunk_size：整段前一段都接上去
+    (
+        "特休怎麼算？到職滿半年者三日！滿一年者七日。滿二年者十日。",
+        12,12,
+        ["特休怎麼算","特休怎麼算\n到職滿半年者三日","到職滿半年者三日\n滿一年者七日","滿一年者七日\n滿二年者十日。"],
+    ),
+    (
+        "特休怎麼算？到職滿半年者三日！滿一年者七日。滿二年者十日。",
+        12,50,
+        ["特休怎麼算","特休怎麼算\n到職滿半年者三日","到職滿半年者三日\n滿一年者七日","滿一年者七日\n滿二年者十日。"],
+    ),
+    ("  a\t b  \n\n\n\n  c   d  ",3,1,["a b","b\nc d"]),
+    ("   \n\n  ",10,2,[]),
+    ("",10,2,[]),
+]
+
+
+@pytest.mark.parametrize("text,chunk_size,overlap,want",GOLDEN)
+def test_golden(text,chunk_size,overlap,want):
+    assert legacy_smart_chunk(text,chunk_size,overlap)==want
+    assert rag._smart_chunk(text,chunk_size,overlap)==want
+
+
+@pytest.mark.parametrize("text,chunk_size,overlap,want",GOLDEN)
+def test_spans_map_back_to_text(text,chunk_size,overlap,want):
+    norm=_normalize_text(text)
+    spans=rag._chunk_spans(norm,chunk_size,overlap)
+    assert [c.text for c in spans]==want
+    for c in spans:
+        core=c.text[c.head:]
+        span=norm[c.start:c.end]
+        assert span[:1]==core[:1] and span[-1:]==core[-1:]
+        assert len(core)<=len(span)
+
+
+def test_random_against_legacy():
+    alpha=list("ab ．.。！？\n　\t 中文字x. ")+["\n\n",". ",". \n"," \n","\n \n"]
+    rnd=random.Random(1)
+    for _ in range(3000):
+        t="".join(rnd.choice(alpha) for _ in range(rnd.randint(0,160)))
+        _check_one(t,rnd.randint(1,60),rnd.choice([0,0,1,3,10,50,80]))
+
+
+def test_long_text_without_separators():
+    # 舊版在這裡會遞迴過深；新版要硬切成 chunk_size 的段落、接回去跟原文一樣
+    text="規則"*50000
+    chunks=rag._smart_chunk(text,800,0)
+    assert all(len(c)<=800 for c in chunks)
+    assert "".join(chunks)==text
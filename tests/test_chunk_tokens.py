@@ -0,0 +1,121 @@
+# tests/test_chunk_tokens.py
+"""token 模式切段：rag._text_units / _chunk_spans_tokens 的預算、斷點、標題另起一段、長句硬切，以及 tokenizer 的估算規則"""
+import pytest
+
+import rag
+from tokenizer import count_tokens,token_spans
+
+_PAGE=(
+    "第一條 員工應準時上下班；遲到三次者：記申誡一次」。　主管得視情況從寬認定\n"
+    "一、加班須事先申請，經主管核准後始得加班；加班費依勞基法計算。\n"
+    "二、國定假日出勤者，工資加倍發給。\n"
+    "第二條 員工請假應填寫請假單：病假全年不得超過三十日；事假全年不得超過十四日。\n"
+    "（一）婚假八日。（二）喪假依親等給假。\n"
+    "第三條 本規則經總經理核准後施行，修正時亦同。"
+)
+
+
+def _check(page:str,chunks,max_tokens:int):
+    for c in chunks:
+        assert count_tokens(c.text)<=max_tokens
+        assert c.text==page[c.start-c.head:c.end]
+    # 每段的本體前後相接，中間只跳過空白
+    for a,b in zip(chunks,chunks[1:]):
+        assert page[a.end:b.start].strip()==""
+    assert chunks[0].start==0 and chunks[-1].end==len(page)
+
+
+def test_token_spans_and_count():
+    # 英文字一個 token、超過 4 個字母每 4 個一段；數字每 3 位一段；中文字/標點一字一個
+    assert token_spans("ab overtime")==[(0,2),(3,7),(7,11)]
+    assert count_tokens("2500 元。")==4
+    assert count_tokens("Employees overtime")==len(token_spans("Employees overtime"))==5
+    # start/end 只看中間那一段，位置還是原文的
+    assert token_spans("加班 overtime",3)==[(3,7),(7,11)]
+    assert count_tokens("")==0
+
+
+def test_text_units_split_on_chinese_punct_and_headings():
+    page="第一條 員工應準時上下班；遲到三次者：記申誡一次」。主管得核准　一、加班須事先申請。"
+    units=[(page[a:b],h,t) for a,b,h,t in rag._text_units(page)]
+    assert units==[
+        ("第一條 員工應準時上下班；",True,12),
+        ("遲到三次者：",False,6),
+        # 引號後面接句號：一起算句尾
+        ("記申誡一次」。",False,7),
+        ("主管得核准",False,5),
+        # 不在行首的「一、」不算標題
+        ("一、加班須事先申請。",False,10),
+    ]
+
+
+def test_text_units_line_headings_and_list_items():
+    page="前言說明\n一、加班須事先申請\n第二條 請假\n（一）婚假八日\n1. 喪假"
+    units=[(page[a:b],h) for a,b,h,_ in rag._text_units(page)]
+    assert units==[
+        ("前言說明",False),
+        ("一、加班須事先申請",True),
+        ("第二條 請假",True),
+        ("（一）婚假八日",False),
+        ("1. 喪假",False),
+    ]
+
+
+@pytest.mark.parametrize("max_tokens,overlap",[(16,0),(24,6),(40,8),(64,16),(200,32)])
+def test_chunks_fit_budget_and_map_back_to_page(max_tokens,overlap):
+    chunks=rag._chunk_page(_PAGE,max_tokens,overlap,chunk_mode="token")
+    _check(_PAGE,chunks,max_tokens)
+    if overlap:
+        assert all(c.head>0 for c in chunks[1:])
+        assert chunks[0].head==0
+    else:
+        assert all(c.head==0 for c in chunks)
+
+
+def test_breaks_land_on_chinese_punct_and_fullwidth_space():
+    page="遲到三次者：記申誡一次」。主管得核准　病假三十日；事假十四日。"
+    # 每句 5~7 token、預算 10：兩句塞不下就斷，斷點都在句尾標點/引號之後或全形空白前
+    assert [page[c.start:c.end] for c in rag._chunk_spans_tokens(page,max_tokens=10,overlap_tokens=0)]==[
+        "遲到三次者：","記申誡一次」。","主管得核准","病假三十日；","事假十四日。",
+    ]
+    chunks=rag._chunk_spans_tokens(_PAGE,max_tokens=24,overlap_tokens=0)
+    assert max(u[3] for u in rag._text_units(_PAGE))<=24
+    # 沒有單句超過預算：句子本身不會被切開
+    for c in chunks[:-1]:
+        assert _PAGE[c.end-1] in "。；：」" or _PAGE[c.end] in "　\n"
+
+
+def test_heading_starts_new_chunk_after_half_budget():
+    page="第一條 員工應準時上下班不得遲到早退。\n第二條 加班須事先申請。\n一、國定假日出勤。"
+    # 前一句 19 token 已過半（36//2）：「第二條」塞得下，還是另起一段；「一、」同理
+    assert [page[c.start:c.end] for c in rag._chunk_spans_tokens(page,max_tokens=36,overlap_tokens=0)]==[
+        "第一條 員工應準時上下班不得遲到早退。",
+        "第二條 加班須事先申請。\n一、國定假日出勤。",
+    ]
+    page="第一條 員工應準時上下班不得遲到早退。\n一、國定假日出勤。"
+    assert [page[c.start:c.end] for c in rag._chunk_spans_tokens(page,max_tokens=36,overlap_tokens=0)]==[
+        "第一條 員工應準時上下班不得遲到早退。",
+        "一、國定假日出勤。",
+    ]
+    # 還沒過半就不另起
+    assert len(rag._chunk_spans_tokens("第一條 準時。\n一、加班須事先申請。",max_tokens=36,overlap_tokens=0))==1
+    # 清單項目只是斷點，不會強迫另起一段
+    items="第一條 員工應準時上下班不得遲到早退。\n（一）婚假八日。\n1. 喪假。"
+    assert len(rag._chunk_spans_tokens(items,max_tokens=36,overlap_tokens=0))==1
+
+
+def test_long_sentence_is_hard_split_by_tokens():
+    page="員工請假出勤加班薪資獎金規則公司主管核准申請時數計算依照本辦法辦理"*3+"。"
+    chunks=rag._chunk_spans_tokens(page,max_tokens=20,overlap_tokens=4)
+    _check(page,chunks,20)
+    # 本體每段 16 token（20-4）；整句只有一個 unit，overlap 取前一段最後 4 個 token
+    assert [count_tokens(page[c.start:c.end]) for c in chunks[:-1]]==[16]*(len(chunks)-1)
+    assert all(c.head==4 for c in chunks[1:])
+    assert "".join(page[c.start:c.end] for c in chunks)==page
+
+
+def test_english_words_are_split_into_pieces():
+    page="Employees must submit overtime requests before Friday. "*6
+    chunks=rag._chunk_spans_tokens(page.strip(),max_tokens=30,overlap_tokens=6)
+    _check(page.strip(),chunks,30)
+    assert len(chunks)>1
@@ -0,0 +1,67 @@
+# tests/test_embedding_cache.py
+"""EmbeddingCache：命中/未命中、超過上限時依最後使用時間淘汰（LRU）、覆寫與重開時的大小計算"""
+import numpy as np
+import pytest
+
+import caches
+from caches import EmbeddingCache
+
+# 每筆 4 維 float32 = 16 bytes
+_DIM=4
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # last_used 用假時鐘，每次呼叫 +1 秒，淘汰順序才確定
+    t=[1000.0]
+
+    def _now():
+        t[0]+=1.0
+        return t[0]
+
+    monkeypatch.setattr(caches.time,"time",_now)
+    return t
+
+
+def _vec(i:int):
+    return np.full(_DIM,float(i),dtype=np.float32)
+
+
+def test_embedding_cache_roundtrip(tmp_path):
+    c=EmbeddingCache(str(tmp_path/"emb.sqlite3"))
+    c.put_many("m",["甲","乙"],[_vec(1),_vec(2)])
+    got=c.get_many("m",["甲","丙","乙"])
+    assert got[1] is None
+    np.testing.assert_array_equal(got[0],_vec(1))
+    np.testing.assert_array_equal(got[2],_vec(2))
+    # 不同模型不共用
+    assert c.get_many("other",["甲"])==[None]
+    st=c.stats()
+    assert (st["hits"],st["misses"],st["entries"])==(2,2,2)
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path,clock):
+    c=EmbeddingCache(str(tmp_path/"emb.sqlite3"),max_bytes=100)
+    for i in range(6):
+        c.put_many("m",[f"t{i}"],[_vec(i)])
+    assert c.stats()["bytes"]==96
+    # 讀過的 t0 變成最近使用，超過上限時淘汰的是 t1、t2（砍到 90 bytes 以下）
+    c.get_many("m",["t0"])
+    c.put_many("m",["t6"],[_vec(6)])
+    got=c.get_many("m",[f"t{i}" for i in range(7)])
+    assert [g is not None for g in got]==[True,False,False,True,True,True,True]
+    st=c.stats()
+    assert st["bytes"]<=int(100*0.9)
+    assert st["entries"]==5
+
+
+def test_embedding_cache_overwrite_and_reopen_keep_byte_count(tmp_path,clock):
+    path=str(tmp_path/"emb.sqlite3")
+    c=EmbeddingCache(path,max_bytes=1000)
+    c.put_many("m",["a","b"],[_vec(1),_vec(2)])
+    # 覆寫同一個 key 不會重複計算大小
+    c.put_many("m",["a"],[_vec(3)])
+    assert c.stats()["bytes"]==32
+    assert EmbeddingCache(path,max_bytes=1000).stats()["bytes"]==32
+    c.clear()
+    assert c.stats()["bytes"]==0
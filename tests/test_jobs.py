@@ -0,0 +1,102 @@
+# tests/test_jobs.py
+"""JobQueue：同一份內容不會重複排隊、process 重開時把執行中的工作改回排隊重跑、runner 的結果寫回工作表"""
+import time
+import threading
+
+from jobs import JobQueue,QUEUED,RUNNING,DONE,FAILED
+
+
+def _wait_status(q:JobQueue,job_id:int,status:str,timeout:float=5.0)->dict:
+    end=time.time()+timeout
+    while True:
+        j=q.get(job_id)
+        if j["status"]==status or time.time()>end:
+            return j
+        time.sleep(0.02)
+
+
+class _Runner:
+    """記下每批拿到的工作；gate 沒打開前一直擋著（模擬匯入中）"""
+
+    def __init__(self,block:bool=False):
+        self.gate=threading.Event()
+        if not block:
+            self.gate.set()
+        self.batches=[]
+
+    def __call__(self,jobs,progress,finish):
+        self.batches.append([j["id"] for j in jobs])
+        self.gate.wait(timeout=10)
+        for j in jobs:
+            progress(j["id"],{"pages_done":1,"pages_total":1,"chunks_done":2})
+            finish(j["id"],{"chunks":2,"note":"" if j["name"]!="bad.pdf" else "壞檔"})
+
+
+def test_submit_dedupes_active_jobs(tmp_path):
+    runner=_Runner(block=True)
+    q=JobQueue(str(tmp_path/"jobs.sqlite3"),runner)
+    try:
+        a=q.submit("kb","a.pdf","/u/a.pdf","h1",{"chunk_size":800})
+        # 同一份內容（同 collection、同 hash）還在排隊/執行中：拿到同一個 id
+        assert q.submit("kb","a-copy.pdf","/u/a2.pdf","h1",{"chunk_size":800})==a
+        # 別的 collection 不算重複
+        b=q.submit("other","a.pdf","/u/a.pdf","h1",{"chunk_size":800})
+        assert b!=a
+        assert q.active_count("kb")==1
+    finally:
+        runner.gate.set()
+    assert _wait_status(q,a,DONE)["status"]==DONE
+    # 做完之後可以再排一次
+    assert q.submit("kb","a.pdf","/u/a.pdf","h1",{"chunk_size":800})!=a
+
+
+def test_results_and_failures_are_recorded(tmp_path):
+    q=JobQueue(str(tmp_path/"jobs.sqlite3"),_Runner())
+    ok=q.submit("kb","ok.pdf","/u/ok.pdf","h1",{})
+    bad=q.submit("kb","bad.pdf","/u/bad.pdf","h2",{})
+    j=_wait_status(q,ok,DONE)
+    assert (j["status"],j["chunks_done"],j["pages_done"],j["result"]["chunks"])==(DONE,2,1,2)
+    j=_wait_status(q,bad,FAILED)
+    assert (j["status"],j["note"])==(FAILED,"壞檔")
+    assert q.clear_finished("kb")==2
+
+
+def test_runner_without_result_marks_job_failed(tmp_path):
+    q=JobQueue(str(tmp_path/"jobs.sqlite3"),lambda jobs,progress,finish:None)
+    j=_wait_status(q,q.submit("kb","a.pdf","/u/a.pdf","h1",{}),FAILED)
+    assert j["status"]==FAILED and j["note"]
+
+
+def test_running_jobs_are_requeued_on_restart(tmp_path):
+    path=str(tmp_path/"jobs.sqlite3")
+    stuck=_Runner(block=True)
+    q1=JobQueue(path,stuck)
+    try:
+        job=q1.submit("kb","a.pdf","/u/a.pdf","h1",{})
+        assert _wait_status(q1,job,RUNNING)["status"]==RUNNING
+        # 模擬 process 當掉後重開：同一個檔案開新的 JobQueue
+        runner=_Runner(block=True)
+        q2=JobQueue(path,runner)
+        assert q2.get(job)["status"] in (QUEUED,RUNNING)
+        runner.gate.set()
+        j=_wait_status(q2,job,DONE)
+        assert j["status"]==DONE
+        assert runner.batches==[[job]]
+    finally:
+        stuck.gate.set()
+
+
+def test_worker_batches_jobs_with_same_params(tmp_path):
+    runner=_Runner(block=True)
+    q=JobQueue(str(tmp_path/"jobs.sqlite3"),runner,batch_size=8)
+    try:
+        first=q.submit("kb","0.pdf","/u/0.pdf","h0",{"chunk_size":800})
+        _wait_status(q,first,RUNNING)
+        ids=[q.submit("kb",f"{i}.pdf",f"/u/{i}.pdf",f"h{i}",{"chunk_size":800}) for i in range(1,4)]
+        other=q.submit("kb","x.pdf","/u/x.pdf","hx",{"chunk_size":400})
+    finally:
+        runner.gate.set()
+    for i in [first,*ids,other]:
+        assert _wait_status(q,i,DONE)["status"]==DONE
+    # 第一批只有 first；之後同參數的三個一起，參數不同的另外一批
+    assert runner.batches==[[first],ids,[other]]
@@ -0,0 +1,64 @@
+# tests/test_lexical.py
+"""LexicalIndex：斷詞、新增/覆蓋、刪除、BM25 查詢、太常見的詞不查"""
+from lexical import LexicalIndex,lexical_terms
+
+_DOCS={
+    "c1":("第十六條 員工加班應事前申請，一個月加班不得超過46小時。","policies/overtime.pdf"),
+    "c2":("第八條 員工請假應填寫請假單，病假全年不得超過30日。","policies/leave.pdf"),
+    "c3":("第三條 員工出差旅費依 Travel Policy 報支，住宿上限 2,500 元。","policies/travel.pdf"),
+}
+
+
+def _index(tmp_path,**kw)->LexicalIndex:
+    idx=LexicalIndex(str(tmp_path/"lexical.sqlite3"),**kw)
+    ids=list(_DOCS)
+    idx.add(ids,[_DOCS[i][0] for i in ids],[_DOCS[i][1] for i in ids])
+    return idx
+
+
+def test_lexical_terms():
+    assert lexical_terms("加班費")==["加班","班費"]
+    # 全形轉半形、英文小寫、數字去千分位
+    assert lexical_terms("Travel ２,５００元")==["travel","2500","元"]
+
+
+def test_search_ranks_exact_terms(tmp_path):
+    idx=_index(tmp_path)
+    assert idx.count()==3
+    assert idx.search("加班可以超過46小時嗎",k=3)[0][0]=="c1"
+    assert idx.search("病假幾天",k=3)[0][0]=="c2"
+    assert [cid for cid,_ in idx.search("travel 2500",k=3)]==["c3"]
+    assert idx.search("完全無關 xyz",k=3)==[]
+
+
+def test_add_same_id_overwrites(tmp_path):
+    idx=_index(tmp_path)
+    idx.add(["c2"],["第八條 婚假八日。"],["policies/leave.pdf"])
+    assert idx.count()==3
+    assert idx.search("病假",k=3)==[]
+    assert idx.search("婚假",k=3)[0][0]=="c2"
+
+
+def test_delete_ids_and_source(tmp_path):
+    idx=_index(tmp_path)
+    assert idx.delete_ids(["c1","missing"])==1
+    assert idx.search("加班",k=3)==[]
+    assert idx.delete_source("policies/travel.pdf")==1
+    assert idx.count()==1
+    assert [cid for cid,_ in idx.search("員工",k=3)]==["c2"]
+    idx.clear()
+    assert idx.count()==0
+
+
+def test_common_terms_are_skipped(tmp_path):
+    # 「員工」三段都有，超過 max_df 就不拿來查；整句都是常見詞時回傳空的
+    idx=_index(tmp_path,max_df=2)
+    assert idx.search("員工",k=3)==[]
+    assert idx.search("員工加班",k=3)[0][0]=="c1"
+
+
+def test_rebuild(tmp_path):
+    idx=_index(tmp_path)
+    assert idx.rebuild([("n1","新的規定 加班","a.pdf"),("n2","其他","b.pdf")],batch_size=1)==2
+    assert idx.count()==2
+    assert [cid for cid,_ in idx.search("加班",k=3)]==["n1"]
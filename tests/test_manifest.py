@@ -0,0 +1,57 @@
+# tests/test_manifest.py
+"""Manifest 的 totals 表（trigger 維護）要跟 sources 表實際加總一致"""
+from manifest import Manifest
+
+
+def _actual(m:Manifest,collection:str)->dict:
+    rows=m.list_sources(collection)
+    return {"unique_sources":len(rows),"total_chunks":sum(r["chunks"] for r in rows)}
+
+
+def test_totals_follow_insert_update_delete(tmp_path):
+    m=Manifest(str(tmp_path/"manifest.sqlite3"))
+    assert m.totals("kb")=={"unique_sources":0,"total_chunks":0}
+
+    m.upsert("kb","a.pdf",chunks=10,pages=3,file_hash="h1")
+    m.upsert("kb","b.pdf",chunks=5,pages=1,file_hash="h2")
+    assert m.totals("kb")=={"unique_sources":2,"total_chunks":15}
+
+    # 重新匯入同一份（UPSERT）：文件數不變，chunk 數換成新的
+    m.upsert("kb","a.pdf",chunks=7,pages=3,file_hash="h3")
+    assert m.totals("kb")=={"unique_sources":2,"total_chunks":12}
+    assert m.get("kb","a.pdf")["file_hash"]=="h3"
+
+    m.remove("kb","b.pdf")
+    assert m.totals("kb")=={"unique_sources":1,"total_chunks":7}
+    # 刪不存在的不影響
+    m.remove("kb","nope.pdf")
+    assert m.totals("kb")==_actual(m,"kb")
+
+
+def test_totals_are_per_collection(tmp_path):
+    m=Manifest(str(tmp_path/"manifest.sqlite3"))
+    m.upsert("kb","a.pdf",chunks=4,pages=1)
+    m.upsert("other","a.pdf",chunks=9,pages=2)
+    assert m.totals("kb")=={"unique_sources":1,"total_chunks":4}
+    assert m.totals("other")=={"unique_sources":1,"total_chunks":9}
+
+    m.clear("kb")
+    assert m.totals("kb")=={"unique_sources":0,"total_chunks":0}
+    assert m.totals("other")=={"unique_sources":1,"total_chunks":9}
+    # clear 之後再加，從 0 開始算
+    m.upsert("kb","c.pdf",chunks=2,pages=1)
+    assert m.totals("kb")=={"unique_sources":1,"total_chunks":2}
+
+
+def test_rebuild_and_reopen(tmp_path):
+    path=str(tmp_path/"manifest.sqlite3")
+    m=Manifest(path)
+    m.upsert("kb","old.pdf",chunks=100,pages=10)
+    m.rebuild("kb",[{"source":"a.pdf","chunks":3,"pages":1},{"source":"b.pdf","chunks":6,"pages":2}])
+    assert m.totals("kb")=={"unique_sources":2,"total_chunks":9}
+    assert [r["source"] for r in m.list_sources("kb")]==["a.pdf","b.pdf"]
+    # 重開檔案不會重複建 trigger，totals 照舊
+    m2=Manifest(path)
+    m2.upsert("kb","c.pdf",chunks=1,pages=1)
+    assert m2.totals("kb")=={"unique_sources":3,"total_chunks":10}
+    assert m2.totals("kb")==_actual(m2,"kb")
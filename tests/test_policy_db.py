@@ -0,0 +1,57 @@
+# tests/test_policy_db.py
+"""policy_db（SQLite）：同一個 filename 上傳過新舊兩版時，匯入只讀最新那一筆；已匯入的 hash 不抓內容"""
+import sqlite3
+
+import policy_db
+
+
+def _upload(conn,tmp_path,version:str,content:bytes,name:str="leave.pdf")->str:
+    # 不同資料夾、同檔名：表裡的 filename 一樣，內容不同
+    path=tmp_path/version/name
+    path.parent.mkdir()
+    path.write_bytes(content)
+    policy_db.load_policy_files(conn,[str(path)])
+    return policy_db.sha256_file(str(path))
+
+
+def _conn(tmp_path)->sqlite3.Connection:
+    conn=sqlite3.connect(str(tmp_path/"policies.sqlite3"))
+    policy_db.ensure_table(conn)
+    return conn
+
+
+def test_newest_version_per_filename_is_ingested(tmp_path):
+    conn=_conn(tmp_path)
+    _upload(conn,tmp_path,"v1",b"%PDF old")
+    new=_upload(conn,tmp_path,"v2",b"%PDF new")
+    other=_upload(conn,tmp_path,"v3",b"%PDF other",name="travel.pdf")
+    assert policy_db.count_policies(conn)==3
+
+    stats={}
+    rows=sorted(policy_db.iter_policy_pdfs(conn,stats=stats))
+    assert rows==[("leave.pdf",new,b"%PDF new"),("travel.pdf",other,b"%PDF other")]
+    assert stats=={"rows":2,"skipped":0,"superseded":1}
+
+
+def test_known_hash_is_skipped_and_old_version_not_refetched(tmp_path):
+    conn=_conn(tmp_path)
+    old=_upload(conn,tmp_path,"v1",b"%PDF old")
+    new=_upload(conn,tmp_path,"v2",b"%PDF new")
+    # 新版已經在知識庫：什麼都不抓；舊版的 hash 不算（它已經被取代）
+    stats={}
+    assert list(policy_db.iter_policy_pdfs(conn,skip_hashes={new},stats=stats))==[]
+    assert stats=={"rows":1,"skipped":1,"superseded":1}
+    assert [h for _,h,_ in policy_db.iter_policy_pdfs(conn,skip_hashes={old})]==[new]
+
+
+def test_reupload_is_ignored_and_ensure_table_is_idempotent(tmp_path):
+    conn=_conn(tmp_path)
+    _upload(conn,tmp_path,"v1",b"%PDF old")
+    new=_upload(conn,tmp_path,"v2",b"%PDF new")
+    # 舊版同內容再傳一次：sha256 已存在，不會變成「最新」
+    stats={}
+    path=tmp_path/"v1"/"leave.pdf"
+    assert policy_db.load_policy_files(conn,[str(path)],stats=stats)==0
+    assert stats["skipped"]==1
+    policy_db.ensure_table(conn)
+    assert [h for _,h,_ in policy_db.iter_policy_pdfs(conn)]==[new]
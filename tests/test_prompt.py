@@ -0,0 +1,88 @@
+# tests/test_prompt.py
+"""build_prompt 的 context token 上限：截斷後（含補上的 "…"）不能超過 max_context_tokens；同頁相連的段落合併、去掉重複的 overlap"""
+import pytest
+
+import rag
+from rag import Hit
+from tokenizer import count_tokens
+
+_TEXT=(
+    "第十六條 員工因業務需要，應於預定加班日前填寫加班工作申請單，經單位主管及部門主管簽核，"
+    "總經理核准後送交管理部辦理後行之。Overtime requests must be approved in advance by managers. "
+    "一個月加班總時數不得超過46小時，加班費依勞基法第24條計算。"
+)
+
+
+def _hits(n:int=6):
+    # 不同頁：不會被合併，每段各自算 token
+    return [Hit(text=_TEXT*3,meta={"source":"policies/a.pdf","page":i,"chunk":0},distance=0.1*i,id=f"c{i}") for i in range(1,n+1)]
+
+
+@pytest.mark.parametrize("budget",[64,100,257,500,999])
+def test_context_tokens_within_budget(budget):
+    stats={}
+    rag.build_prompt("加班要申請嗎？",_hits(),max_context_tokens=budget,min_block_tokens=16,stats=stats)
+    assert stats["context_tokens"]<=budget
+    # 統計的數字要跟實際放進去的文字一致
+    assert stats["context_tokens"]==sum(count_tokens(h.text) for h in stats["hits"])
+
+
+@pytest.mark.parametrize("max_tokens",[1,2,5,17,40])
+def test_truncate_tokens_counts_ellipsis(max_tokens):
+    out=rag._truncate_tokens(_TEXT,max_tokens)
+    assert out.endswith("…")
+    assert count_tokens(out)<=max_tokens
+
+
+def test_truncate_tokens_keeps_short_text():
+    assert rag._truncate_tokens("加班",5)=="加班"
+    assert rag._truncate_tokens(_TEXT,0)==""
+
+
+def _page_hits(legacy:bool=False):
+    # 同一頁切成 6 段（跟 ingest 一樣），meta 帶 chunk / start / end / head；legacy=True 時沒有 head（舊資料）
+    page=rag._normalize_text(_TEXT*2)
+    chunks=rag._chunk_spans(page,chunk_size=60,overlap=15)
+    hits=[]
+    for i,c in enumerate(chunks):
+        meta={"source":"policies/a.pdf","page":3,"chunk":i,"start":c.start,"end":c.end}
+        if not legacy:
+            meta["head"]=c.head
+        hits.append(Hit(text=c.text,meta=meta,distance=0.1,id=f"p3-{i}"))
+    return chunks,hits
+
+
+@pytest.mark.parametrize("legacy",[False,True])
+def test_merge_adjacent_chunks_drops_overlap(legacy):
+    chunks,hits=_page_hits(legacy)
+    assert len(chunks)==6 and all(c.head>0 for c in chunks[1:])
+    # 排名亂序也一樣：依 chunk 編號接起來
+    merged=rag._merge_adjacent([hits[2],hits[0],hits[5],hits[1],hits[4],hits[3]])
+    assert len(merged)==1
+    block=merged[0]
+    assert block.text=="\n".join(c.text[c.head:] for c in chunks)
+    # 這句在頁面裡出現兩次；每段開頭的 overlap 沒去掉的話會變四次
+    assert block.text.count("經理核准後送交管理部辦理後行之")==2
+    assert "\n".join(c.text for c in chunks).count("經理核准後送交管理部辦理後行之")==4
+    assert (block.meta["chunk"],block.meta["chunk_last"],block.meta["start"],block.meta["end"])==(0,5,chunks[0].start,chunks[-1].end)
+    assert block.id=="p3-0"
+
+
+@pytest.mark.parametrize("legacy",[False,True])
+def test_merge_adjacent_keeps_rank_order_and_gaps(legacy):
+    chunks,hits=_page_hits(legacy)
+    other=Hit(text="第八條 病假全年不得超過30日。",meta={"source":"policies/b.pdf","page":1,"chunk":0},distance=0.05,id="b1")
+    # 0、1 相連；3 跟它們不相連，同一頁也要分開；其他頁的段落夾在中間
+    merged=rag._merge_adjacent([hits[3],other,hits[1],hits[0]])
+    assert [h.id for h in merged]==["p3-3","b1","p3-0"]
+    assert merged[0].text==chunks[3].text
+    assert merged[1].text==other.text
+    assert merged[2].text==chunks[0].text+"\n"+chunks[1].text[chunks[1].head:]
+    assert merged[2].meta["chunk_last"]==1
+
+
+def test_strip_overlap():
+    assert rag._strip_overlap("甲乙丙丁","丙丁\n戊己")=="戊己"
+    # 開頭不是上一段的結尾：原樣保留
+    assert rag._strip_overlap("甲乙丙丁","丙戊\n戊己")=="丙戊\n戊己"
+    assert rag._strip_overlap("甲乙丙丁","戊己")=="戊己"
@@ -0,0 +1,120 @@
+# tests/test_scheduler.py
+"""Scheduler：優先序、同優先序先來先做、老化、同時執行數上限"""
+import time
+import threading
+
+from scheduler import Scheduler,PRIORITY_QUERY,PRIORITY_CHAT,PRIORITY_INGEST
+
+
+def _wait_depth(s:Scheduler,n:int,timeout:float=5.0)->None:
+    end=time.time()+timeout
+    while s.stats()["depth"]<n:
+        assert time.time()<end,"排隊人數沒有到"
+        time.sleep(0.005)
+
+
+def _run_queued(s:Scheduler,requests,delay_between:float=0.0):
+    """
+    先佔住唯一的名額，依序排進 requests（(名字, priority)），放開後回傳實際執行順序
+    """
+    order=[]
+    release=threading.Event()
+
+    def hold():
+        with s.slot(PRIORITY_QUERY):
+            release.wait(timeout=5)
+
+    def req(name,priority):
+        with s.slot(priority):
+            order.append(name)
+
+    threads=[threading.Thread(target=hold)]
+    threads[0].start()
+    while s.stats()["running"]<1:
+        time.sleep(0.005)
+    for i,(name,priority) in enumerate(requests):
+        t=threading.Thread(target=req,args=(name,priority))
+        t.start()
+        threads.append(t)
+        _wait_depth(s,i+1)
+        time.sleep(delay_between)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+    return order
+
+
+def test_priority_order_then_fifo():
+    s=Scheduler(max_concurrent=1,aging_s=0)
+    order=_run_queued(s,[
+        ("ingest1",PRIORITY_INGEST),("chat1",PRIORITY_CHAT),("ingest2",PRIORITY_INGEST),
+        ("query1",PRIORITY_QUERY),("chat2",PRIORITY_CHAT),("query2",PRIORITY_QUERY),
+    ])
+    assert order==["query1","query2","chat1","chat2","ingest1","ingest2"]
+    st=s.stats()
+    assert st["depth"]==0 and st["running"]==0
+    assert st["by_priority"]["ingest_embed"]["requests"]==2
+
+
+def test_aging_lets_old_ingest_go_first():
+    # 匯入排了超過 2 個老化間隔，升到跟問題 embedding 同一級，又比較早來，所以先做
+    s=Scheduler(max_concurrent=1,aging_s=0.05)
+    order=_run_queued(s,[("ingest",PRIORITY_INGEST),("query",PRIORITY_QUERY)],delay_between=0.15)
+    assert order==["ingest","query"]
+
+
+def test_no_aging_is_strict():
+    s=Scheduler(max_concurrent=1,aging_s=0)
+    order=_run_queued(s,[("ingest",PRIORITY_INGEST),("query",PRIORITY_QUERY)],delay_between=0.15)
+    assert order==["query","ingest"]
+
+
+def test_positions_reported_while_queued():
+    s=Scheduler(max_concurrent=1,aging_s=0)
+    seen=[]
+    release=threading.Event()
+
+    def hold():
+        with s.slot(PRIORITY_QUERY):
+            release.wait(timeout=5)
+
+    h=threading.Thread(target=hold)
+    h.start()
+    while s.stats()["running"]<1:
+        time.sleep(0.005)
+
+    def req():
+        with s.slot(PRIORITY_CHAT,on_position=seen.append):
+            pass
+
+    t=threading.Thread(target=req)
+    t.start()
+    _wait_depth(s,1)
+    release.set()
+    t.join(timeout=5)
+    h.join(timeout=5)
+    assert seen==[1,0]
+
+
+def test_concurrency_limit():
+    s=Scheduler(max_concurrent=2,aging_s=0)
+    peak=[0]
+    lock=threading.Lock()
+    running=[0]
+
+    def req():
+        with s.slot(PRIORITY_CHAT):
+            with lock:
+                running[0]+=1
+                peak[0]=max(peak[0],running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0]-=1
+
+    threads=[threading.Thread(target=req) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert peak[0]==2
+    assert s.stats()["by_priority"]["chat"]["requests"]==8
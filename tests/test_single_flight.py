@@ -0,0 +1,44 @@
+# tests/test_single_flight.py
+"""SingleFlight：同一題同時只有一個帶頭跑，跟著的共用串流；帶頭的中斷時跟著的會收到 abort"""
+import threading
+
+from caches import SingleFlight
+
+
+def test_single_flight_follower_shares_leader_stream():
+    sf=SingleFlight()
+    key=("加班要申請嗎？",4)
+    flight,leader=sf.begin(key)
+    assert leader
+    same,leader2=sf.begin(key)
+    assert same is flight and not leader2
+
+    seen=[]
+    t=threading.Thread(target=lambda:seen.extend(same.stream(timeout=0.05)))
+    t.start()
+    flight.publish("要，")
+    flight.publish("事前申請。")
+    flight.finish({"answer":"要，事前申請。"})
+    sf.end(key,flight)
+    t.join(timeout=5)
+
+    assert "".join(seen)=="要，事前申請。"
+    assert same.result=={"answer":"要，事前申請。"} and not same.aborted
+    assert sf.stats()=={"in_flight":0,"leaders":1,"shared":1}
+    # 跑完之後同一個問題會有新的帶頭者
+    _,leader3=sf.begin(key)
+    assert leader3
+
+
+def test_single_flight_leader_interrupted_aborts_followers():
+    sf=SingleFlight()
+    key=("q",)
+    flight,_=sf.begin(key)
+    follower,leader=sf.begin(key)
+    assert not leader
+    flight.publish("半")
+    # 帶頭的沒有 finish 就結束（例如 rerun）
+    sf.end(key,flight)
+    assert follower.wait(timeout=1)
+    assert follower.aborted and follower.result is None
+    assert list(follower.stream(timeout=0.05))==["半"]
@@ -0,0 +1,104 @@
+# tests/test_vector_store.py
+"""VectorStore：量化後重算的排名、刪除補洞後 SQLite 與 .f32 的列號一致、重開載入、.f32 壞掉時清空"""
+import os
+
+import numpy as np
+import pytest
+
+from vector_store import VectorStore,quantize
+
+
+def _unit(n:int,dim:int=32,seed:int=0)->np.ndarray:
+    v=np.random.default_rng(seed).standard_normal((n,dim)).astype(np.float32)
+    return v/np.linalg.norm(v,axis=1,keepdims=True)
+
+
+def _exact(vecs,ids,q,k):
+    s=vecs@q
+    return [ids[i] for i in np.argsort(-s)[:k]]
+
+
+@pytest.mark.parametrize("dtype",["int8","float16"])
+def test_quantize_roundtrip(dtype):
+    v=_unit(50)
+    q,scale=quantize(v,dtype)
+    assert q.dtype==np.dtype(dtype)
+    back=q.astype(np.float32)*scale[:,None]
+    assert np.abs(back-v).max()<0.01
+
+
+@pytest.mark.parametrize("dtype",["int8","float16","float32"])
+def test_search_matches_exact_after_rescore(tmp_path,dtype):
+    vecs=_unit(500)
+    ids=[f"c{i}" for i in range(500)]
+    vs=VectorStore(str(tmp_path/"vectors.sqlite3"),dtype=dtype,rescore=4)
+    vs.add(ids,vecs,["a.pdf"]*500)
+    for q in _unit(10,seed=1):
+        hits=vs.search(q,k=5)
+        assert [cid for cid,_ in hits]==_exact(vecs,ids,q,5)
+        # 回傳的是 float32 精確的 cosine
+        assert hits[0][1]==pytest.approx(float(vecs[ids.index(hits[0][0])]@q),abs=1e-5)
+
+
+def test_delete_keeps_rows_consistent_across_reopen(tmp_path):
+    path=str(tmp_path/"vectors.sqlite3")
+    vecs=_unit(40)
+    ids=[f"c{i}" for i in range(40)]
+    vs=VectorStore(path,dtype="int8")
+    vs.add(ids[:20],vecs[:20],["a.pdf"]*20)
+    vs.add(ids[20:],vecs[20:],["b.pdf"]*20)
+    assert vs.delete_ids(["c0","c5","missing"])==2
+    assert vs.delete_source("b.pdf")==20
+    # 同 ID 覆蓋
+    vs.add(["c1"],vecs[39:40],["a.pdf"])
+    keep=[cid for cid in ids[:20] if cid not in ("c0","c5")]
+    expected={cid:vecs[ids.index(cid)] for cid in keep}
+    expected["c1"]=vecs[39]
+
+    for store in (vs,VectorStore(path,dtype="int8")):
+        assert store.count()==len(keep)
+        assert sorted(store.ids())==sorted(keep)
+        got=store.get_vectors(keep)
+        for cid,v in zip(keep,got):
+            np.testing.assert_array_equal(v,expected[cid])
+        # 每個向量都查得到自己
+        for cid in keep:
+            assert store.search(expected[cid],k=1)[0][0]==cid
+
+
+def test_float32_vectors_live_only_on_disk(tmp_path):
+    path=str(tmp_path/"vectors.sqlite3")
+    VectorStore(path,dtype="int8").add([f"c{i}" for i in range(100)],_unit(100),["a.pdf"]*100)
+    # 重開（不含寫入時的預留）：記憶體裡只有 int8 矩陣 + 每列一個 scale；float32 在 .f32（memmap）
+    vs=VectorStore(path,dtype="int8")
+    assert vs.stats()["ram_bytes"]==100*32+100*4
+    assert os.path.getsize(vs.raw_path)>=100*32*4
+    cols=[r[1] for r in vs._conn.execute("PRAGMA table_info(vectors)")]
+    assert "vec" not in cols
+
+
+def test_truncated_raw_file_clears_store(tmp_path):
+    path=str(tmp_path/"vectors.sqlite3")
+    vs=VectorStore(path,dtype="int8")
+    vs.add(["a","b"],_unit(2),["a.pdf"]*2)
+    raw=vs.raw_path
+    del vs
+    with open(raw,"r+b") as f:
+        f.truncate(10)
+    vs=VectorStore(path,dtype="int8")
+    assert vs.count()==0 and vs.search(_unit(1)[0],k=3)==[]
+    # 清空後可以照常加回來（rag.sync_vector_store 會這樣補）
+    vs.add(["a"],_unit(1),["a.pdf"])
+    assert vs.count()==1
+
+
+def test_dimension_mismatch(tmp_path):
+    vs=VectorStore(str(tmp_path/"vectors.sqlite3"))
+    vs.add(["a"],_unit(1,dim=8),["a.pdf"])
+    with pytest.raises(ValueError):
+        vs.add(["b"],_unit(1,dim=16),["a.pdf"])
+    with pytest.raises(ValueError):
+        vs.search(np.ones(16,dtype=np.float32),k=1)
+    vs.clear()
+    vs.add(["b"],_unit(1,dim=16),["a.pdf"])
+    assert vs.stats()["dim"]==16
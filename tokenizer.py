@@ -0,0 +1,45 @@
+# tokenizer.py
+"""
+本機 token 估算（不用連 Ollama、不用下載模型檔）
+
+這不是模型的 tokenizer，只是用正規表示式數的近似值，也還沒對 llama3.1 / nomic 的 tokenizer 校正過：
+- 中日韓字元：一字一 token
+- 英文字母：一個字 ≈ 每 4 個字母一個 token
+- 數字：每 1~3 位一個 token
+- 其他標點/符號：一個一 token；空白不算（會併進相鄰 token）
+
+已知會偏的地方：BPE 會把常見的中文詞、英文字合成一個 token（實際比估的少），
+罕用字會拆成好幾個 byte token（實際比估的多）。所以「token 切段」、context 上限都是估算值，
+不是模型實際的 token 數，設定時要留餘裕。
+實際差多少：python -m benchmarks.bench_prompt --real 會印出估算跟 Ollama 回報的 prompt_eval_count 的比值
+"""
+import re
+from typing import List, Tuple, Optional
+
+# 中日韓字元跟標點一樣落在最後一類：一字一 token
+_TOKEN_RE=re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+_WORD_RE=re.compile(r"[A-Za-z]{5,}")
+_WORD_PIECE=4
+
+
+def token_spans(text:str,start:int=0,end:Optional[int]=None)->List[Tuple[int,int]]:
+    """text[start:end] 每個 token 的 [a,b) 位置（英文長字會切成每 4 個字母一段）"""
+    end=len(text) if end is None else end
+    out=[]
+    for m in _TOKEN_RE.finditer(text,start,end):
+        a,b=m.span()
+        if b-a>_WORD_PIECE and text[a].isascii() and text[a].isalpha():
+            for x in range(a,b,_WORD_PIECE):
+                out.append((x,min(b,x+_WORD_PIECE)))
+        else:
+            out.append((a,b))
+    return out
+
+
+def count_tokens(text:str)->int:
+    # 跟 len(token_spans(text)) 一樣，但用 findall 在 C 裡數，快很多
+    text=text or ""
+    n=len(_TOKEN_RE.findall(text))
+    for w in _WORD_RE.findall(text):
+        n+=(len(w)+_WORD_PIECE-1)//_WORD_PIECE-1
+    return n
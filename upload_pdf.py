@@ -1,54 +1,63 @@
+# upload_pdf.py
+"""
+把資料夾裡的 PDF 原檔存進 Postgres 的 SIM_policies 表（之後可以用 ingest_cli.py --from-db 匯入知識庫）
+
+- 資料夾：參數 > POLICIES_DIR 環境變數 > KnowledgeBase/policies
+- 一份一份讀：先算 hash，已經在表裡的不讀內容；要寫的湊一批（--batch-mb）用 execute_values 寫入
+- 連線參數讀 PG* 環境變數 / .env；--sqlite PATH 改寫進 SQLite 檔（沒有 Postgres 時測試用）
+
+用法：
+    python upload_pdf.py
+    python upload_pdf.py D:\\Sandy\\RAG_Llama\\policies --batch-mb 32
+"""
 import os
-import hashlib
+import sys
+import argparse
 from pathlib import Path
 
-import psycopg2
-from psycopg2.extras import execute_batch
-from dotenv import load_dotenv
+import policy_db
+from config import KB_DIR
+
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("folder",nargs="?",default=os.getenv("POLICIES_DIR",str(KB_DIR/"policies")))
+    ap.add_argument("--pattern",default="*",help="rglob 樣式（預設所有檔案）")
+    ap.add_argument("--batch-mb",type=float,default=64.0,help="每批寫入最多幾 MB")
+    ap.add_argument("--sqlite",metavar="PATH",help="寫進 SQLite 檔而不是 Postgres（測試用）")
+    args=ap.parse_args(argv)
+
+    folder=Path(args.folder)
+    if not folder.exists():
+        print(f"Folder not found: {folder}",file=sys.stderr)
+        return 2
+    # generator：邊走資料夾邊處理，不會先把所有檔案列出來或讀進記憶體（所以不排序，順序照檔案系統）
+    paths=(str(p) for p in folder.rglob(args.pattern) if p.is_file())
+
+    stats={}
+    if args.sqlite:
+        import sqlite3
+        conn=sqlite3.connect(args.sqlite)
+        try:
+            policy_db.ensure_table(conn)
+            policy_db.load_policy_files(conn,paths,batch_bytes=int(args.batch_mb*1024*1024),stats=stats)
+            total=policy_db.count_policies(conn)
+        finally:
+            conn.close()
+    else:
+        pool=policy_db.get_pool(maxconn=1)
+        try:
+            with policy_db.pooled(pool) as conn:
+                policy_db.ensure_table(conn)
+                policy_db.load_policy_files(conn,paths,batch_bytes=int(args.batch_mb*1024*1024),stats=stats)
+                total=policy_db.count_policies(conn)
+        finally:
+            pool.closeall()
+
+    print(f"Found {stats['files']} files: inserted {stats['inserted']}, already in table {stats['skipped']} ({stats['bytes']/1024/1024:.1f} MB read)")
+    print("Total rows in SIM_policies:",total)
+    return 0
 
-load_dotenv()
-
-POLICIES_DIR=Path(r"D:\Sandy\RAG_Llama\policies")
-CONTENT_COL="file_content"  # 若你的欄位叫 pdf_content 就改這行
-
-def sha256_bytes(b:bytes)->str:
-    return hashlib.sha256(b).hexdigest()
-
-def main():
-    if not POLICIES_DIR.exists():
-        raise FileNotFoundError(f"Folder not found: {POLICIES_DIR}")
-
-    conn=psycopg2.connect(
-        host=os.getenv("PGHOST","localhost"),
-        port=int(os.getenv("PGPORT","5432")),
-        dbname=os.getenv("PGDATABASE","RAG_Llama"),
-        user=os.getenv("PGUSER","postgres"),
-        password=os.getenv("PGPASSWORD"),
-    )
-    cur=conn.cursor()
-
-    sql=f'''
-    INSERT INTO public."SIM_policies"(filename,sha256,{CONTENT_COL})
-    VALUES (%s,%s,%s)
-    ON CONFLICT (sha256) DO NOTHING
-    '''
-
-    rows=[]
-    for p in POLICIES_DIR.rglob("*"):
-        if p.is_file():
-            b=p.read_bytes()
-            rows.append((p.name,sha256_bytes(b),psycopg2.Binary(b)))
-
-    print("Found",len(rows),"files")
-
-    execute_batch(cur,sql,rows,page_size=50)
-    conn.commit()
-
-    cur.execute('SELECT COUNT(*) FROM public."SIM_policies";')
-    print("Total rows in SIM_policies:",cur.fetchone()[0])
-
-    cur.close()
-    conn.close()
 
 if __name__=="__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# vector_store.py
+"""
+壓縮的向量索引：開了之後它是知識庫唯一的向量存放處（Chroma 只剩文字與 metadata，見 rag.open_collection）
+
+- 記憶體只放 int8 / float16 的矩陣（約 float32 的 1/4、1/2），查詢時先用它挑候選
+- float32 原始向量只為了精確重算而存在：放在 <path 去掉副檔名>.f32（每列 dim 個 float32），用 np.memmap 讀，
+  重算時只會碰到候選那幾列的頁面，不佔 process 的記憶體；dtype="float32" 時不另外壓縮，直接在 memmap 上算
+- SQLite 檔只記 chunk_id、source、在 .f32 裡第幾列（跟記憶體矩陣同一列）；刪除時拿最後一列補洞，兩邊都保持連續
+- int8：每個向量一個 scale 的對稱量化（v ≈ q * scale），float16：直接轉型
+- 查詢：壓縮矩陣分段跟問題向量做內積（分段才不會一次把整個矩陣轉成 float32），
+  取前 k*rescore 筆候選 → 從 memmap 讀這些候選的 float32 向量 → 精確內積排序，回傳前 k 筆
+- 向量都是 L2 正規化過的（rag._l2_normalize / Ollama /api/embed），內積就是 cosine
+- chunk ID 跟 Chroma 一樣，由 rag.py 的匯入/刪除維護；兩邊段數對不起來時用 rag.sync_vector_store 補齊
+- 同一個物件可以給多個 thread 共用（內部有鎖）
+"""
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+
+DTYPES=("int8","float16","float32")
+
+
+def quantize(vecs:np.ndarray,dtype:str)->Tuple[np.ndarray,np.ndarray]:
+    """
+    (n, d) float32 → (壓縮後的矩陣, 每列的 scale)；還原是 q.astype(float32) * scale[:,None]
+    """
+    vecs=np.asarray(vecs,dtype=np.float32)
+    if vecs.ndim==1:
+        vecs=vecs[None,:]
+    ones=np.ones(len(vecs),dtype=np.float32)
+    if dtype=="float32":
+        return vecs.copy(),ones
+    if dtype=="float16":
+        return vecs.astype(np.float16),ones
+    if dtype=="int8":
+        scale=np.abs(vecs).max(axis=1)/127.0
+        scale[scale==0]=1.0
+        q=np.rint(vecs/scale[:,None]).clip(-127,127).astype(np.int8)
+        return q,scale.astype(np.float32)
+    raise ValueError(f"unknown dtype: {dtype}（可用 {', '.join(DTYPES)}）")
+
+
+class VectorStore:
+    """
+    path：SQLite 檔（chunk_id → 列號）；float32 原始向量在同名的 .f32
+    dtype：記憶體裡的矩陣格式（int8 / float16 / float32）；換 dtype 重開就好，磁碟上永遠是 float32
+    rescore：壓縮矩陣先挑 k*rescore 筆候選，再用 float32 精確重算
+    block_rows：查詢時每段幾列；每段轉成 float32 的暫存要放得進 CPU 快取（768 維 × 4096 列約 12MB），太大反而慢
+    """
+
+    def __init__(self,path:str,dtype:str="int8",rescore:int=4,block_rows:int=4096):
+        if dtype not in DTYPES:
+            raise ValueError(f"unknown dtype: {dtype}（可用 {', '.join(DTYPES)}）")
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path=path
+        self.raw_path=os.path.splitext(path)[0]+".f32"
+        self.dtype=dtype
+        self.rescore=max(1,int(rescore))
+        self.block_rows=max(1,int(block_rows))
+        self._quantized=dtype!="float32"
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        cols=[r[1] for r in self._conn.execute("PRAGMA table_info(vectors)")]
+        if "vec" in cols:
+            # 舊格式（float32 存在 SQLite 裡）：丟掉，由 rag.sync_vector_store 補回來
+            self._conn.execute("DROP TABLE vectors")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS vectors(
+                chunk_id TEXT PRIMARY KEY,source TEXT NOT NULL,row INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_vectors_source ON vectors(source);
+            CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY,value TEXT NOT NULL);
+            """
+        )
+        self._conn.commit()
+        self._raw=None
+        self._reset_memory()
+        self._load()
+
+    # ---- 記憶體裡的矩陣與 .f32：前 _n 列有效，刪除時拿最後一列補洞 ----
+
+    def _reset_memory(self,dim:int=0)->None:
+        self._dim=dim
+        self._n=0
+        self._ids:List[str]=[]
+        self._row:Dict[str,int]={}
+        self._raw=None
+        self._mat=np.zeros((0,dim),dtype=self.dtype)
+        self._scale=np.zeros(0,dtype=np.float32)
+
+    def _map_raw_locked(self,rows:int)->None:
+        # .f32 至少 rows 列；先放掉舊的 memmap（Windows 上有 mmap 開著不能改檔案長度）再重新 map
+        self._raw=None
+        if not self._quantized:
+            self._mat=np.zeros((0,self._dim),dtype=np.float32)
+        need=rows*self._dim*4
+        with open(self.raw_path,"ab") as f:
+            if f.tell()<need:
+                f.truncate(need)
+        size=os.path.getsize(self.raw_path)//(self._dim*4)
+        self._raw=np.memmap(self.raw_path,dtype=np.float32,mode="r+",shape=(size,self._dim))
+        if not self._quantized:
+            self._mat=self._raw
+
+    def _reserve_locked(self,n:int,dim:int)->None:
+        if self._dim==0:
+            self._reset_memory(dim)
+            self._conn.execute("INSERT OR REPLACE INTO meta(key,value) VALUES ('dim',?)",(str(dim),))
+        elif dim!=self._dim:
+            raise ValueError(f"embedding 維度 {dim} 跟索引裡的 {self._dim} 不同（換了 embed 模型就要重建）")
+        cap=0 if self._raw is None else len(self._raw)
+        if n>cap:
+            self._map_raw_locked(max(n,1024,cap*2))
+        if not self._quantized:
+            return
+        cap=len(self._mat)
+        if n<=cap:
+            return
+        cap=max(n,1024,cap*2)
+        mat=np.zeros((cap,self._dim),dtype=self.dtype)
+        scale=np.zeros(cap,dtype=np.float32)
+        mat[:self._n]=self._mat[:self._n]
+        scale[:self._n]=self._scale[:self._n]
+        self._mat,self._scale=mat,scale
+
+    def _put_locked(self,ids:List[str],vecs:np.ndarray)->List[int]:
+        self._reserve_locked(self._n+len(ids),vecs.shape[1])
+        rows=[]
+        for cid in ids:
+            r=self._row.get(cid)
+            if r is None:
+                r=self._n
+                self._n+=1
+                self._ids.append(cid)
+                self._row[cid]=r
+            rows.append(r)
+        self._raw[rows]=vecs
+        if self._quantized:
+            q,scale=quantize(vecs,self.dtype)
+            self._mat[rows]=q
+            self._scale[rows]=scale
+        return rows
+
+    def _drop_locked(self,ids:Iterable[str])->Tuple[int,Dict[str,int]]:
+        # 回傳 (刪掉幾筆, 被搬去補洞的 chunk_id → 新列號)
+        n=0
+        moved=set()
+        for cid in ids:
+            r=self._row.pop(cid,None)
+            if r is None:
+                continue
+            last=self._n-1
+            if r!=last:
+                m=self._ids[last]
+                self._ids[r]=m
+                self._row[m]=r
+                self._raw[r]=self._raw[last]
+                if self._quantized:
+                    self._mat[r]=self._mat[last]
+                    self._scale[r]=self._scale[last]
+                moved.add(m)
+            self._ids.pop()
+            self._n-=1
+            n+=1
+        return n,{m:self._row[m] for m in moved if m in self._row}
+
+    def _load(self,batch_size:int=4096)->None:
+        row=self._conn.execute("SELECT value FROM meta WHERE key='dim'").fetchone()
+        dim=int(row[0]) if row else 0
+        rows=self._conn.execute("SELECT chunk_id,row FROM vectors ORDER BY row").fetchall()
+        if not rows or not dim:
+            return
+        n=len(rows)
+        try:
+            size=os.path.getsize(self.raw_path)
+        except OSError:
+            size=0
+        if rows[-1][1]!=n-1 or size<n*dim*4:
+            # 列號不連續或 .f32 不見/被截斷：對不起來的資料不用，清空後由 rag.sync_vector_store 補
+            self.clear()
+            return
+        with self._lock:
+            self._reset_memory(dim)
+            self._map_raw_locked(n)
+            self._ids=[cid for cid,_ in rows]
+            self._row={cid:i for i,cid in enumerate(self._ids)}
+            self._n=n
+            if self._quantized:
+                # 筆數已知：一次配好，不用倍增預留；一段一段從 memmap 量化，記憶體峰值只多一段 float32
+                self._mat=np.zeros((n,dim),dtype=self.dtype)
+                self._scale=np.zeros(n,dtype=np.float32)
+                for i in range(0,n,batch_size):
+                    j=min(n,i+batch_size)
+                    self._mat[i:j],self._scale[i:j]=quantize(self._raw[i:j],self.dtype)
+
+    # ---- 寫入 / 刪除（rag.py 呼叫）----
+
+    def add(self,ids:List[str],embs,sources:List[str])->None:
+        """新增（同 ID 已存在就覆蓋）；embs 是 (n, d) 的 float32 陣列或 list"""
+        if not len(ids):
+            return
+        vecs=np.asarray(embs,dtype=np.float32)
+        with self._lock:
+            # 先寫 .f32 再 commit 列號：中途當掉時 SQLite 還是指向舊的（仍然有效的）列
+            rows=self._put_locked(list(ids),vecs)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors(chunk_id,source,row) VALUES (?,?,?)",
+                list(zip(ids,sources,rows)),
+            )
+            self._conn.commit()
+
+    def _delete_locked(self,ids:List[str])->int:
+        n,moved=self._drop_locked(ids)
+        for i in range(0,len(ids),500):
+            part=ids[i:i+500]
+            self._conn.execute(f"DELETE FROM vectors WHERE chunk_id IN ({','.join('?'*len(part))})",part)
+        self._conn.executemany("UPDATE vectors SET row=? WHERE chunk_id=?",[(r,cid) for cid,r in moved.items()])
+        self._conn.commit()
+        return n
+
+    def delete_ids(self,ids:List[str])->int:
+        with self._lock:
+            return self._delete_locked(list(ids))
+
+    def delete_source(self,source:str)->int:
+        with self._lock:
+            ids=[r[0] for r in self._conn.execute("SELECT chunk_id FROM vectors WHERE source=?",(source,))]
+            return self._delete_locked(ids)
+
+    def clear(self)->None:
+        with self._lock:
+            self._conn.execute("DELETE FROM vectors")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.commit()
+            self._reset_memory()
+            if os.path.exists(self.raw_path):
+                with open(self.raw_path,"r+b") as f:
+                    f.truncate(0)
+
+    def count(self)->int:
+        with self._lock:
+            return self._n
+
+    def ids(self)->List[str]:
+        with self._lock:
+            return list(self._ids)
+
+    def get_vectors(self,ids:List[str])->np.ndarray:
+        """ids 的 float32 原始向量 (n, d)；沒有的 ID 會丟 KeyError"""
+        with self._lock:
+            if not ids:
+                return np.zeros((0,self._dim),dtype=np.float32)
+            return np.asarray(self._raw[[self._row[cid] for cid in ids]])
+
+    def rebuild(self,items:Iterable[Tuple[str,str,List[float]]],batch_size:int=1000)->int:
+        """整個重建：items 是 (chunk_id, source, embedding)；回傳筆數"""
+        self.clear()
+        n=0
+        buf=[]
+        for it in items:
+            buf.append(it)
+            if len(buf)>=batch_size:
+                self.add([x[0] for x in buf],[x[2] for x in buf],[x[1] for x in buf])
+                n+=len(buf)
+                buf=[]
+        if buf:
+            self.add([x[0] for x in buf],[x[2] for x in buf],[x[1] for x in buf])
+            n+=len(buf)
+        return n
+
+    # ---- 查詢 ----
+
+    def search(self,query,k:int=6,candidates:Optional[int]=None)->List[Tuple[str,float]]:
+        """
+        回傳 [(chunk_id, cosine)]，由高到低
+        candidates：壓縮矩陣挑幾筆候選去精確重算；不給就是 k*rescore
+        """
+        qv=np.asarray(query,dtype=np.float32).ravel()
+        k=int(k)
+        with self._lock:
+            n=self._n
+            if n==0 or k<=0:
+                return []
+            if qv.shape[0]!=self._dim:
+                raise ValueError(f"問題向量維度 {qv.shape[0]} 跟索引裡的 {self._dim} 不同")
+            scores=np.empty(n,dtype=np.float32)
+            for i in range(0,n,self.block_rows):
+                j=min(n,i+self.block_rows)
+                s=self._mat[i:j].astype(np.float32,copy=False)@qv
+                scores[i:j]=s*self._scale[i:j] if self._quantized else s
+            c=min(n,max(k,int(candidates or k*self.rescore)) if self._quantized else k)
+            top=np.argpartition(-scores,c-1)[:c] if c<n else np.arange(n)
+            if not self._quantized:
+                ranked=sorted(zip((self._ids[r] for r in top),scores[top].tolist()),key=lambda x:-x[1])
+                return ranked[:k]
+            # 列號排序後再讀 memmap，比較接近循序讀
+            top=np.sort(top)
+            cand=[self._ids[r] for r in top]
+            exact=np.asarray(self._raw[top])@qv
+        ranked=sorted(zip(cand,exact.tolist()),key=lambda x:-x[1])
+        return ranked[:k]
+
+    def stats(self)->Dict:
+        """
+        count、dim、dtype
+        ram_bytes：常駐記憶體的矩陣 + scale（含預留的空間）；float32 時查詢每次都掃整個 .f32，算成有效的 n×d×4
+        disk_bytes：SQLite 檔 + .f32（.f32 含預留的空間）
+        """
+        with self._lock:
+            if self._quantized:
+                ram=int(self._mat.nbytes+self._scale.nbytes)
+            else:
+                ram=self._n*self._dim*4
+            out={"count":self._n,"dim":self._dim,"dtype":self.dtype,"ram_bytes":ram}
+        disk=0
+        for p in (self.path,self.path+"-wal",self.raw_path):
+            try:
+                disk+=os.path.getsize(p)
+            except OSError:
+                pass
+        out["disk_bytes"]=disk
+        return out